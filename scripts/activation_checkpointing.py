@@ -0,0 +1,69 @@
+"""
+Activation (gradient) checkpointing for the BERT encoder.
+
+By default, the backward pass needs the activations of every encoder layer, which are kept from the forward pass.
+`enable_activation_checkpointing` splits the encoder layers into segments of `every` layers and keeps only the input
+of each segment; the activations inside a segment are recomputed during the backward pass. This trades one more
+forward pass through the encoder for memory that grows with the number of segments instead of the number of layers.
+The parameters are not touched, so checkpoints of the model load either way.
+"""
+
+import inspect
+
+import torch
+from torch import nn
+from torch.utils.checkpoint import checkpoint
+
+
+def _checkpoint(function, hidden_states, *inputs):
+    # Non-reentrant checkpointing also computes parameter gradients if no input requires a gradient (e.g. with
+    # frozen embeddings, or the cached output of frozen layers)
+    if "use_reentrant" in inspect.signature(checkpoint).parameters:
+        return checkpoint(function, hidden_states, *inputs, use_reentrant=False)
+    # Reentrant checkpointing (torch < 1.11) does not, so the hidden states are made to require one
+    if not hidden_states.requires_grad:
+        hidden_states = hidden_states.detach().requires_grad_()
+    return checkpoint(function, hidden_states, *inputs)
+
+
+class CheckpointedEncoder(nn.Module):
+    """Drop-in replacement of a `BertEncoder` that recomputes the activations of `every` layers at a time."""
+
+    def __init__(self, encoder, every=1):
+        super().__init__()
+        if every < 1:
+            raise ValueError("Segments need at least one layer, got {}".format(every))
+        self.layer = encoder.layer
+        self.every = every
+
+    def _segment(self, start):
+        def forward(hidden_states, attention_mask):
+            for layer_module in self.layer[start:start + self.every]:
+                hidden_states = layer_module(hidden_states, attention_mask)
+            return hidden_states
+        return forward
+
+    def forward(self, hidden_states, attention_mask, output_all_encoded_layers=True, start=0):
+        """Like `BertEncoder.forward`; `hidden_states` can also be the output of layer `start` - 1."""
+        all_encoder_layers = []
+        recompute = torch.is_grad_enabled() and not output_all_encoded_layers
+        for first in range(start, len(self.layer), self.every if recompute else 1):
+            if recompute:
+                hidden_states = _checkpoint(self._segment(first), hidden_states, attention_mask)
+            else:
+                hidden_states = self.layer[first](hidden_states, attention_mask)
+                if output_all_encoded_layers:
+                    all_encoder_layers.append(hidden_states)
+        if not output_all_encoded_layers:
+            all_encoder_layers.append(hidden_states)
+        return all_encoder_layers
+
+
+def enable_activation_checkpointing(bert, every=1):
+    """Checkpoint the encoder layers of the `BertModel` `bert` in segments of `every` layers; 0 leaves it as is."""
+    if every <= 0:
+        return
+    if isinstance(bert.encoder, CheckpointedEncoder):
+        bert.encoder.every = every
+    else:
+        bert.encoder = CheckpointedEncoder(bert.encoder, every)
@@ -63,7 +63,7 @@ class TokenLanguageDiscriminator(nn.Module):
         language_preds = scores.argmax(dim=2)
         language_preds = language_preds.reshape(-1)
         if len(language):
-            return float(torch.sum(language_preds == language.repeat(scores.shape[1]))) / language_preds.numel()
+            return (language_preds == language.repeat(scores.shape[1])).float().mean()
         else:
             return 0
 
@@ -0,0 +1,83 @@
+"""
+Evaluation in a separate process.
+
+With --async_evaluation, the evaluation of --evaluate_each_epoch does not stop training. The trainer saves the
+weights of the epoch as a snapshot (in the background, with `CheckpointManager.save_file`), and `AsyncEvaluator`
+hands the snapshot to a worker process, which loads it into its own copy of the model and runs the same evaluation
+function as the synchronous path. The trainer collects the results with `poll` after every epoch and with `close`
+at the end, in epoch order, and uses them for best-model selection and early stopping.
+
+The worker evaluates on the device of the trainer, in the precision that `make_model` gives the model, so its results
+are the ones the synchronous path would get. It is started with the "spawn" method: the trainer has initialized CUDA
+and started threads (data loaders, checkpoint and metrics writers) by then, and neither survives a fork. `evaluate`
+and `make_model` are therefore pickled, so they have to be module-level functions or `functools.partial`s of them.
+"""
+
+import logging
+import multiprocessing
+import queue
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def _work(evaluate, make_model, device, requests, results):
+    model = make_model().to(device)
+    while True:
+        request = requests.get()
+        if request is None:
+            results.put(None)
+            return
+        epoch, step, path = request
+        try:
+            model.load_state_dict(torch.load(path, map_location=device))
+            result = evaluate(model, device)
+        except Exception:
+            logger.exception("Could not evaluate %s", path)
+            result = None
+        results.put((epoch, step, result, path))
+
+
+class AsyncEvaluator:
+    """
+    Runs `evaluate(model, device)` on snapshots of the model weights in a worker process. `make_model()` builds the
+    model that the snapshots are loaded into, on `device` (the CPU by default). Results are tuples (epoch, step,
+    result of `evaluate`, snapshot path); the result is None if the evaluation failed.
+    """
+
+    def __init__(self, evaluate, make_model, device=None):
+        context = multiprocessing.get_context("spawn")
+        device = device if device is not None else torch.device("cpu")
+        self._requests = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(target=_work,
+                                        args=(evaluate, make_model, device, self._requests, self._results),
+                                        daemon=True)
+        self._process.start()
+
+    def submit(self, epoch, step, path):
+        """Evaluate the weights in `path`, saved after `epoch` at metrics step `step`."""
+        self._requests.put((epoch, step, path))
+
+    def poll(self):
+        """The results that are ready, without waiting for the others."""
+        results = []
+        while True:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                return results
+            results.append(result)
+
+    def close(self):
+        """Wait for the evaluation of all submitted snapshots and return the results that were not polled yet."""
+        self._requests.put(None)
+        results = []
+        while True:
+            result = self._results.get()
+            if result is None:
+                break
+            results.append(result)
+        self._process.join()
+        return results
@@ -0,0 +1,282 @@
+"""
+Length-bucketed batching with dynamic padding.
+
+Features are zero-padded to --max_seq_length when they are created. With dynamic padding, every batch is trimmed to
+its longest member and batches are formed from sentences of similar length, so that little compute is spent on pads.
+"""
+
+import inspect
+import logging
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.data.dataloader import default_collate
+
+logger = logging.getLogger(__name__)
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Batch sampler that draws indices from an underlying sampler (e.g. RandomSampler or DistributedSampler),
+    sorts pools of `bucket_size` batches by length and cuts them into batches. The batches of all pools are
+    shuffled, so the order across buckets stays random.
+
+    If `max_tokens` is given, a batch is closed as soon as its padded size (number of sentences times the length
+    of the longest sentence) would exceed the budget; `batch_size` remains an upper bound on the number of sentences.
+
+    With a `seed`, the batches are shuffled with their own random state instead of the global torch RNG, and a
+    pass can start in the middle (see `set_position`).
+    """
+
+    def __init__(self, sampler, lengths, batch_size, max_tokens=None, bucket_size=100, seed=None):
+        self.sampler = sampler
+        self.lengths = [int(length) for length in lengths]
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.bucket_size = bucket_size
+        self.seed = seed
+        self.epoch = 0
+        self.skip = 0
+
+    def _make_batches(self, pool):
+        pool = sorted(pool, key=lambda index: self.lengths[index])
+        batches = []
+        batch = []
+        for index in pool:
+            if batch and self._is_full(batch, self.lengths[index]):
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _is_full(self, batch, next_length):
+        if len(batch) >= self.batch_size:
+            return True
+        if self.max_tokens is not None:
+            # The pool is sorted, so the next sentence is the longest one in the extended batch
+            return (len(batch) + 1) * next_length > self.max_tokens
+        return False
+
+    def _iter_pools(self, indices):
+        pool_size = self.batch_size * self.bucket_size
+        pool = []
+        for index in indices:
+            pool.append(index)
+            if len(pool) == pool_size:
+                yield pool
+                pool = []
+        if pool:
+            yield pool
+
+    def __iter__(self):
+        batches = []
+        for pool in self._iter_pools(self.sampler):
+            batches += self._make_batches(pool)
+        if self.seed is None:
+            order = torch.randperm(len(batches)).tolist()
+        else:
+            order = np.random.RandomState((self.seed + self.epoch) % 2 ** 32).permutation(len(batches)).tolist()
+            self.epoch += 1
+        order, self.skip = order[self.skip:], 0
+        return iter([batches[i] for i in order])
+
+    def __len__(self):
+        if self.max_tokens is None:
+            return sum((len(pool) + self.batch_size - 1) // self.batch_size
+                       for pool in self._iter_pools(range(len(self.sampler))))
+        if hasattr(self.sampler, "set_epoch"):
+            return self.num_batches(getattr(self.sampler, "epoch", self.epoch))
+        # The number of batches depends on the sampled order; estimate it from pools in dataset order
+        indices = list(range(len(self.lengths)))[:len(self.sampler)]
+        return sum(len(self._make_batches(pool)) for pool in self._iter_pools(indices))
+
+    def num_batches(self, epoch):
+        """
+        The number of batches of pass `epoch`. With a token budget, it depends on which sentences the sampler puts
+        into the same pool, so a seeded sampler (one with `set_epoch`) draws the indices of that pass here, and its
+        state is restored afterwards. For other samplers, this is an upper bound: one sentence per batch.
+        """
+        if self.max_tokens is None:
+            return len(self)
+        if not hasattr(self.sampler, "set_epoch"):
+            return len(self.sampler)
+        state = dict(self.sampler.__dict__)
+        try:
+            self.sampler.set_epoch(epoch)
+            if hasattr(self.sampler, "skip"):
+                self.sampler.skip = 0
+            indices = list(self.sampler)
+        finally:
+            self.sampler.__dict__.update(state)
+        return sum(len(self._make_batches(pool)) for pool in self._iter_pools(indices))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+
+
+class SeededRandomSampler(Sampler):
+    """
+    Like RandomSampler, but with its own random state: pass `epoch` is shuffled with `seed + epoch`, and drawing
+    indices leaves the global torch RNG alone. The next pass leaves out its first `skip` indices.
+    """
+
+    def __init__(self, data_source, seed=42):
+        self.data_source = data_source
+        self.seed = seed
+        self.epoch = 0
+        self.skip = 0
+
+    def __iter__(self):
+        order = np.random.RandomState((self.seed + self.epoch) % 2 ** 32).permutation(len(self.data_source))
+        self.epoch += 1
+        order, self.skip = order[self.skip:], 0
+        return iter(order.tolist())
+
+    def __len__(self):
+        return len(self.data_source)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+
+def set_position(dataloader, epoch, num_batches=0):
+    """
+    Make the next pass over `dataloader` pass `epoch` of its sampler, starting after its first `num_batches`
+    batches. Seeded samplers leave these batches out without loading them; returns the number of batches that the
+    caller has to draw and drop instead (e.g. with a DistributedSampler).
+    """
+    batch_sampler = dataloader.batch_sampler
+    if hasattr(batch_sampler, "set_epoch"):
+        batch_sampler.set_epoch(epoch)
+    elif hasattr(dataloader.sampler, "set_epoch"):
+        dataloader.sampler.set_epoch(epoch)
+    if isinstance(batch_sampler, LengthBucketBatchSampler) and batch_sampler.seed is not None:
+        batch_sampler.skip = num_batches
+        return 0
+    if isinstance(dataloader.sampler, SeededRandomSampler) and not isinstance(batch_sampler, LengthBucketBatchSampler):
+        dataloader.sampler.skip = num_batches * dataloader.batch_size
+        return 0
+    return num_batches
+
+
+def count_optimization_steps(dataloader, num_epochs, gradient_accumulation_steps):
+    """
+    The number of optimization steps of `num_epochs` passes over `dataloader`. With a token budget, the number of
+    batches changes from epoch to epoch, so it is counted for every epoch (see `LengthBucketBatchSampler.num_batches`).
+    """
+    batch_sampler = dataloader.batch_sampler
+    if isinstance(batch_sampler, LengthBucketBatchSampler):
+        num_batches = [batch_sampler.num_batches(epoch) for epoch in range(num_epochs)]
+    else:
+        num_batches = [len(dataloader)] * num_epochs
+    return sum(n // gradient_accumulation_steps for n in num_batches)
+
+
+def isolated_rng_kwargs(seed):
+    """
+    DataLoader keyword arguments that give its iterators their own random generator (torch >= 1.6 draws a base
+    seed from the global RNG for every iterator otherwise; older versions only do so with worker processes).
+    """
+    if "generator" not in inspect.signature(DataLoader.__init__).parameters:
+        return {}
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    return {"generator": generator}
+
+
+def trim_batch(batch, input_mask_index=1):
+    """
+    Cut all sequence tensors of a batch to the length of its longest member. The lengths are taken from the input
+    mask, which is the second tensor in all datasets of the run scripts (nonzero for real tokens; packed batches
+    number the sentences in it).
+    """
+    input_mask = batch[input_mask_index]
+    seq_length = input_mask.size(1)
+    max_length = max(int((input_mask > 0).sum(1).max()), 1)
+    if max_length == seq_length:
+        return batch
+    return type(batch)(
+        t[:, :max_length].contiguous() if t.dim() > 1 and t.size(1) == seq_length else t
+        for t in batch
+    )
+
+
+def dynamic_padding_collate(samples):
+    return trim_batch(default_collate(samples))
+
+
+def get_collate_fn(dynamic_padding):
+    return dynamic_padding_collate if dynamic_padding else default_collate
+
+
+def worker_kwargs(num_workers):
+    """DataLoader keyword arguments for `num_workers` processes, which are kept between epochs with torch >= 1.7."""
+    kwargs = {"num_workers": num_workers}
+    if num_workers > 0 and "persistent_workers" in inspect.signature(DataLoader.__init__).parameters:
+        kwargs["persistent_workers"] = True
+    return kwargs
+
+
+def get_train_dataloader(data, sampler, args, lengths=None):
+    """
+    Build the training DataLoader, with length-bucketed batching if --dynamic_padding is set and --num_workers
+    processes that assemble the batches. Its random order only depends on --seed, so it can be iterated on a
+    background thread.
+    """
+    if not args.dynamic_padding:
+        return DataLoader(data, sampler=sampler, batch_size=args.train_batch_size,
+                          **worker_kwargs(args.num_workers), **isolated_rng_kwargs(args.seed))
+    if lengths is None:
+        lengths = data.tensors[1].sum(1).tolist()
+    batch_sampler = LengthBucketBatchSampler(sampler, lengths, args.train_batch_size,
+                                             max_tokens=args.max_tokens_per_batch, seed=args.seed)
+    return DataLoader(data, batch_sampler=batch_sampler, collate_fn=dynamic_padding_collate,
+                      **worker_kwargs(args.num_workers), **isolated_rng_kwargs(args.seed))
+
+
+class PaddingStatistics:
+    """
+    Tracks how many of the processed positions are padding, and the throughput in tokens per second.
+
+    `fixed_padding_ratio` is the ratio the batch would have had if it was padded to the full sequence length
+    (i.e. without --dynamic_padding), so a single run logs the numbers before and after.
+    """
+
+    def __init__(self, max_seq_length, input_mask_index=1):
+        self.max_seq_length = max_seq_length
+        self.input_mask_index = input_mask_index
+        self.reset()
+
+    def reset(self):
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.fixed_padded_tokens = 0
+        self.start_time = time.time()
+
+    def update(self, batch):
+        input_mask = batch[self.input_mask_index]
+        self.real_tokens += int((input_mask > 0).sum())
+        self.padded_tokens += input_mask.numel()
+        self.fixed_padded_tokens += input_mask.size(0) * self.max_seq_length
+
+    @property
+    def padding_ratio(self):
+        return 1 - self.real_tokens / max(self.padded_tokens, 1)
+
+    @property
+    def fixed_padding_ratio(self):
+        return 1 - self.real_tokens / max(self.fixed_padded_tokens, 1)
+
+    def log(self, description="Epoch"):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        logger.info("%s: padding ratio %.1f%% with fixed padding, %.1f%% as batched; "
+                    "%.0f tokens/sec (%.0f incl. padding)",
+                    description, 100 * self.fixed_padding_ratio, 100 * self.padding_ratio,
+                    self.real_tokens / elapsed, self.padded_tokens / elapsed)
+        self.reset()
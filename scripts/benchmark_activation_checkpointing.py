@@ -0,0 +1,92 @@
+"""
+Compare the peak memory and step time of training steps with and without --activation_checkpointing.
+
+Every setting runs in a fresh process: a randomly initialized BERT encoder of the given size with a token
+classification head does --num_steps training steps (forward, backward and an SGD step) on random batches of
+--batch_size sequences of --max_seq_length tokens. Example:
+
+python -m scripts.benchmark_activation_checkpointing --segments 0,1,2,4 --batch_size 16 --max_seq_length 384
+
+prints the peak resident set size of the process (on the GPU: the peak of allocated CUDA memory) and the mean step
+time of every segment size, where 0 keeps all activations.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig, BertModel
+
+from .activation_checkpointing import enable_activation_checkpointing
+from .packing import encode
+
+
+def measure(every, args):
+    """Peak memory in MiB and mean step time in seconds of training with segments of `every` layers."""
+    torch.manual_seed(0)
+    device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+    config = BertConfig(vocab_size_or_config_json_file=args.vocab_size, hidden_size=args.hidden_size,
+                        num_hidden_layers=args.num_hidden_layers, num_attention_heads=args.hidden_size // 64,
+                        intermediate_size=4 * args.hidden_size, max_position_embeddings=max(512, args.max_seq_length))
+    bert = BertModel(config)
+    enable_activation_checkpointing(bert, every)
+    classifier = torch.nn.Linear(args.hidden_size, 9)
+    bert.to(device)
+    classifier.to(device)
+    optimizer = torch.optim.SGD(list(bert.parameters()) + list(classifier.parameters()), lr=1e-5)
+
+    step_times = []
+    for step in range(args.num_warmup_steps + args.num_steps):
+        input_ids = torch.randint(1, args.vocab_size, (args.batch_size, args.max_seq_length), device=device)
+        labels = torch.randint(0, 9, (args.batch_size, args.max_seq_length), device=device)
+        start = time.time()
+        logits = classifier(encode(bert, input_ids, attention_mask=torch.ones_like(input_ids)))
+        loss = torch.nn.functional.cross_entropy(logits.view(-1, 9), labels.view(-1))
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        if step >= args.num_warmup_steps:
+            step_times.append(time.time() - start)
+
+    if device.type == "cuda":
+        peak_memory = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10  # KiB on Linux
+    return peak_memory, sum(step_times) / len(step_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--segments", default="0,1,2", type=str,
+                        help="Comma-separated --activation_checkpointing values to compare; 0 is the current path.")
+    parser.add_argument("--batch_size", default=16, type=int)
+    parser.add_argument("--max_seq_length", default=384, type=int)
+    parser.add_argument("--num_steps", default=5, type=int, help="Number of timed training steps.")
+    parser.add_argument("--num_warmup_steps", default=1, type=int, help="Number of untimed steps before them.")
+    parser.add_argument("--hidden_size", default=768, type=int)
+    parser.add_argument("--num_hidden_layers", default=12, type=int)
+    parser.add_argument("--vocab_size", default=28996, type=int)
+    parser.add_argument("--no_cuda", action='store_true', help="Whether not to use CUDA when available")
+    args = parser.parse_args()
+
+    # A new process per setting, so that the peak memory of one does not carry over to the next
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for every in [int(segment) for segment in args.segments.split(",")]:
+        with context.Pool(1) as pool:
+            results.append((every,) + pool.apply(measure, (every, args)))
+
+    reference_memory, reference_time = results[0][1:]
+    print("{:<10}{:>18}{:>12}{:>16}{:>12}".format("segments", "peak memory (MiB)", "memory", "step time (s)",
+                                                   "time"))
+    for every, peak_memory, step_time in results:
+        print("{:<10}{:>18.0f}{:>12.2f}{:>16.3f}{:>12.2f}".format(every, peak_memory, peak_memory / reference_memory,
+                                                                  step_time, step_time / reference_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure how CPU training scales with the number of data-parallel processes.
+
+For every number of processes, a process group with the gloo backend trains a randomly initialized
+`BertForTokenClassification` in `DistributedDataParallel` (as the run scripts do in distributed training) for
+--num_steps optimization steps. The global batch of --batch_size sequences of --max_seq_length tokens is split among
+the processes and accumulated over --gradient_accumulation_steps batches, with the gradients all-reduced only after
+the last one. The cores are split evenly among the processes. Example:
+
+python -m scripts.benchmark_distributed --processes 1,2,4 --batch_size 32 --max_seq_length 128
+
+prints the mean step time, the throughput in sequences per second, the speedup over the first setting and the
+scaling efficiency (speedup divided by the ratio of the numbers of processes).
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig, BertForTokenClassification
+
+from .distributed import distribute_model, gradient_sync
+
+
+def _train(rank, world_size, args, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(args.master_port)
+    torch.distributed.init_process_group("gloo", rank=rank, world_size=world_size)
+    torch.set_num_threads(max(os.cpu_count() // world_size, 1))
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size_or_config_json_file=args.vocab_size, hidden_size=args.hidden_size,
+                        num_hidden_layers=args.num_hidden_layers, num_attention_heads=args.hidden_size // 64,
+                        intermediate_size=4 * args.hidden_size, max_position_embeddings=max(512, args.max_seq_length))
+    model = distribute_model(BertForTokenClassification(config, num_labels=9), torch.device("cpu"))
+    optimizer = torch.optim.SGD([p for p in model.parameters() if p.requires_grad], lr=1e-5)
+    batch_size = args.batch_size // world_size // args.gradient_accumulation_steps
+
+    step_times = []
+    for step in range(args.num_warmup_steps + args.num_steps):
+        start = time.time()
+        for micro_step in range(args.gradient_accumulation_steps):
+            input_ids = torch.randint(1, args.vocab_size, (batch_size, args.max_seq_length))
+            labels = torch.randint(0, 9, (batch_size, args.max_seq_length))
+            with gradient_sync(model, sync=micro_step == args.gradient_accumulation_steps - 1):
+                loss = model(input_ids, attention_mask=torch.ones_like(input_ids), labels=labels)
+                (loss / args.gradient_accumulation_steps).backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        if step >= args.num_warmup_steps:
+            step_times.append(time.time() - start)
+
+    step_time = torch.tensor([sum(step_times) / len(step_times)])
+    torch.distributed.all_reduce(step_time, op=torch.distributed.ReduceOp.MAX)
+    if rank == 0:
+        results.put(float(step_time))
+    torch.distributed.destroy_process_group()
+
+
+def measure(world_size, args):
+    """Mean step time in seconds of training in `world_size` processes (the slowest process counts)."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [context.Process(target=_train, args=(rank, world_size, args, results)) for rank in range(world_size)]
+    for process in processes:
+        process.start()
+    step_time = results.get()
+    for process in processes:
+        process.join()
+    return step_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--processes", default="1,2,4", type=str, help="Comma-separated numbers of processes.")
+    parser.add_argument("--batch_size", default=32, type=int, help="Global batch size of an optimization step.")
+    parser.add_argument("--gradient_accumulation_steps", default=1, type=int)
+    parser.add_argument("--max_seq_length", default=128, type=int)
+    parser.add_argument("--num_steps", default=5, type=int, help="Number of timed optimization steps.")
+    parser.add_argument("--num_warmup_steps", default=1, type=int, help="Number of untimed steps before them.")
+    parser.add_argument("--hidden_size", default=768, type=int)
+    parser.add_argument("--num_hidden_layers", default=12, type=int)
+    parser.add_argument("--vocab_size", default=28996, type=int)
+    parser.add_argument("--master_port", default=29501, type=int)
+    args = parser.parse_args()
+
+    results = []
+    for world_size in [int(processes) for processes in args.processes.split(",")]:
+        if args.batch_size % (world_size * args.gradient_accumulation_steps) != 0:
+            raise ValueError("--batch_size {} cannot be split into {} processes and {} accumulation steps".format(
+                args.batch_size, world_size, args.gradient_accumulation_steps))
+        results.append((world_size, measure(world_size, args)))
+
+    reference_size, reference_time = results[0]
+    print("{:<12}{:>16}{:>16}{:>10}{:>12}".format("processes", "step time (s)", "sequences/s", "speedup",
+                                                  "efficiency"))
+    for world_size, step_time in results:
+        speedup = reference_time / step_time
+        print("{:<12}{:>16.3f}{:>16.1f}{:>10.2f}{:>12.2f}".format(world_size, step_time, args.batch_size / step_time,
+                                                                 speedup, speedup * reference_size / world_size))
+
+
+if __name__ == "__main__":
+    main()
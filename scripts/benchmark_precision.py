@@ -0,0 +1,65 @@
+"""
+Compare the throughput and F1 of run_ner.py in different --precision modes.
+
+Every precision gets its own run with the same arguments and seed, in a subdirectory of --output_dir. All other
+arguments are passed on to run_ner.py, which needs --do_train and --do_predict here. Example:
+
+python -m scripts.benchmark_precision --precisions fp32,bf16 --output_dir /tmp/precision -- \
+    --bert_model bert-base-cased --train_file data/conll03/train.txt --predict_file data/conll03/valid.txt \
+    --do_train --do_predict --no_cuda --dynamic_padding
+
+prints the wall time, the training throughput of the last epoch and the F1 of every precision, and the difference
+to the F1 of the first one.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+_TOKENS_PER_SECOND = re.compile(r"Epoch \d+: .*; (\d+) tokens/sec")
+_F1 = re.compile(r"^accuracy:.*FB1:\s*([\d.]+)", re.MULTILINE)
+
+
+def run(precision, output_dir, run_ner_args):
+    command = [sys.executable, "-m", "scripts.run_ner", "--precision", precision, "--metrics_sink", "none",
+               "--output_dir", os.path.join(output_dir, precision)] + run_ner_args
+    start = time.time()
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    elapsed = time.time() - start
+    with open(os.path.join(output_dir, precision + ".log"), "w", encoding="utf-8") as f:
+        f.write(completed.stdout)
+    if completed.returncode != 0:
+        raise RuntimeError("run_ner.py failed with --precision {}, see {}.log".format(precision, precision))
+    tokens_per_second = [int(match) for match in _TOKENS_PER_SECOND.findall(completed.stdout)]
+    f1 = [float(match) for match in _F1.findall(completed.stdout)]
+    return elapsed, tokens_per_second[-1] if tokens_per_second else None, f1[-1] if f1 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--precisions", default="fp32,bf16", type=str,
+                        help="Comma-separated precisions to compare; the first one is the reference.")
+    parser.add_argument("--output_dir", required=True, type=str,
+                        help="Directory for the runs, one subdirectory and log file per precision.")
+    args, run_ner_args = parser.parse_known_args()
+    run_ner_args = [arg for arg in run_ner_args if arg != "--"]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    results = []
+    for precision in args.precisions.split(","):
+        results.append((precision,) + run(precision, args.output_dir, run_ner_args))
+
+    reference_f1 = results[0][3]
+    print("{:<12}{:>10}{:>20}{:>10}{:>14}".format("precision", "time (s)", "train tokens/sec", "F1",
+                                                  "F1 - " + results[0][0]))
+    for precision, elapsed, tokens_per_second, f1 in results:
+        difference = f1 - reference_f1 if f1 is not None and reference_f1 is not None else float("nan")
+        print("{:<12}{:>10.1f}{:>20}{:>10}{:>14.2f}".format(precision, elapsed, tokens_per_second or "-",
+                                                            f1 if f1 is not None else "-", difference))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Memoization of the WordPiece tokenization of single words.
+
+All scripts tokenize their input one word at a time, and word frequencies are Zipfian, so most calls tokenize a
+word that was seen before. `CachingTokenizer` wraps a `BertTokenizer` and remembers the WordPieces of recently used
+words. Optionally, the WordPiece ids of words are kept in a table on disk that later runs start from.
+
+`load_bert_tokenizer` keeps the `BertTokenizer` itself in a pickle, which loads several times faster than parsing the
+vocabulary file again, and does not ask the server whether the vocabulary of a pretrained model changed.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+from collections import OrderedDict
+
+from .feature_cache import hash_vocab
+
+logger = logging.getLogger(__name__)
+
+
+class CachingTokenizer(object):
+    """
+    Drop-in replacement for `BertTokenizer` with a memoized `tokenize`. All other attributes are those of the
+    wrapped tokenizer. At most `max_size` words are kept in memory, least recently used words are dropped first.
+    """
+
+    def __init__(self, tokenizer, max_size=100000, table_file=None):
+        self.tokenizer = tokenizer
+        self.max_size = max_size
+        self.table_file = table_file
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._table = {}
+        self._vocab_hash = hash_vocab(tokenizer)
+        if table_file is not None and os.path.isfile(table_file):
+            self._load_table(table_file)
+
+    def tokenize(self, text):
+        word_pieces = self._cache.get(text)
+        if word_pieces is not None:
+            self._cache.move_to_end(text)
+            self.hits += 1
+            return list(word_pieces)
+        word_piece_ids = self._table.get(text)
+        if word_piece_ids is not None:
+            word_pieces = tuple(self.tokenizer.ids_to_tokens[i] for i in word_piece_ids)
+            self.hits += 1
+        else:
+            word_pieces = tuple(self.tokenizer.tokenize(text))
+            self.misses += 1
+        self._cache[text] = word_pieces
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return list(word_pieces)
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def log_statistics(self):
+        logger.info("WordPiece cache: %d lookups, hit rate %.1f%%, %d words in memory, %d in the table",
+                    self.hits + self.misses, 100 * self.hit_rate, len(self._cache), len(self._table))
+
+    def _load_table(self, table_file):
+        with open(table_file, "rb") as f:
+            stored = pickle.load(f)
+        if stored["vocab"] != self._vocab_hash or stored["do_lower_case"] != self._do_lower_case:
+            logger.warning("Ignoring WordPiece table %s, which was created for a different vocabulary", table_file)
+            return
+        self._table = stored["table"]
+        logger.info("Loaded WordPiece table with %d words from %s", len(self._table), table_file)
+
+    def save(self):
+        """Add the words in memory to the table on disk, if there is one."""
+        if self.table_file is None:
+            return
+        table = dict(self._table)
+        for text, word_pieces in self._cache.items():
+            table[text] = tuple(self.tokenizer.vocab[word_piece] for word_piece in word_pieces)
+        temporary_file = "{}.{}.tmp".format(self.table_file, os.getpid())
+        with open(temporary_file, "wb") as f:
+            pickle.dump({"vocab": self._vocab_hash, "do_lower_case": self._do_lower_case, "table": table}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary_file, self.table_file)
+        logger.info("Saved WordPiece table with %d words to %s", len(table), self.table_file)
+
+    @property
+    def _do_lower_case(self):
+        return self.tokenizer.basic_tokenizer.do_lower_case
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not found on the wrapper itself
+        if name == "tokenizer":
+            raise AttributeError(name)
+        return getattr(self.tokenizer, name)
+
+
+def _resolve_vocab_file(bert_model):
+    """The local vocabulary file that `BertTokenizer.from_pretrained(bert_model)` reads, or None before its download."""
+    from pytorch_pretrained_bert.file_utils import PYTORCH_PRETRAINED_BERT_CACHE, url_to_filename
+    from pytorch_pretrained_bert.tokenization import PRETRAINED_VOCAB_ARCHIVE_MAP, VOCAB_NAME
+
+    vocab_file = PRETRAINED_VOCAB_ARCHIVE_MAP.get(bert_model, bert_model)
+    if os.path.isdir(vocab_file):
+        return os.path.join(vocab_file, VOCAB_NAME)
+    if os.path.isfile(vocab_file):
+        return vocab_file
+    # `cached_path` stores a download as <hash of the URL>.<hash of its ETag>, next to a .json with the metadata
+    prefix = os.path.join(str(PYTORCH_PRETRAINED_BERT_CACHE), url_to_filename(vocab_file))
+    downloads = [path for path in glob.glob(prefix + "*") if not path.endswith(".json")]
+    return max(downloads, key=os.path.getmtime) if downloads else None
+
+
+def _tokenizer_key(bert_model, vocab_file, do_lower_case):
+    stat = os.stat(vocab_file)
+    description = {"bert_model": bert_model, "do_lower_case": bool(do_lower_case),
+                   "vocab_file": os.path.abspath(vocab_file), "size": stat.st_size, "mtime": stat.st_mtime}
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_bert_tokenizer(bert_model, do_lower_case, cache_dir=None):
+    """
+    `BertTokenizer.from_pretrained(bert_model, do_lower_case=do_lower_case)`, pickled into `cache_dir` (by default a
+    'tokenizers' directory in the pytorch_pretrained_bert cache) the first time and unpickled afterwards. Entries are
+    keyed on the vocabulary file that `bert_model` resolves to, with its size and modification time.
+    """
+    from pytorch_pretrained_bert.file_utils import PYTORCH_PRETRAINED_BERT_CACHE
+    from pytorch_pretrained_bert.tokenization import BertTokenizer
+
+    cache_dir = cache_dir or os.path.join(str(PYTORCH_PRETRAINED_BERT_CACHE), "tokenizers")
+    vocab_file = _resolve_vocab_file(bert_model)
+    if vocab_file is not None:
+        path = os.path.join(cache_dir, _tokenizer_key(bert_model, vocab_file, do_lower_case) + ".pkl")
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                return pickle.load(f)
+    tokenizer = BertTokenizer.from_pretrained(bert_model, do_lower_case=do_lower_case)
+    if tokenizer is None:
+        # `from_pretrained` logs the error and returns None if it cannot find the vocabulary
+        raise EnvironmentError("Cannot load the vocabulary of {}".format(bert_model))
+    vocab_file = _resolve_vocab_file(bert_model)
+    if vocab_file is None:
+        return tokenizer
+    path = os.path.join(cache_dir, _tokenizer_key(bert_model, vocab_file, do_lower_case) + ".pkl")
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_file = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary_file, "wb") as f:
+        pickle.dump(tokenizer, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(temporary_file, path)
+    logger.info("Saved the tokenizer of %s to %s", bert_model, path)
+    return tokenizer
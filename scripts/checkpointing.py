@@ -0,0 +1,173 @@
+"""
+Resumable training checkpoints.
+
+A checkpoint holds everything needed to continue training where it stopped: the model and optimizer state, the
+loss scaler, all random number generators, the position in every data stream and the progress counters (epoch,
+step in the epoch, global step, best F1, ...). `CheckpointManager.save` copies the state to the CPU on the training
+thread, which is fast, and writes it to disk on a background thread. It keeps the last `keep` checkpoints and the
+best one by F1; `load_latest` returns the newest one for --resume.
+"""
+
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+def _to_cpu(state):
+    """Copy all tensors of a nested state to the CPU, so that training can go on modifying the originals."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        copy = type(state)((key, _to_cpu(value)) for key, value in state.items())
+        if hasattr(state, "_metadata"):  # versions of the modules in a state_dict
+            copy._metadata = state._metadata
+        return copy
+    if isinstance(state, (list, tuple)):
+        return type(state)(_to_cpu(value) for value in state)
+    return state
+
+
+def _load(path):
+    # Checkpoints hold more than tensors (e.g. the numpy RNG state)
+    if "weights_only" in inspect.signature(torch.load).parameters:
+        return torch.load(path, map_location="cpu", weights_only=False)
+    return torch.load(path, map_location="cpu")
+
+
+def get_rng_state():
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def get_training_state(model, optimizer, loss_scaler, scheduler, **progress):
+    """The full training state; `progress` holds counters such as epoch, step, global_step and best_f1."""
+    model_to_save = model.module if hasattr(model, 'module') else model
+    return {
+        "model": model_to_save.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "loss_scaler": loss_scaler.state_dict(),
+        "scheduler": scheduler.state_dict(),
+        "rng": get_rng_state(),
+        "progress": progress,
+    }
+
+
+def restore_training_state(state, model, optimizer, loss_scaler, scheduler):
+    """Restore a state of `get_training_state` and return its progress counters."""
+    model_to_load = model.module if hasattr(model, 'module') else model
+    model_to_load.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    loss_scaler.load_state_dict(state["loss_scaler"])
+    scheduler.load_state_dict(state["scheduler"])
+    set_rng_state(state["rng"])
+    return state["progress"]
+
+
+class CheckpointManager:
+    """Writes checkpoints named checkpoint-<global step>.pt into `directory`, and other files, asynchronously."""
+
+    def __init__(self, directory, keep=2):
+        if keep < 1:
+            raise ValueError("At least one checkpoint must be kept, got {}".format(keep))
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        self.index_file = os.path.join(directory, "checkpoints.json")
+        self.index = {"checkpoints": [], "best": None, "best_f1": None}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        # At most one state waits for the writer, so that only two CPU copies exist at a time
+        self._queue = queue.Queue(1)
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def save(self, state, global_step, f1=None):
+        """Save a training state; it becomes the best checkpoint if `f1` is higher than all before."""
+        self._queue.put((self._save_checkpoint, (_to_cpu(state), global_step, f1)))
+
+    def save_file(self, state, path, callback=None):
+        """
+        Write `state` (e.g. the model weights) to `path` with torch.save in the background; `callback` is called on
+        the background thread once the file is complete.
+        """
+        self._queue.put((self._save, (_to_cpu(state), path, callback)))
+
+    def wait(self):
+        """Block until everything that was saved is on disk."""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def load_latest(self):
+        """The state of the newest checkpoint, or None if there is none."""
+        self.wait()
+        if not self.index["checkpoints"]:
+            return None
+        path = os.path.join(self.directory, self.index["checkpoints"][-1])
+        logger.info("Loading checkpoint %s", path)
+        return _load(path)
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _CLOSE:
+                    return
+                function, arguments = item
+                function(*arguments)
+            except Exception:
+                logger.exception("Could not write checkpoint")
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _save(state, path, callback=None):
+        temporary_path = path + ".tmp"
+        torch.save(state, temporary_path)
+        os.replace(temporary_path, path)
+        if callback is not None:
+            callback()
+
+    def _save_checkpoint(self, state, global_step, f1):
+        name = "checkpoint-{}.pt".format(global_step)
+        self._save(state, os.path.join(self.directory, name))
+        checkpoints = [checkpoint for checkpoint in self.index["checkpoints"] if checkpoint != name] + [name]
+        if f1 is not None and (self.index["best_f1"] is None or f1 > self.index["best_f1"]):
+            self.index["best"], self.index["best_f1"] = name, f1
+        for checkpoint in checkpoints[:-self.keep]:
+            if checkpoint != self.index["best"] and checkpoint != name:
+                os.remove(os.path.join(self.directory, checkpoint))
+                checkpoints.remove(checkpoint)
+        self.index["checkpoints"] = checkpoints
+        self._save_index()
+        logger.info("Saved checkpoint %s", name)
+
+    def _save_index(self):
+        temporary_file = self.index_file + ".tmp"
+        with open(temporary_file, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(temporary_file, self.index_file)
@@ -0,0 +1,330 @@
+"""
+Shared reader for CoNLL-formatted datasets.
+
+A `CoNLLCorpus` stores a dataset compactly: every distinct token string is kept once and referred to by an int32 id,
+tags are uint8 ids, and sentence and document boundaries are offset arrays. `CoNLL2003Dataset` exposes the usual
+nested lists of (token, tag) tuples as a lazy view on top of it, and computes its statistics on the arrays.
+"""
+
+import itertools
+import random
+from array import array
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# Token id of lines that only contain a tag
+NO_TOKEN = -1
+
+
+class CoNLLCorpus(object):
+    """
+    Documents, sentences and tokens of a CoNLL file.
+
+    `token_ids` and `tag_ids` have one entry per token. The tokens of sentence i are
+    `sentence_offsets[i]:sentence_offsets[i + 1]`, and the sentences of document j are
+    `document_offsets[j]:document_offsets[j + 1]`.
+    """
+
+    def __init__(self, tokens, tags, token_ids, tag_ids, sentence_offsets, document_offsets):
+        self.tokens = tokens
+        self.tags = tags
+        self.token_ids = token_ids
+        self.tag_ids = tag_ids
+        self.sentence_offsets = sentence_offsets
+        self.document_offsets = document_offsets
+
+    @classmethod
+    def read(cls, filepath):
+        builder = _CorpusBuilder()
+        with open(filepath, encoding="utf-8") as f:
+            builder.add_lines(f)
+        return builder.build()
+
+    @classmethod
+    def read_sentences(cls, filepath, chunk_lines=10000):
+        """
+        Lazily yield the tokens and the tags of every sentence of a CoNLL file as two lists, like
+        `read(filepath).iter_sentences()`. The file is parsed in chunks of about `chunk_lines` lines that end at a
+        sentence boundary, so memory use does not depend on its size.
+        """
+        with open(filepath, encoding="utf-8") as f:
+            chunk = []
+            for line in f:
+                chunk.append(line)
+                if len(chunk) >= chunk_lines and not line.strip():
+                    for sentence in cls._parse(chunk).iter_sentences():
+                        yield sentence
+                    chunk = []
+            for sentence in cls._parse(chunk).iter_sentences():
+                yield sentence
+
+    @classmethod
+    def _parse(cls, lines):
+        builder = _CorpusBuilder()
+        builder.add_lines(lines)
+        return builder.build()
+
+    @classmethod
+    def from_documents(cls, documents):
+        builder = _CorpusBuilder()
+        for document in documents:
+            for sentence in document:
+                for token, tag in sentence:
+                    builder.add(token, tag)
+                builder.end_sentence()
+            builder.end_document()
+        return builder.build()
+
+    @property
+    def num_documents(self):
+        return len(self.document_offsets) - 1
+
+    @property
+    def num_sentences(self):
+        return len(self.sentence_offsets) - 1
+
+    def get_sentence(self, index):
+        start, end = self.sentence_offsets[index], self.sentence_offsets[index + 1]
+        tokens, tags = self.tokens, self.tags
+        return [(tokens[token_id] if token_id != NO_TOKEN else None, tags[tag_id])
+                for token_id, tag_id in zip(self.token_ids[start:end].tolist(), self.tag_ids[start:end].tolist())]
+
+    def get_document(self, index):
+        return [self.get_sentence(i)
+                for i in range(self.document_offsets[index], self.document_offsets[index + 1])]
+
+    def iter_sentences(self):
+        """Yield the tokens and the tags of every sentence as two lists."""
+        token_ids, tag_ids = self.token_ids.tolist(), self.tag_ids.tolist()
+        tokens, tags = self.tokens, self.tags
+        offsets = self.sentence_offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield ([tokens[i] if i != NO_TOKEN else None for i in token_ids[start:end]],
+                   [tags[i] for i in tag_ids[start:end]])
+
+
+class _CorpusBuilder(object):
+
+    def __init__(self):
+        self.token_index = {}
+        self.tag_index = {}
+        self.token_ids = array("i")
+        self.tag_ids = array("B")
+        self.sentence_offsets = array("q", [0])
+        self.document_offsets = array("q", [0])
+
+    def add(self, token, tag):
+        if token is None:
+            token_id = NO_TOKEN
+        else:
+            token_id = self.token_index.get(token)
+            if token_id is None:
+                token_id = self.token_index[token] = len(self.token_index)
+        tag_id = self.tag_index.get(tag)
+        if tag_id is None:
+            tag_id = self._add_tag(tag)
+        self.token_ids.append(token_id)
+        self.tag_ids.append(tag_id)
+
+    def add_lines(self, lines):
+        """Parse CoNLL lines. This is the same as calling `add` and `end_*`, but inlined for speed."""
+        token_index, tag_index = self.token_index, self.tag_index
+        get_token_id, get_tag_id = token_index.get, tag_index.get
+        append_token_id, append_tag_id = self.token_ids.append, self.tag_ids.append
+        for line in lines:
+            fields = line.split()
+            if not fields:
+                self.end_sentence()
+                continue
+            if "DOCSTART" in line:
+                self.end_document()
+                continue
+            if " " in line or "\t" in line:
+                token, tag = fields[0], fields[-1]
+                token_id = get_token_id(token)
+                if token_id is None:
+                    token_id = token_index[token] = len(token_index)
+            else:
+                token_id, tag = NO_TOKEN, fields[0]
+            tag_id = get_tag_id(tag)
+            if tag_id is None:
+                tag_id = self._add_tag(tag)
+            append_token_id(token_id)
+            append_tag_id(tag_id)
+
+    def _add_tag(self, tag):
+        if len(self.tag_index) > 255:
+            raise ValueError("More than 256 different tags")
+        tag_id = self.tag_index[tag] = len(self.tag_index)
+        return tag_id
+
+    def end_sentence(self):
+        if len(self.token_ids) > self.sentence_offsets[-1]:
+            self.sentence_offsets.append(len(self.token_ids))
+
+    def end_document(self):
+        self.end_sentence()
+        if len(self.sentence_offsets) - 1 > self.document_offsets[-1]:
+            self.document_offsets.append(len(self.sentence_offsets) - 1)
+
+    def build(self):
+        self.end_document()
+        return CoNLLCorpus(
+            tokens=sorted(self.token_index, key=self.token_index.get),
+            tags=sorted(self.tag_index, key=self.tag_index.get),
+            token_ids=np.frombuffer(self.token_ids, dtype=np.int32),
+            tag_ids=np.frombuffer(self.tag_ids, dtype=np.uint8),
+            sentence_offsets=np.frombuffer(self.sentence_offsets, dtype=np.int64),
+            document_offsets=np.frombuffer(self.document_offsets, dtype=np.int64),
+        )
+
+
+class _Documents(object):
+    """Read-only list of documents; each document is materialized as a list of sentences when it is accessed."""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __len__(self):
+        return self.corpus.num_documents
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("document index out of range")
+        return self.corpus.get_document(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.corpus.get_document(index)
+
+
+class CoNLL2003Dataset(object):
+    """
+    A CoNLL dataset as a list of documents, which are lists of sentences, which are lists of (token, tag) tuples.
+    Assigning to `documents` replaces the corpus.
+    """
+
+    def __init__(self, filepath=None, corpus=None):
+        self.corpus = corpus if corpus is not None else CoNLLCorpus.read(filepath)
+
+    @property
+    def documents(self):
+        return _Documents(self.corpus)
+
+    @documents.setter
+    def documents(self, documents):
+        self.corpus = CoNLLCorpus.from_documents(documents)
+
+    def get_num_tokens(self):
+        return len(self.corpus.token_ids)
+
+    def get_num_sentences(self):
+        return self.corpus.num_sentences
+
+    def get_num_documents(self):
+        return self.corpus.num_documents
+
+    def get_document_lengths(self):
+        return np.diff(self.corpus.document_offsets).tolist()
+
+    def get_document_token_counts(self):
+        return np.diff(self.corpus.sentence_offsets[self.corpus.document_offsets]).tolist()
+
+    def get_sentence_lengths(self):
+        return np.diff(self.corpus.sentence_offsets).tolist()
+
+    def get_subset(self, n):
+        all_sentences = list(itertools.chain.from_iterable(self.documents))
+        sample_sentences = random.sample(all_sentences, n)
+        return CoNLL2003Dataset(corpus=CoNLLCorpus.from_documents([[sentence] for sentence in sample_sentences]))
+
+    def _get_main_tag(self, tag):
+        return tag.replace("B-", "").replace("I-", "").replace("O-", "")
+
+    def get_raw_classes(self):
+        return sorted(self.get_raw_class_sizes())
+
+    def get_classes(self):
+        classes = {self._get_main_tag(tag) for tag in self.get_raw_classes()}
+        return sorted(list(classes))
+
+    def get_raw_class_sizes(self):
+        counts = np.bincount(self.corpus.tag_ids, minlength=len(self.corpus.tags))
+        return Counter({tag: int(count) for tag, count in zip(self.corpus.tags, counts) if count})
+
+    def get_class_sizes(self):
+        counter = Counter()
+        for tag, count in self.get_raw_class_sizes().items():
+            if "-" not in tag or tag.startswith("B-"):
+                counter[self._get_main_tag(tag)] += count
+        return counter
+
+    def get_vocabulary_size(self):
+        # Tag-only lines count as a single token (None)
+        return len(np.unique(self.corpus.token_ids))
+
+    def get_unigram_distribution(self):
+        class_counts = sorted(self.get_raw_class_sizes().items())
+        classes = [tag for tag, _ in class_counts]
+        counts = np.array([count for tag, count in class_counts])
+        frequencies = counts / sum(counts)
+        return classes, frequencies
+
+    def print_unigram_distribution(self):
+        classes, frequencies = self.get_unigram_distribution()
+        print("\t".join(classes))
+        print("\t".join(str(f) for f in frequencies))
+
+    def get_bigram_distribution(self):
+        counter = defaultdict(int)
+        for _, sentence_tags in self.corpus.iter_sentences():
+            for prev_tag, tag in zip(sentence_tags[:-1], sentence_tags[1:]):
+                counter[(prev_tag, tag)] += 1
+        classes = self.get_raw_classes()
+        counts = []
+        bigrams = []
+        for class1 in classes:
+            for class2 in classes:
+                if any([
+                    class1 == "O" and class2.startswith("I-"),
+                    class1 != class2 and class1.startswith("I-") and class2.startswith("I-"),
+                    self._get_main_tag(class1) != self._get_main_tag(class2) and class1.startswith("B-") and class2.startswith("I-"),
+                ]):
+                    continue  # Invalid bigram
+                counts.append(counter[(class1, class2)])
+                bigrams.append("{}+{}".format(class1, class2))
+        counts = np.array(counts)
+        frequencies = counts / sum(counts)
+        return bigrams, frequencies
+
+    def print_bigram_distribution(self):
+        bigrams, frequencies = self.get_bigram_distribution()
+        print("\t".join(bigrams))
+        print("\t".join(str(f) for f in frequencies))
+
+    def print_all_distributions(self):
+        unigrams, unigram_frequencies = self.get_unigram_distribution()
+        bigrams, bigram_frequencies = self.get_bigram_distribution()
+        print("\t".join(unigrams + bigrams))
+        print("\t".join(str(f) for f in list(unigram_frequencies) + list(bigram_frequencies)))
+
+    def print_unsupervised(self):
+        for tokens, _ in self.corpus.iter_sentences():
+            line = " ".join(tokens)
+            if line.strip():
+                print(line)
+
+    def __str__(self):
+        s = []
+        for document in self.documents:
+            s.append("-DOCSTART- O\n\n")
+            for sentence in document:
+                for word in sentence:
+                    s.append("\t".join(word) + "\n")
+                s.append("\n")
+        return "".join(s)
@@ -11,7 +11,7 @@ import random
 import sys
 from copy import deepcopy
 
-from .conll_sampling import CoNLL2003Dataset
+from .conll import CoNLL2003Dataset
 
 MAX_SEQ_LEN = 150
 
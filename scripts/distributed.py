@@ -0,0 +1,122 @@
+"""
+Data-parallel training with torch.distributed.
+
+With --local_rank (or LOCAL_RANK in the environment, as set by `scripts.launch_distributed` and torchrun), every
+process joins a process group and trains a `DistributedDataParallel` copy of the model on its share of the data:
+with NCCL and one GPU per process, or with gloo on the CPU (--no_cuda or no GPUs), e.g. one process per socket or
+node. Gradients are averaged across the processes by all-reduce after every backward pass that ends a gradient
+accumulation; the other backward passes only accumulate locally (`gradient_sync`).
+
+The main process (rank 0) is the only one that writes shared files: the feature cache, checkpoints, metrics and the
+model. The others wait for the features at a barrier (`wait_for_main_process`, `release_other_processes`), and
+follow its decision to stop early (`broadcast_flag`).
+"""
+
+import contextlib
+import inspect
+import logging
+import os
+
+import torch
+from torch.utils.data.distributed import DistributedSampler
+
+from .batching import SeededRandomSampler
+
+logger = logging.getLogger(__name__)
+
+
+def is_distributed():
+    return torch.distributed.is_available() and torch.distributed.is_initialized()
+
+
+def get_rank():
+    return torch.distributed.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return torch.distributed.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_distributed(args):
+    """
+    Device and number of GPUs of this process. Joins the process group if --local_rank is set or the launcher set
+    LOCAL_RANK: with NCCL on the GPU of the local rank, or with gloo on the CPU.
+    """
+    if args.local_rank == -1 and "LOCAL_RANK" in os.environ:
+        args.local_rank = int(os.environ["LOCAL_RANK"])
+    use_cuda = torch.cuda.is_available() and not args.no_cuda
+    if args.local_rank == -1:
+        return torch.device("cuda" if use_cuda else "cpu"), torch.cuda.device_count()
+    if use_cuda:
+        torch.cuda.set_device(args.local_rank)
+        device, n_gpu, backend = torch.device("cuda", args.local_rank), 1, "nccl"
+    else:
+        device, n_gpu, backend = torch.device("cpu"), 0, "gloo"
+    # Initializes the distributed backend which will take care of sychronizing nodes/GPUs
+    torch.distributed.init_process_group(backend=backend)
+    logger.info("Process %d of %d (%s backend)", get_rank(), get_world_size(), backend)
+    return device, n_gpu
+
+
+def distribute_model(model, device):
+    """
+    Wrap `model` in `DistributedDataParallel`, which starts from the weights of the main process. The pooler is not
+    used by the NER models, so it gets no gradients; DDP requires them for all parameters that it reduces.
+    """
+    for name, parameter in model.named_parameters():
+        if name.startswith("bert.pooler."):
+            parameter.requires_grad = False
+    device_ids = [device.index] if device.type == "cuda" else None
+    # Without broadcast of the buffers, the main process can evaluate the model on its own
+    return torch.nn.parallel.DistributedDataParallel(model, device_ids=device_ids, broadcast_buffers=False)
+
+
+@contextlib.contextmanager
+def gradient_sync(model, sync=True):
+    """
+    Context of a forward and backward pass. Without `sync` (for all but the last batch of a gradient accumulation),
+    a `DistributedDataParallel` model accumulates the gradients locally instead of all-reducing them.
+    """
+    if sync or not hasattr(model, "no_sync"):
+        yield
+    else:
+        with model.no_sync():
+            yield
+
+
+def wait_for_main_process(rank):
+    """Make the processes other than the main one (`rank` 0) wait until it calls `release_other_processes`."""
+    if rank > 0:
+        torch.distributed.barrier()
+
+
+def release_other_processes(rank):
+    if rank == 0:
+        torch.distributed.barrier()
+
+
+def broadcast_flag(flag):
+    """The value of `flag` on the main process, in every process."""
+    if not is_distributed():
+        return flag
+    tensor = torch.tensor([int(bool(flag))])
+    if torch.distributed.get_backend() == "nccl":
+        tensor = tensor.cuda()
+    torch.distributed.broadcast(tensor, 0)
+    return bool(tensor.item())
+
+
+def get_sampler(dataset, seed):
+    """
+    A `SeededRandomSampler` over `dataset`, or in distributed training a `DistributedSampler` over the share of this
+    process. Its order depends on `seed` (torch >= 1.6) and on the epoch that `set_position` passes to it.
+    """
+    if not is_distributed():
+        return SeededRandomSampler(dataset, seed)
+    if "seed" in inspect.signature(DistributedSampler.__init__).parameters:
+        return DistributedSampler(dataset, seed=seed)
+    return DistributedSampler(dataset)
@@ -0,0 +1,154 @@
+"""
+Content-addressed store for featurized datasets.
+
+Entries are keyed by a hash of everything the features depend on: the contents of the input files, the tokenizer
+vocabulary, the casing, the maximum sequence length, the label vocabulary and the featurizer. Entries are built
+under a file lock and moved into place with an atomic rename, so parallel jobs share one featurization and never
+see half-written caches. When the store grows beyond its size cap, the least recently used entries are evicted.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from .feature_store import ColumnarFeatures
+from .preloading import preloaded
+
+logger = logging.getLogger(__name__)
+
+# Increase when the layout of the stored features changes
+FORMAT_VERSION = 2
+
+
+def hash_file(filepath, chunk_size=1 << 20):
+    sha = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _hash_file_once(filepath):
+    """`hash_file`, computed once per version of the file in a process tree (see `scripts.preloading`)."""
+    stat = os.stat(filepath)
+    return preloaded(("file hash", os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns),
+                     lambda: hash_file(filepath))
+
+
+def hash_vocab(tokenizer):
+    sha = hashlib.sha1()
+    for token in tokenizer.vocab:
+        sha.update(token.encode("utf-8"))
+        sha.update(b"\n")
+    return sha.hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(lock_path, shared=False):
+    """Hold an flock on `lock_path`: exclusive, or `shared` with other shared holders (e.g. readers of an entry)."""
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, filename))
+               for root, _, filenames in os.walk(directory) for filename in filenames)
+
+
+class FeatureCache(object):
+
+    def __init__(self, cache_dir, max_size_gb=None):
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_gb * (1 << 30)) if max_size_gb is not None else None
+        self._vocab_hashes = {}
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, featurizer, input_files, tokenizer, do_lower_case, max_seq_length, labels=None, **kwargs):
+        """Build the cache key. Additional keyword arguments (e.g. the languages) become part of the key."""
+        if id(tokenizer) not in self._vocab_hashes:
+            self._vocab_hashes[id(tokenizer)] = hash_vocab(tokenizer)
+        description = {
+            "format_version": FORMAT_VERSION,
+            "featurizer": featurizer,
+            "input_files": [_hash_file_once(input_file) for input_file in input_files],
+            "vocab": self._vocab_hashes[id(tokenizer)],
+            "do_lower_case": bool(do_lower_case),
+            "max_seq_length": max_seq_length,
+            "labels": list(labels) if labels is not None else None,
+        }
+        description.update(kwargs)
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._entry_path(key))
+
+    def _load(self, key, tokenizer):
+        path = self._entry_path(key)
+        features = ColumnarFeatures.load(path, tokenizer=tokenizer)
+        os.utime(path, None)  # Mark as recently used
+        return features
+
+    def get_or_create(self, key, build_fn, tokenizer=None, description="features"):
+        """
+        Return the features stored under `key`. If there are none, `build_fn` is called to create them (as
+        `ColumnarFeatures` or a list of `InputFeatures`), and they are stored and returned. Only one process builds
+        an entry; others wait for it. Entries are loaded under their lock, so that `evict` cannot move them away
+        in the middle.
+        """
+        path = self._entry_path(key)
+        with file_lock(path + ".lock", shared=True):
+            if os.path.isdir(path):
+                logger.info("Loading %s from cache %s", description, path)
+                return self._load(key, tokenizer)
+        with file_lock(path + ".lock"):
+            if not os.path.isdir(path):
+                features = build_fn()
+                if not isinstance(features, ColumnarFeatures):
+                    features = ColumnarFeatures.from_features(features)
+                temporary_path = tempfile.mkdtemp(prefix=key + ".", suffix=".tmp", dir=self.cache_dir)
+                features.save(temporary_path)
+                os.rename(temporary_path, path)
+                logger.info("Saved %s into cache %s", description, path)
+            else:
+                logger.info("Loading %s from cache %s", description, path)
+            features = self._load(key, tokenizer)
+        self.evict(keep=key)
+        return features
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the store is below its size cap."""
+        if self.max_size is None:
+            return
+        with file_lock(os.path.join(self.cache_dir, ".evict.lock")):
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if os.path.isdir(path) and not name.endswith(".tmp"):
+                    entries.append((os.path.getmtime(path), name, _directory_size(path)))
+            total_size = sum(size for _, _, size in entries)
+            for _, name, size in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                if name == keep:
+                    continue
+                logger.info("Evicting features %s from cache", name)
+                path = self._entry_path(name)
+                with file_lock(path + ".lock"):
+                    # Processes that already mapped the files keep their data until they close them
+                    evicted_path = tempfile.mkdtemp(prefix=name + ".", suffix=".tmp", dir=self.cache_dir)
+                    os.rename(path, os.path.join(evicted_path, name))
+                    shutil.rmtree(evicted_path)
+                total_size -= size
@@ -0,0 +1,231 @@
+"""
+Columnar storage for the features of the run scripts.
+
+Instead of pickling lists of `InputFeatures`, all sentences are concatenated into flat arrays (one .npy file per
+column) with an offsets array marking the sentence boundaries. Padding is not stored. The arrays are opened with
+`np.memmap`, so loading a cache only maps the files, and batches are padded when they are sampled.
+"""
+
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+# Columns with one entry per WordPiece
+TOKEN_COLUMNS = {
+    "input_ids": np.int32,
+    "loss_mask": np.uint8,
+    "label_ids": np.int16,
+    "tok_to_orig": np.int32,  # -1 for [CLS] and [SEP]
+    "prediction_mask": np.uint8,  # 1 for the WordPiece that predicts the label of its original token
+}
+# Columns with one entry per feature
+FEATURE_COLUMNS = {
+    "unique_id": np.int64,
+    "example_index": np.int64,
+    "language_id": np.int64,
+}
+
+
+class FeatureView(object):
+    """Read-only view on a single feature, with the attributes of `InputFeatures` that are used for predictions."""
+
+    def __init__(self, features, index):
+        index = int(index)
+        self._features = features
+        self._index = index
+        self._tokens = None
+        self._token_to_orig_map = None
+        self.unique_id = int(features.columns["unique_id"][index])
+        self.example_index = int(features.columns["example_index"][index])
+
+    @property
+    def input_ids(self):
+        return self._features.get_column("input_ids", self._index).tolist()
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            if self._features.tokenizer is None:
+                raise ValueError("Features were loaded without a tokenizer, so the WordPiece tokens are unavailable")
+            self._tokens = self._features.tokenizer.convert_ids_to_tokens(self.input_ids)
+        return self._tokens
+
+    @property
+    def token_to_orig_map(self):
+        if self._token_to_orig_map is None:
+            tok_to_orig = self._features.get_column("tok_to_orig", self._index).tolist()
+            self._token_to_orig_map = {i: orig_index for i, orig_index in enumerate(tok_to_orig) if orig_index >= 0}
+        return self._token_to_orig_map
+
+    @property
+    def prediction_mask(self):
+        return self._features.get_column("prediction_mask", self._index).tolist()
+
+    @property
+    def head_positions(self):
+        """Positions of the WordPieces that predict the labels of the original tokens, in order."""
+        return np.flatnonzero(self._features.get_column("prediction_mask", self._index))
+
+    @property
+    def head_orig_indices(self):
+        """Original token index of each of the `head_positions`."""
+        return self._features.get_column("tok_to_orig", self._index)[self.head_positions]
+
+    @property
+    def language_id(self):
+        return int(self._features.columns["language_id"][self._index])
+
+
+class ColumnarFeatures(object):
+
+    def __init__(self, columns, tokenizer=None):
+        self.columns = columns
+        self.tokenizer = tokenizer
+        offsets = columns["offsets"]
+        self.lengths = offsets[1:] - offsets[:-1]
+
+    @classmethod
+    def from_features(cls, features, tokenizer=None):
+        """Convert a list of `InputFeatures` (of any of the run scripts) into columns."""
+        lengths = [sum(f.input_mask) for f in features]
+        offsets = np.zeros(len(features) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        columns = {"offsets": offsets}
+        first = features[0] if features else None
+        has_labels = first is not None and first.label_ids is not None
+        has_language = first is not None and hasattr(first, "language_id")
+        has_prediction_mask = first is not None and hasattr(first, "prediction_mask")
+        for name, dtype in TOKEN_COLUMNS.items():
+            if name == "label_ids" and not has_labels:
+                continue
+            if name == "prediction_mask" and not has_prediction_mask:
+                continue
+            columns[name] = np.zeros(offsets[-1], dtype=dtype)
+        for name, dtype in FEATURE_COLUMNS.items():
+            if name == "language_id" and not has_language:
+                continue
+            columns[name] = np.array([getattr(f, name) for f in features], dtype=dtype)
+        for i, (f, length) in enumerate(zip(features, lengths)):
+            start, end = offsets[i], offsets[i + 1]
+            columns["input_ids"][start:end] = f.input_ids[:length]
+            columns["loss_mask"][start:end] = f.loss_mask[:length]
+            if has_labels:
+                columns["label_ids"][start:end] = f.label_ids[:length]
+            if has_prediction_mask:
+                columns["prediction_mask"][start:end] = f.prediction_mask[:length]
+            columns["tok_to_orig"][start:end] = [f.token_to_orig_map.get(j, -1) if 0 < j < length - 1 else -1
+                                                 for j in range(length)]
+        return cls(columns, tokenizer)
+
+    @classmethod
+    def concatenate(cls, parts, tokenizer=None):
+        """Join the features of consecutive shards of a dataset."""
+        parts = list(parts)
+        if len(parts) == 1:
+            return cls(parts[0].columns, tokenizer)
+        offsets = [parts[0].columns["offsets"][:1]]
+        for part in parts:
+            part_offsets = part.columns["offsets"]
+            offsets.append(part_offsets[1:] - part_offsets[0] + offsets[-1][-1])
+        columns = {"offsets": np.concatenate(offsets)}
+        for name in parts[0].columns:
+            if name != "offsets":
+                columns[name] = np.concatenate([part.columns[name] for part in parts])
+        # Shards number their features from the index of their first example, which overlaps with the features of
+        # the previous shard if it split examples into several windows
+        unique_ids = columns["unique_id"]
+        if len(unique_ids):
+            columns["unique_id"] = unique_ids[0] + np.arange(len(unique_ids), dtype=unique_ids.dtype)
+        return cls(columns, tokenizer)
+
+    def save(self, directory):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for name, array in self.columns.items():
+            np.save(os.path.join(directory, name + ".npy"), array)
+
+    @classmethod
+    def load(cls, directory, tokenizer=None, mmap_mode="c"):
+        """
+        Map a saved feature directory into memory. The default copy-on-write mode shares the pages with the file
+        (and with other processes that map it) while still allowing torch tensors to be created without a copy.
+        """
+        if not os.path.isfile(os.path.join(directory, "offsets.npy")):
+            raise IOError("No features found in {}".format(directory))
+        columns = {}
+        for filename in os.listdir(directory):
+            name, extension = os.path.splitext(filename)
+            if extension == ".npy":
+                columns[name] = np.load(os.path.join(directory, filename), mmap_mode=mmap_mode)
+        return cls(columns, tokenizer)
+
+    def get_column(self, name, index):
+        offsets = self.columns["offsets"]
+        return self.columns[name][offsets[index]:offsets[index + 1]]
+
+    def to_dataset(self, max_seq_length=None, labels=True, language_ids=False, example_indices=False):
+        if max_seq_length is None:
+            max_seq_length = int(self.lengths.max()) if len(self) else 1
+        return ColumnarFeatureDataset(self, max_seq_length, labels, language_ids, example_indices)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        return FeatureView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class ColumnarFeatureDataset(Dataset):
+    """
+    Dataset that pads features to `max_seq_length` when they are accessed. Items are tuples of
+    (input_ids, input_mask, loss_mask, segment_ids), followed by the label ids, the language id and the
+    feature index if requested, like the TensorDatasets that the run scripts used before.
+    """
+
+    def __init__(self, features, max_seq_length, labels=True, language_ids=False, example_indices=False):
+        self.features = features
+        self.max_seq_length = max_seq_length
+        self.offsets = features.columns["offsets"]
+        self.lengths = np.minimum(features.lengths, max_seq_length)
+        self.input_ids = torch.from_numpy(features.columns["input_ids"])
+        self.loss_mask = torch.from_numpy(features.columns["loss_mask"])
+        self.label_ids = torch.from_numpy(features.columns["label_ids"]) if labels else None
+        self.language_ids = torch.from_numpy(features.columns["language_id"]) if language_ids else None
+        self.example_indices = example_indices
+
+    def _pad(self, column, start, length):
+        padded = torch.zeros(self.max_seq_length, dtype=torch.long)
+        padded[:length] = column[start:start + length]
+        return padded
+
+    def __getitem__(self, index):
+        start = int(self.offsets[index])
+        length = min(int(self.offsets[index + 1]) - start, self.max_seq_length)
+        input_mask = torch.zeros(self.max_seq_length, dtype=torch.long)
+        input_mask[:length] = 1
+        item = [
+            self._pad(self.input_ids, start, length),
+            input_mask,
+            self._pad(self.loss_mask, start, length),
+            torch.zeros(self.max_seq_length, dtype=torch.long),
+        ]
+        if self.label_ids is not None:
+            item.append(self._pad(self.label_ids, start, length))
+        if self.language_ids is not None:
+            item.append(self.language_ids[index].long())
+        if self.example_indices:
+            item.append(torch.tensor(index, dtype=torch.long))
+        return tuple(item)
+
+    def split_logits(self, index, logits):
+        """Yield the feature index and the logits of item `index`, like `PackedDataset.split_logits`."""
+        yield index, logits
+
+    def __len__(self):
+        return len(self.features)
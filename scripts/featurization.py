@@ -0,0 +1,249 @@
+"""
+Multi-process featurization.
+
+WordPiece tokenization is pure Python, so featurizing a large corpus on one core can take hours. The `Featurizer`
+splits the examples into shards, runs the `convert_*_to_features` function of a run script on each shard in a
+process pool and joins the resulting columns in order, so the output is identical to a single-process run.
+
+`convert_examples_to_columns` is the featurization that the run scripts share. It tokenizes every distinct word
+of a shard once and builds the columns of `ColumnarFeatures` with array operations, without creating Python lists
+per sentence.
+
+Jobs are queued as soon as they are submitted, which lets the training, evaluation and unsupervised datasets be
+featurized at the same time.
+"""
+
+import itertools
+import logging
+import multiprocessing
+
+import numpy as np
+
+from .feature_store import ColumnarFeatures, FEATURE_COLUMNS, TOKEN_COLUMNS
+from .preloading import preloaded
+from .windowing import get_prediction_mask, get_windows
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker process by `_init_worker`
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _to_columnar(features, tokenizer=None):
+    if isinstance(features, ColumnarFeatures):
+        features.tokenizer = tokenizer
+        return features
+    return ColumnarFeatures.from_features(features, tokenizer)
+
+
+def _convert_shard(convert_fn, examples, start_index, kwargs):
+    features = convert_fn(examples, _worker_tokenizer, start_index=start_index, **kwargs)
+    # Columns are much cheaper to send back to the parent process than lists of InputFeatures
+    return _to_columnar(features).columns
+
+
+def _ragged_arange(starts, counts):
+    """The concatenation of `range(start, start + count)` for all starts and counts."""
+    counts = np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    return np.repeat(np.asarray(starts, dtype=np.int64) - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+
+
+def _tokenize_words(tokenizer, words):
+    """
+    Tokenize each distinct word once. Returns the WordPiece ids of all words as one array, whether each WordPiece
+    is a continuation ("##"), and the number of WordPieces of every word.
+    """
+    word_indices = {}
+    index_of_words = np.array([word_indices.setdefault(word, len(word_indices)) for word in words], dtype=np.int64)
+    distinct_ids = []
+    distinct_continuations = []
+    distinct_counts = np.zeros(len(word_indices), dtype=np.int64)
+    for i, word in enumerate(word_indices):
+        word_pieces = tokenizer.tokenize(word) if word is not None else []
+        distinct_ids += tokenizer.convert_tokens_to_ids(word_pieces)
+        distinct_continuations += [word_piece.startswith("##") for word_piece in word_pieces]
+        distinct_counts[i] = len(word_pieces)
+    distinct_starts = np.cumsum(distinct_counts) - distinct_counts
+    counts = distinct_counts[index_of_words]
+    pieces = _ragged_arange(distinct_starts[index_of_words], counts)
+    return (np.array(distinct_ids, dtype=np.int64)[pieces], np.array(distinct_continuations, dtype=bool)[pieces],
+            counts)
+
+
+def convert_examples_to_columns(examples, tokenizer, max_seq_length, label_vocab=None, start_index=0,
+                                window_stride=None, first_unique_id=1000000000, languages=None):
+    """
+    Featurize examples (with `tokens`, and `labels` if there is a `label_vocab`) into `ColumnarFeatures`. Every
+    sentence becomes [CLS] WordPieces [SEP]; sentences that are too long are truncated, or split into windows if
+    there is a `window_stride`. Examples get consecutive example indices from `start_index`, and features
+    consecutive unique ids from `first_unique_id + start_index`. With `languages`, the language id of a feature is
+    the index of the language of its example.
+    """
+    max_tokens = max_seq_length - 2
+    words = [word for example in examples for word in example.tokens]
+    word_counts = np.array([len(example.tokens) for example in examples], dtype=np.int64)
+    word_offsets = np.concatenate([[0], np.cumsum(word_counts)])
+    ids, continuations, pieces_per_word = _tokenize_words(tokenizer, words)
+    # WordPiece offsets of the words, and of the sentences
+    piece_offsets = np.concatenate([[0], np.cumsum(pieces_per_word)])
+    sentence_offsets = piece_offsets[word_offsets]
+    sentence_lengths = np.diff(sentence_offsets)
+    # Original index of every WordPiece in its sentence, and whether it is the first WordPiece of its word
+    words_of_pieces = np.repeat(np.arange(len(words)), pieces_per_word)
+    orig_indices = words_of_pieces - np.repeat(word_offsets[:-1], sentence_lengths)
+    is_head = np.zeros(len(ids), dtype=bool)
+    is_head[piece_offsets[:-1][pieces_per_word > 0]] = True
+
+    # One feature per window; most sentences have a single window, starting at 0
+    window_sentences, window_starts, window_ends, prediction_masks = [], [], [], {}
+    for i, length in enumerate(sentence_lengths.tolist()):
+        windows = get_windows(length, max_tokens, window_stride)
+        if len(windows) > 1:
+            head_positions = set(np.flatnonzero(is_head[sentence_offsets[i]:sentence_offsets[i + 1]]).tolist())
+            for window_index in range(len(windows)):
+                prediction_masks[len(window_sentences) + window_index] = get_prediction_mask(
+                    windows, window_index, head_positions)
+        for start, end in windows:
+            window_sentences.append(i)
+            window_starts.append(start)
+            window_ends.append(end)
+    window_sentences = np.array(window_sentences, dtype=np.int64)
+    window_lengths = np.array(window_ends, dtype=np.int64) - window_starts
+    feature_lengths = window_lengths + 2
+
+    offsets = np.zeros(len(window_sentences) + 1, dtype=np.int64)
+    np.cumsum(feature_lengths, out=offsets[1:])
+    # Position of every WordPiece of the windows in the output, and its index in the WordPiece arrays
+    positions = _ragged_arange(offsets[:-1] + 1, window_lengths)
+    pieces = _ragged_arange(sentence_offsets[window_sentences] + window_starts, window_lengths)
+    cls_positions, sep_positions = offsets[:-1], offsets[1:] - 1
+
+    columns = {"offsets": offsets}
+    input_ids = np.zeros(offsets[-1], dtype=TOKEN_COLUMNS["input_ids"])
+    input_ids[positions] = ids[pieces]
+    input_ids[cls_positions], input_ids[sep_positions] = tokenizer.convert_tokens_to_ids(["[CLS]", "[SEP]"])
+    columns["input_ids"] = input_ids
+    # When computing loss, ignore tail WordPieces
+    loss_mask = np.ones(offsets[-1], dtype=TOKEN_COLUMNS["loss_mask"])
+    loss_mask[positions] = ~continuations[pieces]
+    columns["loss_mask"] = loss_mask
+    if label_vocab is not None:
+        word_label_ids = np.array(label_vocab.convert_labels_to_ids(
+            [label for example in examples for label in example.labels]), dtype=TOKEN_COLUMNS["label_ids"])
+        label_ids = np.full(offsets[-1], label_vocab.convert_labels_to_ids(["O"])[0],
+                            dtype=TOKEN_COLUMNS["label_ids"])
+        label_ids[positions] = word_label_ids[words_of_pieces[pieces]]
+        columns["label_ids"] = label_ids
+    tok_to_orig = np.full(offsets[-1], -1, dtype=TOKEN_COLUMNS["tok_to_orig"])
+    tok_to_orig[positions] = orig_indices[pieces]
+    columns["tok_to_orig"] = tok_to_orig
+    prediction_mask = np.zeros(offsets[-1], dtype=TOKEN_COLUMNS["prediction_mask"])
+    prediction_mask[positions] = is_head[pieces]
+    for feature_index, mask in prediction_masks.items():
+        start = offsets[feature_index] + 1
+        prediction_mask[start:start + len(mask)] = mask
+    columns["prediction_mask"] = prediction_mask
+
+    example_indices = start_index + window_sentences
+    columns["unique_id"] = (first_unique_id + start_index + np.arange(len(window_sentences))).astype(
+        FEATURE_COLUMNS["unique_id"])
+    columns["example_index"] = example_indices.astype(FEATURE_COLUMNS["example_index"])
+    if languages is not None:
+        language_ids = np.array([languages.index(example.language) for example in examples], dtype=np.int64)
+        columns["language_id"] = language_ids[window_sentences].astype(FEATURE_COLUMNS["language_id"])
+
+    features = ColumnarFeatures(columns, tokenizer)
+    if start_index == 0:
+        for feature in itertools.islice(features, 5):
+            logger.info("*** Example ***")
+            logger.info("example_index: %s" % feature.example_index)
+            logger.info("tokens: %s" % " ".join(feature.tokens))
+            logger.info("input_ids: %s" % " ".join(str(x) for x in feature.input_ids))
+            logger.info("prediction_mask: %s" % " ".join(str(x) for x in feature.prediction_mask))
+    return features
+
+
+class FeaturizationJob(object):
+
+    def __init__(self, featurizer, convert_fn, examples, kwargs, feature_cache=None, key=None,
+                 description="features"):
+        self.featurizer = featurizer
+        self.convert_fn = convert_fn
+        self.examples = examples
+        self.kwargs = kwargs
+        self.feature_cache = feature_cache
+        self.key = key
+        self.description = description
+        self._shards = None
+        self._result = None
+        if featurizer.pool is not None and (feature_cache is None or key not in feature_cache):
+            self._start()
+
+    def _start(self):
+        shard_size = self.featurizer.shard_size
+        self._shards = [
+            self.featurizer.pool.apply_async(
+                _convert_shard, (self.convert_fn, self.examples[start:start + shard_size], start, self.kwargs))
+            for start in range(0, len(self.examples), shard_size)
+        ]
+        logger.info("Featurizing %s in %d shards", self.description, len(self._shards))
+
+    def _build(self):
+        tokenizer = self.featurizer.tokenizer
+        if self._shards is None:
+            if self.featurizer.pool is None:
+                return _to_columnar(self.convert_fn(self.examples, tokenizer, **self.kwargs), tokenizer)
+            self._start()
+        parts = [ColumnarFeatures(shard.get()) for shard in self._shards]
+        return ColumnarFeatures.concatenate(parts, tokenizer)
+
+    def result(self):
+        """Wait for the features, reading them from (or adding them to) the feature cache if there is one."""
+        if self._result is None:
+            if self.feature_cache is None:
+                self._result = self._build()
+            else:
+                self._result = self.feature_cache.get_or_create(self.key, self._build,
+                                                                tokenizer=self.featurizer.tokenizer,
+                                                                description=self.description)
+        return self._result
+
+
+class Featurizer(object):
+    """
+    Runs the featurization of the run scripts in `num_workers` processes. With a single worker, jobs run in the
+    calling process when their result is requested.
+    """
+
+    def __init__(self, tokenizer, num_workers=1, shard_size=2000):
+        self.tokenizer = tokenizer
+        self.shard_size = shard_size
+        self.pool = None
+        if num_workers > 1:
+            # Forked workers inherit the tokenizer and the run script module without pickling them
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            self.pool = context.Pool(num_workers, initializer=_init_worker, initargs=(tokenizer,))
+
+    def submit(self, convert_fn, examples, feature_cache=None, key=None, description="features", **kwargs):
+        """
+        Queue featurizing `examples` with `convert_fn`, which is called with the examples, the tokenizer,
+        `start_index` and `kwargs`. If a feature cache and key are given, cached features are not recomputed, and
+        the job is shared with later runs in the same process (see `scripts.preloading`).
+        """
+        if key is None:
+            return FeaturizationJob(self, convert_fn, examples, kwargs, feature_cache, key, description)
+        return preloaded(("features", key),
+                         lambda: FeaturizationJob(self, convert_fn, examples, kwargs, feature_cache, key, description))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
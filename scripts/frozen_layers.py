@@ -0,0 +1,117 @@
+"""
+Training with the bottom layers of the BERT encoder frozen.
+
+With --freeze_layers k, the embeddings and the bottom k encoder layers keep their pretrained weights, so their output
+for a training feature is the same in every epoch. `get_frozen_outputs` computes it once (in eval mode, i.e. without
+dropout) and stores it as a memory-mapped fp16 array with one row per WordPiece, in the order of the
+`ColumnarFeatures`. `FrozenOutputDataset` appends the cached hidden states to the items of a training dataset, and
+`encode` then only runs the layers above the frozen ones, forward and backward.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from .batching import dynamic_padding_collate
+from .packing import encode_bottom
+
+logger = logging.getLogger(__name__)
+
+
+def freeze_layers(bert, num_layers):
+    """Stop training the embeddings and the bottom `num_layers` encoder layers of the `BertModel` `bert`."""
+    if not 0 <= num_layers <= len(bert.encoder.layer):
+        raise ValueError("Cannot freeze {} of {} layers".format(num_layers, len(bert.encoder.layer)))
+    bert.num_frozen_layers = num_layers
+    if num_layers == 0:
+        return
+    for module in [bert.embeddings] + list(bert.encoder.layer[:num_layers]):
+        for parameter in module.parameters():
+            parameter.requires_grad = False
+
+
+def _fingerprint(bert, features, max_seq_length):
+    digest = hashlib.sha1(np.ascontiguousarray(features.columns["offsets"]).tobytes())
+    digest.update(np.ascontiguousarray(features.columns["input_ids"]).tobytes())
+    for module in [bert.embeddings] + list(bert.encoder.layer[:bert.num_frozen_layers]):
+        for parameter in module.parameters():
+            digest.update(parameter.detach().float().cpu().numpy().tobytes())
+    return {"features": digest.hexdigest(), "num_frozen_layers": bert.num_frozen_layers,
+            "max_seq_length": max_seq_length, "hidden_size": bert.config.hidden_size}
+
+
+def get_frozen_outputs(bert, features, directory, max_seq_length, batch_size=32):
+    """
+    The output of the frozen layers of `bert` for all `features`, an array of shape [number of WordPieces, hidden
+    size]. It is computed on the device of `bert` if `directory` does not hold it for the same features yet.
+    """
+    path = os.path.join(directory, "hidden_states.npy")
+    metadata_file = os.path.join(directory, "metadata.json")
+    metadata = _fingerprint(bert, features, max_seq_length)
+    if os.path.isfile(path) and os.path.isfile(metadata_file):
+        with open(metadata_file, "r", encoding="utf-8") as f:
+            if json.load(f) == metadata:
+                logger.info("Loading the output of the frozen layers from %s", path)
+                return np.load(path, mmap_mode="c")
+    os.makedirs(directory, exist_ok=True)
+
+    # Other processes (e.g. of distributed training) may compute the same array at the same time
+    temporary_path = "{}.{}.tmp".format(path, os.getpid())
+    hidden_states = np.lib.format.open_memmap(temporary_path, mode="w+", dtype=np.float16,
+                                              shape=(int(features.columns["offsets"][-1]), bert.config.hidden_size))
+    dataset = features.to_dataset(max_seq_length, labels=False, example_indices=True)
+    dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=dynamic_padding_collate)
+    offsets = features.columns["offsets"]
+    device = next(bert.parameters()).device
+    training = bert.training
+    bert.eval()
+    with torch.no_grad():
+        for input_ids, input_mask, _, segment_ids, indices in tqdm(dataloader, desc="Frozen layers"):
+            output = encode_bottom(bert, input_ids.to(device), segment_ids.to(device), input_mask.to(device),
+                                   bert.num_frozen_layers)
+            output = output.to(dtype=torch.float16).cpu().numpy()
+            for row, index in zip(output, indices.tolist()):
+                start, length = int(offsets[index]), int(dataset.lengths[index])
+                hidden_states[start:start + length] = row[:length]
+    bert.train(training)
+    hidden_states.flush()
+    del hidden_states
+    os.replace(temporary_path, path)
+    with open(metadata_file + ".{}.tmp".format(os.getpid()), "w", encoding="utf-8") as f:
+        json.dump(metadata, f)
+    os.replace(metadata_file + ".{}.tmp".format(os.getpid()), metadata_file)
+    logger.info("Saved the output of the frozen layers to %s", path)
+    return np.load(path, mmap_mode="c")
+
+
+class FrozenOutputDataset(Dataset):
+    """
+    Appends the output of the frozen layers (from `get_frozen_outputs`) to the items of a `ColumnarFeatureDataset`
+    or `PackedDataset`, as a [max_seq_length, hidden size] fp16 tensor that is aligned with the input ids.
+    """
+
+    def __init__(self, dataset, hidden_states):
+        self.dataset = dataset
+        self.hidden_states = torch.from_numpy(hidden_states)
+        self.max_seq_length = dataset.max_seq_length
+        self.offsets = dataset.offsets
+        self.feature_lengths = np.minimum(dataset.features.lengths, dataset.max_seq_length)
+        self.lengths = dataset.lengths
+
+    def __getitem__(self, index):
+        frozen_output = torch.zeros(self.max_seq_length, self.hidden_states.size(1), dtype=torch.float16)
+        position = 0
+        for feature_index in self.dataset.packs[index] if hasattr(self.dataset, "packs") else [index]:
+            start, length = int(self.offsets[feature_index]), int(self.feature_lengths[feature_index])
+            frozen_output[position:position + length] = self.hidden_states[start:start + length]
+            position += length
+        return self.dataset[index] + (frozen_output,)
+
+    def __len__(self):
+        return len(self.dataset)
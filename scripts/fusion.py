@@ -0,0 +1,47 @@
+"""
+Fused execution of several batches in one forward pass.
+
+A training step of run_uda_ner.py (and of run_ner.py with --expectation_regularization) runs the model on a
+supervised batch and on one or more unsupervised batches. With --fuse_streams, batches that do not depend on each
+other are concatenated into one padded batch, so that the encoder runs once on more rows instead of several times on
+few. The logits are then split again, and cut to the sequence length of each batch, so that the losses are computed
+as before. Padding does not change the outputs of the real tokens, as it is masked in the attention.
+"""
+
+import torch
+
+# torch < 1.2 has no bool tensors; its `torch.where` takes uint8 conditions
+_FLAG_DTYPE = getattr(torch, "bool", torch.uint8)
+
+
+def concatenate_batches(batches, num_tensors=4):
+    """
+    Concatenate the first `num_tensors` tensors (input_ids, input_mask, loss_mask, segment_ids) of `batches`,
+    padding their sequences with zeros to the longest one.
+    """
+    seq_length = max(batch[0].size(1) for batch in batches)
+    fused = []
+    for i in range(num_tensors):
+        tensors = [batch[i] for batch in batches]
+        fused.append(torch.cat([torch.nn.functional.pad(t, (0, seq_length - t.size(1))) for t in tensors]))
+    return tuple(fused)
+
+
+def split_logits(logits, batches):
+    """Split the logits of a fused batch into those of `batches`, each with its own sequence length."""
+    parts = torch.split(logits, [batch[0].size(0) for batch in batches])
+    return [part[:, :batch[0].size(1)] for part, batch in zip(parts, batches)]
+
+
+def fused_forward(model, batches, use_dropout=None):
+    """
+    Logits of `model` for each of `batches` from a single forward pass. `use_dropout` optionally gives one flag per
+    batch; the model then applies its dropout only to the rows of batches whose flag is set.
+    """
+    input_ids, input_mask, loss_mask, segment_ids = concatenate_batches(batches)
+    kwargs = {}
+    if use_dropout is not None:
+        kwargs["use_dropout"] = torch.cat([torch.full((batch[0].size(0),), int(bool(flag)), dtype=_FLAG_DTYPE)
+                                           for batch, flag in zip(batches, use_dropout)]).to(input_ids.device)
+    logits = model(input_ids, segment_ids, input_mask, loss_mask, **kwargs)
+    return split_logits(logits, batches)
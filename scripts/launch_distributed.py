@@ -0,0 +1,78 @@
+"""
+Start a run script in several processes for distributed data-parallel training.
+
+Every process runs the module with the environment of torch.distributed (MASTER_ADDR, MASTER_PORT, WORLD_SIZE, RANK
+and LOCAL_RANK), which the run scripts read in `init_distributed`. Example, on the CPU with one process per socket of
+a two-socket machine:
+
+python -m scripts.launch_distributed --nproc_per_node 2 --bind_cores scripts.run_ner --no_cuda --do_train ...
+
+On several nodes, start the launcher on each of them with --nnodes, its --node_rank and the --master_addr of node 0.
+On the CPU, every process uses an equal share of the cores of the node (OMP_NUM_THREADS), and with --bind_cores it is
+pinned to a contiguous block of them. If a process fails, the others are stopped.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def _core_blocks(num_blocks):
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    size = max(len(cores) // num_blocks, 1)
+    return [cores[i * size:(i + 1) * size] or cores for i in range(num_blocks)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--nproc_per_node", default=1, type=int, help="Number of processes on this node.")
+    parser.add_argument("--nnodes", default=1, type=int)
+    parser.add_argument("--node_rank", default=0, type=int)
+    parser.add_argument("--master_addr", default="127.0.0.1", type=str, help="Address of node 0.")
+    parser.add_argument("--master_port", default=29500, type=int)
+    parser.add_argument("--threads_per_process", default=None, type=int,
+                        help="OMP_NUM_THREADS of every process. Defaults to the cores of the node divided by "
+                             "--nproc_per_node.")
+    parser.add_argument("--bind_cores", action="store_true",
+                        help="Pin every process to its own block of cores (Linux only).")
+    parser.add_argument("module", type=str, help="Module of the run script, e.g. scripts.run_ner")
+    parser.add_argument("module_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    core_blocks = _core_blocks(args.nproc_per_node)
+    threads = args.threads_per_process or len(core_blocks[0])
+    processes = []
+    for local_rank in range(args.nproc_per_node):
+        env = dict(os.environ, MASTER_ADDR=args.master_addr, MASTER_PORT=str(args.master_port),
+                   WORLD_SIZE=str(args.nnodes * args.nproc_per_node),
+                   RANK=str(args.node_rank * args.nproc_per_node + local_rank), LOCAL_RANK=str(local_rank),
+                   OMP_NUM_THREADS=str(threads))
+        preexec_fn = None
+        if args.bind_cores:
+            cores = core_blocks[local_rank]
+            preexec_fn = lambda cores=cores: os.sched_setaffinity(0, cores)
+        command = [sys.executable, "-m", args.module, "--local_rank={}".format(local_rank)] + args.module_args
+        processes.append(subprocess.Popen(command, env=env, preexec_fn=preexec_fn))
+
+    try:
+        while processes:
+            for process in list(processes):
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+                processes.remove(process)
+                if returncode != 0:
+                    for other in processes:
+                        other.terminate()
+                    sys.exit(returncode)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        raise
+
+
+if __name__ == "__main__":
+    main()
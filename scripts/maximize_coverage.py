@@ -10,11 +10,14 @@ from copy import deepcopy
 
 from pytorch_pretrained_bert import BertTokenizer
 
-from .conll_sampling import CoNLL2003Dataset
+from .caching_tokenizer import CachingTokenizer
+from .conll import CoNLL2003Dataset
 
 
 def maximize_coverage(source: CoNLL2003Dataset, target: CoNLL2003Dataset, n: int, tokenizer: BertTokenizer) -> CoNLL2003Dataset:
     MAX_SEQ_LEN = 150
+    if not isinstance(tokenizer, CachingTokenizer):
+        tokenizer = CachingTokenizer(tokenizer)
 
     target_vocab = set()
     for document in target.documents:
@@ -58,6 +61,7 @@ def maximize_coverage(source: CoNLL2003Dataset, target: CoNLL2003Dataset, n: int
                     tokenized_train_sentences[j]["set"].remove(new_word_piece)
                     tokenized_train_sentences[j]["coverage"] -= 1
 
+    tokenizer.log_statistics()
     output = deepcopy(source)
     output.documents = [[sentence] for sentence in selected_train_sentences]
     return output
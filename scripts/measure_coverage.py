@@ -7,20 +7,20 @@ import sys
 from collections import Counter
 from copy import deepcopy
 
-from pytorch_pretrained_bert import BertTokenizer
-
-from .conll_statistics import CoNLL2003Dataset
+from .caching_tokenizer import CachingTokenizer, load_bert_tokenizer
+from .conll import CoNLL2003Dataset
 
 
 class OverlapMeasure:
 
-    def __init__(self, source: CoNLL2003Dataset, target: CoNLL2003Dataset, tokenizer: BertTokenizer):
+    def __init__(self, source: CoNLL2003Dataset, target: CoNLL2003Dataset, tokenizer):
         self.source = deepcopy(source)
         self.target = deepcopy(target)
-        self.tokenizer = tokenizer
+        self.tokenizer = tokenizer if isinstance(tokenizer, CachingTokenizer) else CachingTokenizer(tokenizer)
 
         self.source_words, self.source_names = self.tokenize(self.source)
         self.target_words, self.target_names = self.tokenize(self.target)
+        self.tokenizer.log_statistics()
 
     def tokenize(self, dataset):
         words = []
@@ -64,7 +64,7 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.WARNING)
     source = CoNLL2003Dataset(sys.argv[1])
     target = CoNLL2003Dataset(sys.argv[2])
-    tokenizer = BertTokenizer.from_pretrained("bert-base-multilingual-cased", do_lower_case=False)
+    tokenizer = load_bert_tokenizer("bert-base-multilingual-cased", do_lower_case=False)
     overlap_measure = OverlapMeasure(source, target, tokenizer)
     print(overlap_measure.get_word_type_coverage())
     print(overlap_measure.get_word_token_coverage())
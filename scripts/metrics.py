@@ -0,0 +1,152 @@
+"""
+Buffered training metrics.
+
+`MetricsWriter.add_scalar` has the signature of tensorboardX's `SummaryWriter.add_scalar`, but only keeps the value:
+loss tensors stay on the device, detached, until the metrics are reduced to their means every `flush_every` steps
+with a single transfer. The reduced values are written by a background thread to TensorBoard or to an append-only
+JSONL file, so neither the device sync nor the writing happens on every training step. The JSONL sink does not
+import tensorboardX (or tensorflow) at all, and the TensorBoard sink only imports it when the first metrics are
+written, so runs that only predict never do.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+from .distributed import is_main_process
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+class TensorBoardSink:
+    """Writes metrics to TensorBoard event files in `log_dir`, which are created with the first metrics."""
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.writer = None
+
+    def write(self, step, values):
+        if self.writer is None:
+            from tensorboardX import SummaryWriter
+            self.writer = SummaryWriter(self.log_dir)
+        for tag, value in values.items():
+            self.writer.add_scalar(tag, value, step)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class JsonlSink:
+    """Appends one JSON object per flush, with the step, the wall time and the metrics, to `path`."""
+
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, step, values):
+        record = OrderedDict([("step", step), ("time", round(time.time(), 3))])
+        record.update(values)
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class MetricsWriter:
+    """
+    Collects scalars (numbers, or tensors that count with their mean) by tag and writes the mean of every tag to
+    `sinks` once every `flush_every` steps. Call `step()` after every training step; scalars without a
+    `global_step` belong to the current step.
+    """
+
+    def __init__(self, sinks, flush_every=20):
+        self.sinks = sinks
+        self.flush_every = flush_every
+        self.global_step = 0
+        self._values = OrderedDict()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def add_scalar(self, tag, value, global_step=None):
+        if global_step is not None and global_step != self.global_step:
+            # Values of another step are written on their own
+            self._queue.put((global_step, {tag: float(value)}))
+            return
+        if isinstance(value, torch.Tensor):
+            # A reduced copy: the training loop may still change the tensor in place (e.g. `loss += ...`)
+            value = value.detach().float().mean()
+        self._values.setdefault(tag, []).append(value)
+
+    def step(self):
+        self.global_step += 1
+        if self.global_step % self.flush_every == 0:
+            self.flush()
+
+    def _reduce(self):
+        tags = list(self._values)
+        means = []
+        for tag in tags:
+            values = self._values[tag]
+            if all(isinstance(value, torch.Tensor) for value in values):
+                means.append(torch.stack(values).mean())
+            else:
+                means.append(sum(float(value) for value in values) / len(values))
+        # One transfer for the means of the tensors on each device
+        by_device = OrderedDict()
+        for i, mean in enumerate(means):
+            if isinstance(mean, torch.Tensor):
+                by_device.setdefault(mean.device, []).append(i)
+        for indices in by_device.values():
+            for i, value in zip(indices, torch.stack([means[i] for i in indices]).tolist()):
+                means[i] = value
+        self._values = OrderedDict()
+        return OrderedDict(zip(tags, means))
+
+    def flush(self):
+        """Reduce the collected scalars and hand them to the background thread."""
+        if self._values:
+            self._queue.put((self.global_step, self._reduce()))
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                return
+            step, values = item
+            for sink in self.sinks:
+                try:
+                    sink.write(step, values)
+                except Exception:
+                    logger.exception("Could not write metrics to %s", type(sink).__name__)
+
+    def close(self):
+        self.flush()
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+
+def get_metrics_writer(args):
+    """
+    The `MetricsWriter` for --metrics_sink and --metrics_every, writing into --output_dir. In distributed training,
+    only the main process writes its metrics.
+    """
+    sinks = []
+    if not is_main_process():
+        return MetricsWriter(sinks, flush_every=args.metrics_every)
+    if args.metrics_sink == "tensorboard":
+        sinks.append(TensorBoardSink(os.path.join(args.output_dir, "runs")))
+    elif args.metrics_sink == "jsonl":
+        sinks.append(JsonlSink(os.path.join(args.output_dir, "metrics.jsonl")))
+    return MetricsWriter(sinks, flush_every=args.metrics_every)
@@ -0,0 +1,196 @@
+"""
+Packing of several short sentences into one BERT input sequence.
+
+Most CoNLL sentences are much shorter than the maximum sequence length, so `PackedDataset` fills each sequence
+with as many features (each with its own [CLS] and [SEP]) as fit. In a packed batch, the input mask numbers the
+feature that a token belongs to (1, 2, ...; 0 for padding) instead of being 0/1. For a model marked with
+`set_packed`, `encode` turns that into position ids that restart for every feature and a block-diagonal attention
+mask, so the features cannot attend to each other and get the same outputs as if they were encoded on their own.
+Whether batches are packed is known from the dataset, so `encode` does not inspect the mask on the device (which
+would wait for the GPU on every forward pass); unpacked batches give the same outputs on the packed path.
+"""
+
+import bisect
+from collections import defaultdict
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from .activation_checkpointing import CheckpointedEncoder
+
+
+def pack_lengths(lengths, max_seq_length, groups=None):
+    """
+    Assign sequences of the given lengths to packs of at most `max_seq_length` positions (best fit, longest
+    sequences first). Sequences of different `groups` are never packed together. Returns a list of packs, each a
+    list of sequence indices in increasing order.
+    """
+    lengths = np.minimum(np.asarray(lengths), max_seq_length)
+    if groups is None:
+        groups = np.zeros(len(lengths), dtype=np.int64)
+    packs = []
+    for group in np.unique(groups):
+        indices = np.flatnonzero(groups == group)
+        # Open packs by the number of free positions they have left, and the sorted list of those numbers
+        packs_by_space = defaultdict(list)
+        spaces = []
+        for index in indices[np.argsort(-lengths[indices], kind="stable")].tolist():
+            length = int(lengths[index])
+            i = bisect.bisect_left(spaces, length)
+            if i == len(spaces):
+                pack = []
+                packs.append(pack)
+                space = max_seq_length
+            else:
+                space = spaces[i]
+                pack = packs_by_space[space].pop()
+                if not packs_by_space[space]:
+                    del spaces[i]
+            pack.append(index)
+            space -= length
+            if space > 0:
+                if not packs_by_space[space]:
+                    bisect.insort(spaces, space)
+                packs_by_space[space].append(pack)
+    packs = [sorted(pack) for pack in packs]
+    packs.sort(key=lambda pack: pack[0])
+    return packs
+
+
+class PackedDataset(Dataset):
+    """
+    Dataset over packs of `ColumnarFeatures`, with the same items as `ColumnarFeatureDataset`. Every item is one
+    sequence of `max_seq_length` positions that holds one or more features; if `example_indices` is set, the last
+    element is the index of the pack, which `split_logits` takes to assign the logits to the features. The features
+    of a pack share the language id, if there is one.
+    """
+
+    def __init__(self, features, max_seq_length, labels=True, language_ids=False, example_indices=False):
+        self.features = features
+        self.max_seq_length = max_seq_length
+        self.offsets = features.columns["offsets"]
+        feature_lengths = np.minimum(features.lengths, max_seq_length)
+        groups = features.columns["language_id"] if language_ids else None
+        self.packs = pack_lengths(feature_lengths, max_seq_length, groups)
+        self.feature_lengths = feature_lengths
+        self.lengths = np.array([feature_lengths[pack].sum() for pack in self.packs], dtype=np.int64)
+        self.input_ids = torch.from_numpy(features.columns["input_ids"])
+        self.loss_mask = torch.from_numpy(features.columns["loss_mask"])
+        self.label_ids = torch.from_numpy(features.columns["label_ids"]) if labels else None
+        self.language_ids = torch.from_numpy(features.columns["language_id"]) if language_ids else None
+        self.example_indices = example_indices
+
+    def _concatenate(self, column, pack):
+        padded = torch.zeros(self.max_seq_length, dtype=torch.long)
+        position = 0
+        for index in pack:
+            start, length = int(self.offsets[index]), int(self.feature_lengths[index])
+            padded[position:position + length] = column[start:start + length]
+            position += length
+        return padded
+
+    def __getitem__(self, index):
+        pack = self.packs[index]
+        input_mask = torch.zeros(self.max_seq_length, dtype=torch.long)
+        position = 0
+        for segment, feature_index in enumerate(pack, 1):
+            length = int(self.feature_lengths[feature_index])
+            input_mask[position:position + length] = segment
+            position += length
+        item = [
+            self._concatenate(self.input_ids, pack),
+            input_mask,
+            self._concatenate(self.loss_mask, pack),
+            torch.zeros(self.max_seq_length, dtype=torch.long),
+        ]
+        if self.label_ids is not None:
+            item.append(self._concatenate(self.label_ids, pack))
+        if self.language_ids is not None:
+            item.append(self.language_ids[pack[0]].long())
+        if self.example_indices:
+            item.append(torch.tensor(index, dtype=torch.long))
+        return tuple(item)
+
+    def split_logits(self, index, logits):
+        """Yield the feature index and the logits of every feature in pack `index`."""
+        position = 0
+        for feature_index in self.packs[index]:
+            length = int(self.feature_lengths[feature_index])
+            yield feature_index, logits[position:position + length]
+            position += length
+
+    def __len__(self):
+        return len(self.packs)
+
+
+def set_packed(model, packed):
+    """Whether `model` (a BERT token classifier of the run scripts) gets packed batches, see `encode`."""
+    model.packed = packed
+
+
+def _get_position_ids(input_mask):
+    """Positions that restart at 0 for every feature of a packed input mask."""
+    # A sequence holds at most as many features as positions, so their number need not be read from the device
+    input_mask = input_mask.long()
+    segment_lengths = torch.zeros(input_mask.size(0), input_mask.size(1) + 1, dtype=torch.long,
+                                  device=input_mask.device)
+    segment_lengths.scatter_add_(1, input_mask, torch.ones_like(input_mask))
+    segment_lengths = segment_lengths[:, 1:]
+    segment_starts = torch.cumsum(segment_lengths, 1) - segment_lengths
+    token_starts = segment_starts.gather(1, (input_mask - 1).clamp(min=0))
+    positions = torch.arange(input_mask.size(1), dtype=torch.long, device=input_mask.device)
+    return (positions.unsqueeze(0) - token_starts) * (input_mask > 0).long()
+
+
+def _embed(bert, input_ids, token_type_ids, attention_mask):
+    if token_type_ids is None:
+        token_type_ids = torch.zeros_like(input_ids)
+    embeddings = bert.embeddings
+    embedding_output = (embeddings.word_embeddings(input_ids)
+                        + embeddings.position_embeddings(_get_position_ids(attention_mask))
+                        + embeddings.token_type_embeddings(token_type_ids))
+    return embeddings.dropout(embeddings.LayerNorm(embedding_output))
+
+
+def _get_extended_attention_mask(bert, attention_mask):
+    # [batch_size, 1, from_seq_length, to_seq_length], 1 where both tokens belong to the same feature
+    same_segment = (attention_mask.unsqueeze(2) == attention_mask.unsqueeze(1)) & (attention_mask.unsqueeze(1) > 0)
+    extended_attention_mask = same_segment.unsqueeze(1).to(dtype=next(bert.parameters()).dtype)
+    return (1.0 - extended_attention_mask) * -10000.0
+
+
+def encode(bert, input_ids, token_type_ids=None, attention_mask=None, frozen_output=None, packed=False):
+    """
+    The sequence output of a `BertModel`. Without `packed`, batches (with a 0/1 attention mask) go through the model
+    unchanged; with it, they may be packed and get per-feature position ids and a block-diagonal attention mask. If
+    `frozen_output` holds the output of the frozen bottom layers (see `frozen_layers.py`), only the layers above them
+    are run.
+    """
+    if frozen_output is None and not packed:
+        sequence_output, _ = bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False)
+        return sequence_output
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    extended_attention_mask = _get_extended_attention_mask(bert, attention_mask)
+    if frozen_output is not None:
+        hidden_states = frozen_output.to(dtype=extended_attention_mask.dtype)
+        start = bert.num_frozen_layers
+        if isinstance(bert.encoder, CheckpointedEncoder):
+            return bert.encoder(hidden_states, extended_attention_mask, output_all_encoded_layers=False,
+                                start=start)[-1]
+        for layer_module in bert.encoder.layer[start:]:
+            hidden_states = layer_module(hidden_states, extended_attention_mask)
+        return hidden_states
+    embedding_output = _embed(bert, input_ids, token_type_ids, attention_mask)
+    encoded_layers = bert.encoder(embedding_output, extended_attention_mask, output_all_encoded_layers=False)
+    return encoded_layers[-1]
+
+
+def encode_bottom(bert, input_ids, token_type_ids, attention_mask, num_layers):
+    """The output of the embeddings and the bottom `num_layers` encoder layers of a `BertModel`."""
+    hidden_states = _embed(bert, input_ids, token_type_ids, attention_mask)
+    extended_attention_mask = _get_extended_attention_mask(bert, attention_mask)
+    for layer_module in bert.encoder.layer[:num_layers]:
+        hidden_states = layer_module(hidden_states, extended_attention_mask)
+    return hidden_states
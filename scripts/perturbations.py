@@ -258,6 +258,10 @@ class SwapPerturbation(Perturbation):
         perturbed_token_mask *= input_mask.byte()  # Ignore pads
         left_mask = torch.ones_like(input_ids)
         left_mask[:, :2] = 0  # Ensure that there is a left neighbour that is not [CLS]
+        # Ensure that there is a right neighbour. Batches trimmed by dynamic padding end with real tokens; without
+        # dynamic padding, only sequences that fill all of max_seq_length do, and their last token ([SEP]) could
+        # otherwise be picked and index past the end of the batch
+        left_mask[:, -1] = 0
         perturbed_token_mask *= left_mask.byte()
         if self.exclude_names:
             nonames_mask_b = logits.argmax(dim=-1) == 0  # 0 is ID of "O" tag
@@ -0,0 +1,66 @@
+"""
+Host-to-device transfer of training batches.
+
+`BatchPipeline.stage` copies a batch into pinned host buffers; it runs on the background thread of the
+`StreamScheduler`. The training loop then moves the staged batch with `to_device`, a non-blocking copy, so it does
+not wait for the transfer. The pinned buffers are preallocated once and reused: a set of buffers goes back to the
+pool as soon as the copy out of it has finished on the GPU, and only grows when a batch is larger than any before.
+"""
+
+import collections
+import threading
+
+import torch
+
+
+class StagedBatch(tuple):
+    """A batch of tensors in pinned host memory; `buffers` are the pooled buffers that hold them."""
+    buffers = None
+
+
+class BatchPipeline:
+    """
+    Stages batches in pinned memory and moves them to `device`. Without `pin_memory` (e.g. on the CPU or with
+    DataParallel, which scatters the batches itself), batches are left as they are and moved synchronously.
+    """
+
+    def __init__(self, device, pin_memory=True):
+        self.device = device
+        self.pin_memory = pin_memory and device is not None and device.type == "cuda"
+        self._free = []
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            while self._pending and self._pending[0][0].query():
+                self._free.append(self._pending.popleft()[1])
+            if self._free:
+                return self._free.pop()
+        return []
+
+    def stage(self, batch):
+        if not self.pin_memory:
+            return batch
+        buffers = self._acquire()
+        tensors = []
+        for i, tensor in enumerate(batch):
+            if i == len(buffers):
+                buffers.append(None)
+            buffer = buffers[i]
+            if buffer is None or buffer.dtype != tensor.dtype or buffer.numel() < tensor.numel():
+                buffer = buffers[i] = torch.empty(tensor.numel(), dtype=tensor.dtype).pin_memory()
+            tensors.append(buffer[:tensor.numel()].view(tensor.size()).copy_(tensor))
+        staged = StagedBatch(tensors)
+        staged.buffers = buffers
+        return staged
+
+    def to_device(self, batch):
+        if not isinstance(batch, StagedBatch):
+            return tuple(t.to(self.device) for t in batch)
+        moved = tuple(t.to(self.device, non_blocking=True) for t in batch)
+        copied = torch.cuda.Event()
+        copied.record()
+        with self._lock:
+            self._pending.append((copied, batch.buffers))
+        return moved
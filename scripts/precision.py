@@ -0,0 +1,78 @@
+"""
+Mixed-precision training and inference with `torch.autocast`, without apex.
+
+With --precision bf16 or fp16, the models run their BERT encoder under autocast: matrix multiplications use the
+reduced precision, on the CPU (bf16) as well as on the GPU. The classifier, the losses and the optimizer stay in
+fp32. fp16 has a small exponent range, so its losses are scaled by `LossScaler` to keep gradients from
+underflowing; bf16 has the range of fp32 and needs no scaling.
+"""
+
+import contextlib
+
+import torch
+
+PRECISIONS = ["fp32", "bf16", "fp16"]
+
+
+def get_dtype(precision):
+    return {"fp32": torch.float32, "bf16": getattr(torch, "bfloat16", None), "fp16": torch.float16}[precision]
+
+
+def check_precision(precision, device, fp16=False):
+    """Raise a ValueError if `precision` cannot be used on `device` with this torch version."""
+    if precision == "fp32":
+        return
+    if fp16:
+        raise ValueError("--precision {} and --fp16 (apex) cannot be combined".format(precision))
+    if not hasattr(torch, "autocast"):
+        raise ValueError("--precision {} needs torch >= 1.10".format(precision))
+    if precision == "fp16" and device.type != "cuda":
+        raise ValueError("--precision fp16 needs a GPU, use bf16 on the CPU")
+
+
+def set_precision(model, precision):
+    """Run the encoder of `model` (a BERT token classifier of the run scripts) in `precision`."""
+    model.precision = precision
+
+
+@contextlib.contextmanager
+def _full_precision():
+    yield
+
+
+def autocast(model):
+    """Autocast context for the forward pass of `model` in the precision that `set_precision` gave it."""
+    precision = getattr(model, "precision", "fp32")
+    if precision == "fp32":
+        return _full_precision()
+    device_type = next(model.parameters()).device.type
+    return torch.autocast(device_type=device_type, dtype=get_dtype(precision))
+
+
+class LossScaler:
+    """
+    Backward pass and optimizer step for `precision`. For fp16, the loss is scaled dynamically (`GradScaler`), and
+    steps with infinite gradients are skipped; otherwise, these are plain `backward()` and `step()` calls.
+    """
+
+    def __init__(self, precision):
+        self.scaler = torch.cuda.amp.GradScaler() if precision == "fp16" else None
+
+    def backward(self, loss):
+        if self.scaler is not None:
+            loss = self.scaler.scale(loss)
+        loss.backward()
+
+    def step(self, optimizer):
+        if self.scaler is None:
+            optimizer.step()
+            return
+        self.scaler.step(optimizer)
+        self.scaler.update()
+
+    def state_dict(self):
+        return self.scaler.state_dict() if self.scaler is not None else {}
+
+    def load_state_dict(self, state):
+        if self.scaler is not None and state:
+            self.scaler.load_state_dict(state)
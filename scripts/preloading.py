@@ -0,0 +1,58 @@
+"""
+Resources that the runs of a sweep load only once.
+
+`scripts.sweep` runs many configurations of a run script, each in a process forked from the sweep. The tokenizer
+vocabulary, the examples, their features and the pretrained weights are the same for all of them, so the run scripts
+get them through `preloaded`: the first call with a key loads the resource, and later calls in the same process, or
+in processes forked from it, return it again. The sweep fills these resources by running the script once under
+`preload_only()`, where the script stops with `PreloadComplete` at `end_of_preloading()`, after the model has been
+built and before anything is put on a GPU.
+
+The pretrained weights are not loaded here: models map them from the `scripts.weights_store`, whose pages the jobs
+share through the page cache.
+"""
+
+import contextlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+_resources = {}
+_preload_only = False
+
+
+class PreloadComplete(Exception):
+    """Raised by `end_of_preloading` under `preload_only()`."""
+
+
+def preloaded(key, load):
+    """The resource stored under `key`, loaded with `load()` on first use."""
+    if key not in _resources:
+        _resources[key] = load()
+    return _resources[key]
+
+
+def preloaded_resources():
+    return list(_resources.values())
+
+
+@contextlib.contextmanager
+def preload_only():
+    """Make run scripts stop at `end_of_preloading`, once they have loaded their resources."""
+    global _preload_only
+    _preload_only = True
+    try:
+        yield
+    finally:
+        _preload_only = False
+
+
+def end_of_preloading():
+    if _preload_only:
+        raise PreloadComplete()
+
+
+def load_tokenizer(bert_model, do_lower_case):
+    from .caching_tokenizer import load_bert_tokenizer
+    return preloaded(("tokenizer", bert_model, bool(do_lower_case)),
+                     lambda: load_bert_tokenizer(bert_model, do_lower_case))
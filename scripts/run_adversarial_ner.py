@@ -19,39 +19,50 @@ from __future__ import absolute_import, division, print_function
 
 import argparse
 import collections
+import functools
 import itertools
 import logging
-from copy import deepcopy
 
 import math
 import os
 import random
-import sys
 from io import open
 
 import numpy as np
 import torch
 from torch.nn import CrossEntropyLoss
-from torch.utils.data import (DataLoader, RandomSampler,
-                              TensorDataset, SequentialSampler)
-from torch.utils.data.distributed import DistributedSampler
+from torch.utils.data import DataLoader, SequentialSampler
 from tqdm import tqdm, trange
-from tensorboardX import SummaryWriter
 
 from pytorch_pretrained_bert.file_utils import PYTORCH_PRETRAINED_BERT_CACHE
 from pytorch_pretrained_bert.modeling import BertConfig, WEIGHTS_NAME, CONFIG_NAME, BertForTokenClassification
 from pytorch_pretrained_bert.optimization import BertAdam, warmup_linear
-from pytorch_pretrained_bert.tokenization import BertTokenizer
 
+from .activation_checkpointing import enable_activation_checkpointing
+from .async_evaluation import AsyncEvaluator
+from .batching import PaddingStatistics, count_optimization_steps, get_collate_fn, get_train_dataloader
+from .caching_tokenizer import CachingTokenizer
+from .checkpointing import CheckpointManager, get_training_state, restore_training_state
+from .conll import CoNLLCorpus
 from .conlleval import evaluate
+from .distributed import (broadcast_flag, distribute_model, get_rank, get_sampler, gradient_sync, init_distributed,
+                          is_main_process, release_other_processes, wait_for_main_process)
+from .feature_cache import FeatureCache
+from .featurization import Featurizer, convert_examples_to_columns
+from .frozen_layers import FrozenOutputDataset, freeze_layers, get_frozen_outputs
+from .metrics import get_metrics_writer
+from .packing import PackedDataset, encode, set_packed
+from .pipeline import BatchPipeline
+from .precision import PRECISIONS, LossScaler, autocast, check_precision, set_precision
+from .preloading import end_of_preloading, load_tokenizer, preloaded
+from .scheduling import StreamScheduler
+from .startup_profile import StartupProfile
+from .step_profiler import StepProfiler, check_profile_trace, phase
+from .windowing import merge_window_predictions
+from .weights_store import from_pretrained
 
 from .adversarial import BertForAdversarialFinetuning
 
-if sys.version_info[0] == 2:
-    import cPickle as pickle
-else:
-    import pickle
-
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
                     datefmt='%m/%d/%Y %H:%M:%S',
                     level=logging.INFO)
@@ -60,8 +71,13 @@ logger = logging.getLogger(__name__)
 
 class AdversarialBertForNER(BertForAdversarialFinetuning):
 
-    def forward(self, input_ids, token_type_ids=None, attention_mask=None, loss_mask=None, labels=None, languages=None):
-        sequence_output, _ = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False)
+    def forward(self, input_ids, token_type_ids=None, attention_mask=None, loss_mask=None, labels=None, languages=None,
+                frozen_output=None):
+        with autocast(self):
+            sequence_output = encode(self.bert, input_ids, token_type_ids, attention_mask, frozen_output,
+                                     packed=getattr(self, "packed", False))
+        # Autocast outputs go back to the dtype of the classifier: fp32, or fp16 after apex's `model.half()`
+        sequence_output = sequence_output.to(dtype=self.classifier.weight.dtype)
         sequence_output = self.dropout(sequence_output)
         logits = self.classifier(sequence_output)
 
@@ -140,43 +156,8 @@ class NERExample(object):
         return s
 
 
-class InputFeatures(object):
-    """A single set of features of data."""
-
-    def __init__(self,
-                 unique_id,
-                 example_index,
-                 tokens,
-                 token_to_orig_map,
-                 input_ids,
-                 input_mask,
-                 loss_mask,
-                 segment_ids,
-                 label_ids,
-                 language_id,
-                 ):
-        self.unique_id = unique_id
-        self.example_index = example_index
-        self.tokens = tokens
-        self.token_to_orig_map = token_to_orig_map
-        self.input_ids = input_ids
-        self.input_mask = input_mask
-        self.loss_mask = loss_mask
-        self.segment_ids = segment_ids
-        self.label_ids = label_ids
-        self.language_id = language_id
-
-
-def _is_divider(line: str) -> bool:
-    empty_line = line.strip() == ''
-    if empty_line:
-        return True
-    else:
-        first_token = line.split()[0]
-        if first_token == "-DOCSTART-":  # pylint: disable=simplifiable-if-statement
-            return True
-        else:
-            return False
+def _language_files(input_file, languages):
+    return [input_file.replace(".lang", ".{}".format(language)) for language in languages]
 
 
 def read_ner_examples(input_file, is_training, languages):
@@ -184,140 +165,32 @@ def read_ner_examples(input_file, is_training, languages):
     label_vocab = LabelVocab()
 
     examples = []
-    for language in languages:
-        language_file = input_file.replace(".lang", ".{}".format(language))
-        with open(language_file, "r", encoding='utf-8') as f:
-            for is_divider, lines in itertools.groupby(f, _is_divider):
-                # Ignore the divider chunks, so that `lines` corresponds to the words
-                # of a single sentence.
-                if not is_divider:
-                    fields = [line.strip().split() for line in lines]
-                    # unzipping trick returns tuples, but our Fields need lists
-                    fields = [list(field) for field in zip(*fields)]
-                    tokens = fields[0]
-                    ner_tags = fields[-1]
-                    example = NERExample(
-                        tokens=tokens,
-                        labels=ner_tags,
-                        label_vocab=label_vocab,
-                        language=language,
-                    )
-                    label_vocab.update(example)
-                    examples.append(example)
+    for language, language_file in zip(languages, _language_files(input_file, languages)):
+        for tokens, ner_tags in CoNLLCorpus.read(language_file).iter_sentences():
+            example = NERExample(
+                tokens=tokens,
+                labels=ner_tags,
+                label_vocab=label_vocab,
+                language=language,
+            )
+            label_vocab.update(example)
+            examples.append(example)
     return examples
 
 
-def convert_examples_to_features(examples, tokenizer, max_seq_length, is_training, languages):
-    """Loads a data file into a list of `InputBatch`s."""
+def convert_examples_to_features(examples, tokenizer, max_seq_length, is_training, languages, start_index=0,
+                                 window_stride=None):
+    """
+    Featurizes examples into `ColumnarFeatures`. `start_index` is the index of the first example, for
+    featurizing a shard of a dataset. With a `window_stride`, sentences that do not fit into `max_seq_length` are
+    split into overlapping windows, one feature each, instead of being truncated.
+    """
     label_vocab = examples[0].label_vocab
     label_vocab.build()
-    logger.info("Labels: {}".format(label_vocab))
-
-    unique_id = 1000000000
-
-    features = []
-
-    for (example_index, example) in enumerate(examples):
-
-        tok_to_orig_index = []
-        orig_to_tok_index = []
-        all_tokens = []
-        all_labels = []
-        for i, (token, label) in enumerate(zip(example.tokens, example.labels)):
-            orig_to_tok_index.append(len(all_tokens))
-            sub_tokens = tokenizer.tokenize(token)
-            for sub_token in sub_tokens:
-                tok_to_orig_index.append(i)
-                all_tokens.append(sub_token)
-                all_labels.append(label)
-
-        # The -3 accounts for [CLS] and [SEP]
-        max_tokens = max_seq_length - 2
-        all_tokens = all_tokens[:max_tokens]
-        all_labels = all_labels[:max_tokens]
-
-        tokens = []
-        segment_ids = []
-        labels = []
-        tokens.append("[CLS]")
-        segment_ids.append(0)
-        labels.append('O')
-        for token, label in zip(all_tokens, all_labels):
-            tokens.append(token)
-            segment_ids.append(0)
-            labels.append(label)
-
-        tokens.append("[SEP]")
-        segment_ids.append(0)
-        labels.append('O')
-
-        token_to_orig_map = {(token_index + 1): orig_index for token_index, orig_index in enumerate(tok_to_orig_index)}
-
-        input_ids = tokenizer.convert_tokens_to_ids(tokens)
-        label_ids = label_vocab.convert_labels_to_ids(labels)
-
-        # The mask has 1 for real tokens and 0 for padding tokens. Only real
-        # tokens are attended to.
-        input_mask = [1] * len(input_ids)
-
-        # When computing loss, ignore tail WordPieces
-        loss_mask = deepcopy(input_mask)
-        for i, token in enumerate(tokens):
-            if token.startswith("##"):
-                loss_mask[i] = 0
-
-        # Zero-pad up to the sequence length.
-        while len(input_ids) < max_seq_length:
-            input_ids.append(0)
-            input_mask.append(0)
-            loss_mask.append(0)
-            segment_ids.append(0)
-            label_ids.append(0)
-
-        assert len(input_ids) == max_seq_length
-        assert len(input_mask) == max_seq_length
-        assert len(loss_mask) == max_seq_length
-        assert len(segment_ids) == max_seq_length
-        assert len(label_ids) == max_seq_length
-
-        language_id = languages.index(example.language)
-
-        if example_index < 20:
-            logger.info("*** Example ***")
-            logger.info("unique_id: %s" % (unique_id))
-            logger.info("example_index: %s" % (example_index))
-            logger.info("tokens: %s" % " ".join(tokens))
-            logger.info("token_to_orig_map: %s" % " ".join([
-                "%d:%d" % (x, y) for (x, y) in token_to_orig_map.items()]))
-            logger.info("input_ids: %s" % " ".join([str(x) for x in input_ids]))
-            logger.info(
-                "input_mask: %s" % " ".join([str(x) for x in input_mask]))
-            logger.info(
-                "loss_mask: %s" % " ".join([str(x) for x in loss_mask]))
-            logger.info(
-                "segment_ids: %s" % " ".join([str(x) for x in segment_ids]))
-            logger.info("labels: %s" % " ".join(labels))
-            logger.info(
-                "label_ids: %s" % " ".join([str(x) for x in label_ids]))
-            logger.info("language_id: %s" % language_id)
-
-        features.append(
-            InputFeatures(
-                unique_id=unique_id,
-                example_index=example_index,
-                tokens=tokens,
-                token_to_orig_map=token_to_orig_map,
-                input_ids=input_ids,
-                input_mask=input_mask,
-                loss_mask=loss_mask,
-                segment_ids=segment_ids,
-                label_ids=label_ids,
-                language_id=language_id,
-            )
-        )
-        unique_id += 1
-
-    return features
+    if start_index == 0:
+        logger.info("Labels: {}".format(label_vocab))
+    return convert_examples_to_columns(examples, tokenizer, max_seq_length, label_vocab, start_index=start_index,
+                                       window_stride=window_stride, languages=languages)
 
 
 RawResult = collections.namedtuple("RawResult",
@@ -328,25 +201,20 @@ def write_predictions(all_examples, all_features, all_results,
                       output_prediction_file, verbose_logging):
     logger.info("Writing predictions to: %s" % (output_prediction_file))
 
+    all_head_labels = []
+    for features, result in zip(all_features, all_results):
+        # Only the head WordPieces predict labels, in the window where they have the most context
+        head_logits = result.logits[torch.from_numpy(features.head_positions)]
+        label_vocab = all_examples[features.example_index].label_vocab
+        all_head_labels.append(label_vocab.convert_ids_to_labels(head_logits.argmax(dim=1).tolist()))
+    example_predictions = merge_window_predictions(all_features, all_head_labels)
+
     all_predictions = []
     all_true_labels = []
-    for example, features, result in zip(all_examples, all_features, all_results):
-        max_scores = result.logits.argmax(dim=1).tolist()
-        raw_labels = example.label_vocab.convert_ids_to_labels(max_scores)
-        # Remove padding and copy head tags to tail (with B=>I)
-        predicted_labels = []
-        true_labels = []
-        last_orig_index = -1
-        for i, token in enumerate(features.tokens):
-            if token in ["[CLS]", "[SEP]"]:
-                continue
-            orig_index = features.token_to_orig_map[i]
-            if orig_index == last_orig_index:
-                continue  # Tail WordPiece
-            # Head WordPiece
-            predicted_labels.append(raw_labels[i])
-            true_labels.append(example.labels[orig_index])
-            last_orig_index = orig_index
+    for example_index, example in enumerate(all_examples):
+        token_predictions = example_predictions.get(example_index, [])
+        predicted_labels = [label for _, label in token_predictions]
+        true_labels = [example.labels[orig_index] for orig_index, _ in token_predictions]
         try:
             assert len(predicted_labels) == len(example.labels)
         except AssertionError:
@@ -370,7 +238,7 @@ def write_predictions(all_examples, all_features, all_results,
     return evaluate(flat_true_labels, flat_predicted_labels, verbose=True)
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser()
 
     ## Required parameters
@@ -386,7 +254,12 @@ def main():
     parser.add_argument("--predict_file", default=None, type=str)
     parser.add_argument("--max_seq_length", default=384, type=int,
                         help="The maximum total input sequence length after WordPiece tokenization. Sequences "
-                             "longer than this will be truncated, and sequences shorter than this will be padded.")
+                             "longer than this will be truncated (or split, see --window_stride), and sequences "
+                             "shorter than this will be padded.")
+    parser.add_argument("--window_stride", default=None, type=int,
+                        help="Split sentences that are longer than the maximum sequence length into overlapping "
+                             "windows that start every N WordPieces, instead of truncating them. Each token is "
+                             "predicted in the window where it has the most context.")
     parser.add_argument("--do_train", action='store_true', help="Whether to run training.")
     parser.add_argument("--do_predict", action='store_true', help="Whether to run eval on the dev set.")
     parser.add_argument("--train_batch_size", default=32, type=int, help="Total batch size for training.")
@@ -416,10 +289,22 @@ def main():
     parser.add_argument("--local_rank",
                         type=int,
                         default=-1,
-                        help="local_rank for distributed training on gpus")
+                        help="local_rank for distributed training: one GPU per process, or gloo on the CPU with "
+                             "--no_cuda (also read from LOCAL_RANK, see scripts/launch_distributed.py)")
     parser.add_argument('--fp16',
                         action='store_true',
                         help="Whether to use 16-bit float precision instead of 32-bit")
+    parser.add_argument('--precision', default="fp32", choices=PRECISIONS,
+                        help="Precision of the BERT encoder with torch.autocast (no apex needed): bf16 on the CPU or "
+                             "GPU, or fp16 with loss scaling on the GPU.")
+    parser.add_argument('--activation_checkpointing', default=0, type=int,
+                        help="Recompute the activations of the BERT encoder in the backward pass instead of keeping "
+                             "them, in segments of this many layers (0: keep all activations). Saves memory at the "
+                             "cost of about one more forward pass.")
+    parser.add_argument('--freeze_layers', default=0, type=int,
+                        help="Freeze the embeddings and this many bottom layers of the BERT encoder. Their output is "
+                             "computed once per training sentence and cached in <output_dir>/frozen_layers, so that "
+                             "training only runs the layers above them.")
     parser.add_argument('--loss_scale',
                         type=float, default=0,
                         help="Loss scaling to improve fp16 numeric stability. Only used when fp16 set to True.\n"
@@ -428,28 +313,86 @@ def main():
     parser.add_argument('--evaluate_each_epoch',
                         action='store_true',
                         help="Whether to run the evaluation script after every training epoch")
+    parser.add_argument('--async_evaluation',
+                        action='store_true',
+                        help="With --evaluate_each_epoch, evaluate snapshots of the model in a separate process on "
+                             "the same device while training goes on.")
     parser.add_argument('--early_stopping',
                         action='store_true',
                         help="Whether to stop finetuning of F1 score on validation set does not improve")
     parser.add_argument('--train_languages', nargs='+', help='<Required> Finetuning languages', required=False)
     parser.add_argument('--predict_languages', nargs='+', help='Validation/prediction languages', required=False)
-    args = parser.parse_args()
-
-    if args.local_rank == -1 or args.no_cuda:
-        device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
-        n_gpu = torch.cuda.device_count()
-    else:
-        torch.cuda.set_device(args.local_rank)
-        device = torch.device("cuda", args.local_rank)
-        n_gpu = 1
-        # Initializes the distributed backend which will take care of sychronizing nodes/GPUs
-        torch.distributed.init_process_group(backend='nccl')
+    parser.add_argument("--dynamic_padding", action='store_true',
+                        help="Pad every batch only to its longest member and batch sentences of similar length.")
+    parser.add_argument("--max_tokens_per_batch", default=None, type=int,
+                        help="With --dynamic_padding, also limit training batches by their padded number of tokens.")
+    parser.add_argument("--pack_sequences", action='store_true',
+                        help="Pack several sentences of the same language into each sequence for training and "
+                             "prediction. The sentences cannot attend to each other and have their own position ids.")
+    parser.add_argument("--num_workers", default=0, type=int,
+                        help="Number of DataLoader worker processes that assemble the training batches.")
+    parser.add_argument("--prefetch", default=2, type=int,
+                        help="Number of training steps whose batches are prepared ahead on a background thread and "
+                             "staged in pinned memory for the GPU (0 to prepare them in the training loop).")
+    parser.add_argument("--metrics_sink", default="tensorboard", choices=["tensorboard", "jsonl", "none"],
+                        help="Where training metrics go: TensorBoard event files in <output_dir>/runs, "
+                             "<output_dir>/metrics.jsonl (without importing tensorboardX) or nowhere.")
+    parser.add_argument("--metrics_every", default=20, type=int,
+                        help="Number of training steps whose metrics are averaged and written together.")
+    parser.add_argument("--checkpoint_dir", default=None, type=str,
+                        help="Directory for resumable training checkpoints (default: <output_dir>/checkpoints).")
+    parser.add_argument("--checkpoint_every", default=0, type=int,
+                        help="Also save a checkpoint every n optimization steps, not only after every epoch.")
+    parser.add_argument("--keep_checkpoints", default=2, type=int,
+                        help="Number of recent checkpoints to keep, in addition to the one with the best F1.")
+    parser.add_argument("--resume", action='store_true',
+                        help="Continue training from the latest checkpoint, in the middle of an epoch if need be.")
+    parser.add_argument("--num_featurize_workers", default=1, type=int,
+                        help="Number of processes that tokenize the datasets. With more than one, the training, "
+                             "evaluation and unsupervised datasets are featurized at the same time.")
+    parser.add_argument("--wordpiece_cache_size", default=100000, type=int,
+                        help="Number of words whose WordPieces are kept in memory during tokenization.")
+    parser.add_argument("--wordpiece_table", default=None, type=str,
+                        help="File with the WordPiece ids of previously tokenized words. It is read at startup "
+                             "and updated with the most frequently used words of this run.")
+    parser.add_argument("--features_cache_dir", default=None, type=str,
+                        help="Directory of the shared feature cache. Defaults to a 'features' directory in the "
+                             "pytorch_pretrained_bert cache.")
+    parser.add_argument("--features_cache_max_gb", default=20.0, type=float,
+                        help="Size cap of the feature cache; least recently used features are evicted beyond it.")
+    parser.add_argument("--weights_cache_dir", default=None, type=str,
+                        help="Directory of the shared store of extracted pretrained weights, which all processes map "
+                             "into memory. Defaults to a 'weights' directory in the pytorch_pretrained_bert cache.")
+    parser.add_argument("--profile_startup", action='store_true',
+                        help="Log how long the imports, the tokenizer, the featurization and the model take until "
+                             "the first batch, and write the times to <output_dir>/startup_profile.json.")
+    parser.add_argument("--profile_steps", action='store_true',
+                        help="Time the phases of every training step (forward passes, backward, optimizer step, "
+                             "metrics, ...) and log a table of them at the end of every epoch.")
+    parser.add_argument("--profile_trace", default=None, type=int, nargs=2, metavar=("START", "STEPS"),
+                        help="Record the operators of STEPS training batches after the first START ones with "
+                             "torch.profiler and write a Chrome trace to <output_dir>/profile/trace.json. Implies "
+                             "--profile_steps.")
+    args = parser.parse_args(argv)
+    startup_profile = StartupProfile(args.profile_startup, os.path.join(args.output_dir, "startup_profile.json"))
+
+    device, n_gpu = init_distributed(args)
     logger.info("device: {} n_gpu: {}, distributed training: {}, 16-bits training: {}".format(
         device, n_gpu, bool(args.local_rank != -1), args.fp16))
 
+    check_precision(args.precision, device, args.fp16)
+    check_profile_trace(args.profile_trace)
+
     if args.gradient_accumulation_steps < 1:
         raise ValueError("Invalid gradient_accumulation_steps parameter: {}, should be >= 1".format(
             args.gradient_accumulation_steps))
+    if args.window_stride is not None and not 0 < args.window_stride <= args.max_seq_length - 2:
+        raise ValueError("Invalid window_stride parameter: {}, should be between 1 and max_seq_length - 2".format(
+            args.window_stride))
+
+    if args.local_rank != -1 and args.max_tokens_per_batch is not None:
+        raise ValueError("--max_tokens_per_batch cannot be used in distributed training, where all processes need "
+                         "the same number of batches per epoch.")
 
     args.train_batch_size = args.train_batch_size // args.gradient_accumulation_steps
 
@@ -471,193 +414,270 @@ def main():
             raise ValueError(
                 "If `do_predict` is True, then `predict_file` must be specified.")
 
-    if os.path.exists(args.output_dir) and len(os.listdir(args.output_dir)) > 1 and args.do_train:
+    if os.path.exists(args.output_dir) and len(os.listdir(args.output_dir)) > 1 and args.do_train and not args.resume:
         raise ValueError("Output directory () already exists and is not empty.")
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
 
-    tensorboard_writer = SummaryWriter(os.path.join(args.output_dir, "runs"))
+    metrics_writer = get_metrics_writer(args)
+
+    startup_profile.lap("setup")
+    bert_tokenizer = load_tokenizer(args.bert_model, args.do_lower_case)
+    tokenizer = CachingTokenizer(bert_tokenizer, args.wordpiece_cache_size, args.wordpiece_table)
+    startup_profile.lap("tokenizer load")
 
-    tokenizer = BertTokenizer.from_pretrained(args.bert_model, do_lower_case=args.do_lower_case)
+    # Only the main process of every node builds the features; the others load them from its cache afterwards
+    wait_for_main_process(args.local_rank)
+    features_cache_dir = args.features_cache_dir or os.path.join(str(PYTORCH_PRETRAINED_BERT_CACHE), 'features')
+    feature_cache = FeatureCache(features_cache_dir, args.features_cache_max_gb)
+    featurizer = Featurizer(tokenizer, args.num_featurize_workers)
 
     train_examples = None
     num_train_optimization_steps = None
     if args.do_train:
-        train_examples = read_ner_examples(
-            input_file=args.train_file, is_training=True, languages=args.train_languages)
+        train_examples = preloaded(("examples", args.train_file, True, tuple(args.train_languages or ())),
+                                   lambda: read_ner_examples(input_file=args.train_file, is_training=True,
+                                                             languages=args.train_languages))
         num_train_optimization_steps = int(
             len(train_examples) / args.train_batch_size / args.gradient_accumulation_steps) * args.num_train_epochs
         if args.local_rank != -1:
             num_train_optimization_steps = num_train_optimization_steps // torch.distributed.get_world_size()
+        train_featurization = _submit_featurization(featurizer, feature_cache, args, train_examples, args.train_file,
+                                                    args.train_languages, "train features", is_training=True)
 
-    # Prepare model
-    model = AdversarialBertForNER.from_pretrained(args.bert_model,
-                                                  cache_dir=os.path.join(str(PYTORCH_PRETRAINED_BERT_CACHE),
-                                                                         'distributed_{}'.format(args.local_rank)),
-                                                  num_labels=len(
-                                                      train_examples[0].label_vocab) if train_examples else 1,
-                                                  num_languages=len(args.train_languages or args.predict_languages))
-
-    if args.fp16:
-        model.half()
-    model.to(device)
-    if args.local_rank != -1:
-        try:
-            from apex.parallel import DistributedDataParallel as DDP
-        except ImportError:
-            raise ImportError(
-                "Please install apex from https://www.github.com/nvidia/apex to use distributed and fp16 training.")
-
-        model = DDP(model)
-    elif n_gpu > 1:
-        model = torch.nn.DataParallel(model)
-
-    # Prepare optimizer
-    param_optimizer = list(model.named_parameters())
-
-    # hack to remove pooler, which is not used
-    # thus it produce None grad that break apex
-    param_optimizer = [n for n in param_optimizer if 'pooler' not in n[0]]
+    startup_profile.lap("examples")
 
-    no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
-    optimizer_grouped_parameters = [
-        {'params': [p for n, p in param_optimizer if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
-        {'params': [p for n, p in param_optimizer if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
-    ]
+    # Prepare model and optimizer; runs that only predict load the fine-tuned model at the end
+    model = None
+    if args.do_train:
+        weights_cache_dir = args.weights_cache_dir or os.path.join(str(PYTORCH_PRETRAINED_BERT_CACHE), 'weights')
+        model = from_pretrained(AdversarialBertForNER, args.bert_model, weights_cache_dir,
+                                num_labels=len(train_examples[0].label_vocab),
+                                num_languages=len(args.train_languages or args.predict_languages))
+
+        if args.fp16:
+            model.half()
+        set_precision(model, args.precision)
+        set_packed(model, args.pack_sequences)
+        enable_activation_checkpointing(model.bert, args.activation_checkpointing)
+        freeze_layers(model.bert, args.freeze_layers)
+        model.to(device)
 
-    if args.fp16:
-        try:
-            from apex.optimizers import FP16_Optimizer
-            from apex.optimizers import FusedAdam
-        except ImportError:
-            raise ImportError(
-                "Please install apex from https://www.github.com/nvidia/apex to use distributed and fp16 training.")
-
-        optimizer = FusedAdam(optimizer_grouped_parameters,
-                              lr=args.learning_rate,
-                              bias_correction=False,
-                              max_grad_norm=1.0)
-        if args.loss_scale == 0:
-            optimizer = FP16_Optimizer(optimizer, dynamic_loss_scale=True)
+        # Prepare optimizer
+        param_optimizer = list(model.named_parameters())
+
+        # hack to remove pooler, which is not used
+        # thus it produce None grad that break apex
+        param_optimizer = [n for n in param_optimizer if 'pooler' not in n[0]]
+        param_optimizer = [n for n in param_optimizer if n[1].requires_grad]
+
+        no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
+        optimizer_grouped_parameters = [
+            {'params': [p for n, p in param_optimizer if not any(nd in n for nd in no_decay)], 'weight_decay': 0.01},
+            {'params': [p for n, p in param_optimizer if any(nd in n for nd in no_decay)], 'weight_decay': 0.0}
+        ]
+
+        if args.fp16:
+            try:
+                from apex.optimizers import FP16_Optimizer
+                from apex.optimizers import FusedAdam
+            except ImportError:
+                raise ImportError(
+                    "Please install apex from https://www.github.com/nvidia/apex to use distributed and fp16 training.")
+
+            optimizer = FusedAdam(optimizer_grouped_parameters,
+                                  lr=args.learning_rate,
+                                  bias_correction=False,
+                                  max_grad_norm=1.0)
+            if args.loss_scale == 0:
+                optimizer = FP16_Optimizer(optimizer, dynamic_loss_scale=True)
+            else:
+                optimizer = FP16_Optimizer(optimizer, static_loss_scale=args.loss_scale)
         else:
-            optimizer = FP16_Optimizer(optimizer, static_loss_scale=args.loss_scale)
-    else:
-        optimizer = BertAdam(optimizer_grouped_parameters,
-                             lr=args.learning_rate,
-                             warmup=args.warmup_proportion,
-                             t_total=num_train_optimization_steps)
+            optimizer = BertAdam(optimizer_grouped_parameters,
+                                 lr=args.learning_rate,
+                                 warmup=args.warmup_proportion,
+                                 t_total=num_train_optimization_steps)
+    startup_profile.lap("model load")
 
     if args.do_predict and (args.local_rank == -1 or torch.distributed.get_rank() == 0):
-        eval_examples = read_ner_examples(
-            input_file=args.predict_file, is_training=False, languages=args.predict_languages)
-        eval_features = convert_examples_to_features(
-            examples=eval_examples,
-            tokenizer=tokenizer,
-            max_seq_length=args.max_seq_length,
-            is_training=False, languages=args.predict_languages)
+        eval_examples = preloaded(("examples", args.predict_file, False, tuple(args.predict_languages or ())),
+                                  lambda: read_ner_examples(input_file=args.predict_file, is_training=False,
+                                                            languages=args.predict_languages))
+        eval_features = _submit_featurization(featurizer, feature_cache, args, eval_examples, args.predict_file,
+                                              args.predict_languages, "eval features", is_training=False).result()
 
         input_filename = os.path.basename(args.predict_file).replace(".lang", "." + "_".join(args.predict_languages))
         output_filepath = os.path.join(args.output_dir, input_filename + ".predictions.txt")
 
-        def evaluate_model(model):
-            logger.info("***** Running predictions *****")
-            logger.info("  Num orig examples = %d", len(eval_examples))
-            logger.info("  Num split examples = %d", len(eval_features))
-            logger.info("  Batch size = %d", args.predict_batch_size)
-            all_input_ids = torch.tensor([f.input_ids for f in eval_features], dtype=torch.long)
-            all_input_mask = torch.tensor([f.input_mask for f in eval_features], dtype=torch.long)
-            all_loss_mask = torch.tensor([f.loss_mask for f in eval_features], dtype=torch.long)
-            all_segment_ids = torch.tensor([f.segment_ids for f in eval_features], dtype=torch.long)
-            all_example_index = torch.arange(all_input_ids.size(0), dtype=torch.long)
-            eval_data = TensorDataset(all_input_ids, all_input_mask, all_loss_mask, all_segment_ids, all_example_index)
-            # Run prediction for full data
-            eval_sampler = SequentialSampler(eval_data)
-            eval_dataloader = DataLoader(eval_data, sampler=eval_sampler, batch_size=args.predict_batch_size)
-            model.eval()
-            all_results = []
-            logger.info("Start evaluating")
-            for input_ids, input_mask, loss_mask, segment_ids, example_indices in tqdm(eval_dataloader,
-                                                                                       desc="Evaluating"):
-                if len(all_results) % 1000 == 0:
-                    logger.info("Processing example: %d" % (len(all_results)))
-                input_ids = input_ids.to(device)
-                input_mask = input_mask.to(device)
-                loss_mask = loss_mask.to(device)
-                segment_ids = segment_ids.to(device)
-                with torch.no_grad():
-                    batch_logits = model(input_ids, segment_ids, input_mask, loss_mask)
-                for i, example_index in enumerate(example_indices):
-                    logits = batch_logits[i].detach().cpu()
-                    eval_feature = eval_features[example_index.item()]
-                    unique_id = int(eval_feature.unique_id)
-                    all_results.append(RawResult(unique_id=unique_id,
-                                                 logits=logits))
-            return write_predictions(eval_examples, eval_features, all_results, output_filepath,
-                                     args.verbose_logging)
+        evaluate_epoch = functools.partial(evaluate_model, eval_examples=eval_examples, eval_features=eval_features,
+                                           output_filepath=output_filepath, args=args)
     else:
-        def evaluate_model(model): pass
+        def evaluate_epoch(model, device): pass
+
+    if args.do_train and args.local_rank in [-1, 0]:
+        # Build and cache the training features here, before the other processes of the node read them
+        train_featurization.result()
+
+    # Wait for all queued featurization; finished jobs keep their results
+    featurizer.close()
+    startup_profile.lap("featurization")
+    tokenizer.log_statistics()
+    tokenizer.save()
+    release_other_processes(args.local_rank)
+    end_of_preloading()
+
+    if args.do_train and args.local_rank != -1:
+        model = distribute_model(model, device)
+    elif args.do_train and n_gpu > 1:
+        model = torch.nn.DataParallel(model)
 
     output_config_file = os.path.join(args.output_dir, CONFIG_NAME)
     output_model_file = os.path.join(args.output_dir, WEIGHTS_NAME)
 
     global_step = 0
     if args.do_train:
-        cached_train_features_file = args.train_file + '_{0}_{1}'.format(
-            list(filter(None, args.bert_model.split('/'))).pop(), str(args.max_seq_length))
-        train_features = None
-        try:
-            with open(cached_train_features_file, "rb") as reader:
-                train_features = pickle.load(reader)
-        except:
-            train_features = convert_examples_to_features(
-                examples=train_examples,
-                tokenizer=tokenizer,
-                max_seq_length=args.max_seq_length,
-                is_training=True,
-                languages=args.train_languages)
-            if args.local_rank == -1 or torch.distributed.get_rank() == 0:
-                logger.info("  Saving train features into cached file %s", cached_train_features_file)
-                with open(cached_train_features_file, "wb") as writer:
-                    pickle.dump(train_features, writer)
+        train_features = train_featurization.result()
         logger.info("***** Running training *****")
         logger.info("  Num orig examples = %d", len(train_examples))
         logger.info("  Num split examples = %d", len(train_features))
         logger.info("  Num labels = %d", len(train_examples[0].label_vocab))
         logger.info("  Batch size = %d", args.train_batch_size)
         logger.info("  Num steps = %d", num_train_optimization_steps)
-        all_input_ids = torch.tensor([f.input_ids for f in train_features], dtype=torch.long)
-        all_input_mask = torch.tensor([f.input_mask for f in train_features], dtype=torch.long)
-        all_loss_mask = torch.tensor([f.loss_mask for f in train_features], dtype=torch.long)
-        all_segment_ids = torch.tensor([f.segment_ids for f in train_features], dtype=torch.long)
-        all_labels = torch.tensor([f.label_ids for f in train_features], dtype=torch.long)
-        all_language_ids = torch.tensor([f.language_id for f in train_features], dtype=torch.long)
-        train_data = TensorDataset(all_input_ids, all_input_mask, all_loss_mask, all_segment_ids, all_labels,
-                                   all_language_ids)
-        if args.local_rank == -1:
-            train_sampler = RandomSampler(train_data)
+        if args.pack_sequences:
+            train_data = PackedDataset(train_features, args.max_seq_length, language_ids=True)
+            logger.info("  Num packed sequences = %d", len(train_data))
         else:
-            train_sampler = DistributedSampler(train_data)
-        train_dataloader = DataLoader(train_data, sampler=train_sampler, batch_size=args.train_batch_size)
+            train_data = train_features.to_dataset(args.max_seq_length, language_ids=True)
+        if args.freeze_layers:
+            model_to_cache = model.module if hasattr(model, 'module') else model
+            wait_for_main_process(get_rank())
+            frozen_outputs = get_frozen_outputs(model_to_cache.bert, train_features,
+                                                os.path.join(args.output_dir, "frozen_layers"), args.max_seq_length,
+                                                args.predict_batch_size)
+            release_other_processes(get_rank())
+            train_data = FrozenOutputDataset(train_data, frozen_outputs)
+        train_sampler = get_sampler(train_data, args.seed)
+        train_dataloader = get_train_dataloader(train_data, train_sampler, args, lengths=train_data.lengths)
+        if args.pack_sequences or (args.dynamic_padding and args.max_tokens_per_batch is not None):
+            # Batches hold several sentences per sequence or are limited by a token budget, so the number of
+            # optimization steps changes
+            num_train_optimization_steps = count_optimization_steps(train_dataloader, int(args.num_train_epochs),
+                                                                    args.gradient_accumulation_steps)
+            for param_group in optimizer.param_groups:
+                param_group['t_total'] = num_train_optimization_steps
+        padding_statistics = PaddingStatistics(args.max_seq_length)
+        pipeline = BatchPipeline(device, pin_memory=n_gpu == 1)
+        loss_scaler = LossScaler(args.precision)
+        scheduler = StreamScheduler(train_dataloader, prefetch=args.prefetch, stage=pipeline.stage)
+
+        checkpoints = CheckpointManager(args.checkpoint_dir or os.path.join(args.output_dir, "checkpoints"),
+                                        args.keep_checkpoints)
+
+        def save_checkpoint(epoch, step, f1=None):
+            if not is_main_process():
+                return
+            state = get_training_state(model, optimizer, loss_scaler, scheduler, epoch=epoch, step=step,
+                                       global_step=global_step, current_f1=current_f1, best_f1=best_f1,
+                                       metrics_step=metrics_writer.global_step)
+            checkpoints.save(state, global_step, f1)
+
+        evaluator = None
+        if args.evaluate_each_epoch and args.async_evaluation and is_main_process():
+            model_to_copy = model.module if hasattr(model, 'module') else model
+            make_model = functools.partial(make_evaluation_model, model_to_copy.config, model_to_copy.num_labels, args)
+            evaluator = AsyncEvaluator(evaluate_epoch, make_model, device)
+        stopped = False
+
+        def process_evaluations(evaluations):
+            """
+            Log the results of `evaluate_epoch` in epoch order, select the best model and check for early stopping.
+            Returns whether training should stop.
+            """
+            nonlocal best_f1, current_f1, stopped
+            for evaluated_epoch, metrics_step, result, snapshot_file in evaluations:
+                if stopped or result is None:
+                    if snapshot_file is not None:
+                        os.remove(snapshot_file)
+                    continue
+                precision, recall, f1 = result
+                metrics_writer.add_scalar('precision', precision, metrics_step)
+                metrics_writer.add_scalar('recall', recall, metrics_step)
+                metrics_writer.add_scalar('f1', f1, metrics_step)
+                metrics_writer.flush()
+                if args.early_stopping and evaluated_epoch > 0:
+                    if f1 < current_f1:
+                        logger.info("Stopping early because {} F1 < {} F1".format(f1, current_f1))
+                        stopped = True
+                        if snapshot_file is not None:
+                            os.remove(snapshot_file)
+                        continue
+
+                if f1 > best_f1:
+                    logger.info("Saving model ...")
+                    model_to_save = model.module if hasattr(model, 'module') else model  # Only save the model it-self
+                    if snapshot_file is None:
+                        checkpoints.save_file(model_to_save.state_dict(), output_model_file)
+                    else:
+                        os.replace(snapshot_file, output_model_file)
+                    output_config_file = os.path.join(args.output_dir, CONFIG_NAME)
+                    with open(output_config_file, 'w') as f:
+                        f.write(model_to_save.config.to_json_string())
+                    best_f1 = f1
+                elif snapshot_file is not None:
+                    os.remove(snapshot_file)
+
+                current_f1 = f1
+            return stopped
 
         current_f1 = 0.0
         best_f1 = 0.0
-
-        for epoch in trange(int(args.num_train_epochs), desc="Epoch"):
+        start_epoch = 0
+        start_step = 0
+        if args.resume:
+            checkpoint = checkpoints.load_latest()
+            if checkpoint is None:
+                logger.info("No checkpoint in %s, starting from the beginning", checkpoints.directory)
+            else:
+                progress = restore_training_state(checkpoint, model, optimizer, loss_scaler, scheduler)
+                start_epoch, start_step = progress["epoch"], progress["step"]
+                global_step, current_f1, best_f1 = progress["global_step"], progress["current_f1"], progress["best_f1"]
+                metrics_writer.global_step = progress["metrics_step"]
+                logger.info("Resuming at epoch %d, step %d (global step %d)", start_epoch, start_step, global_step)
+                del checkpoint
+
+        startup_profile.lap("training setup")
+        startup_profile.report()
+        step_profiler = StepProfiler(args.profile_steps or args.profile_trace is not None, args.output_dir, device,
+                                     args.profile_trace)
+        for epoch in trange(start_epoch, int(args.num_train_epochs), desc="Epoch"):
             model.train()
-            for step, batch in enumerate(tqdm(train_dataloader, desc="Iteration")):
+            first_step = start_step if epoch == start_epoch else 0
+            batches = tqdm(scheduler.epoch(epoch, first_step), total=len(scheduler), initial=first_step,
+                           desc="Iteration")
+            for step, (batch, _) in enumerate(step_profiler.batches(batches), first_step):
+                padding_statistics.update(batch)
+                metrics_writer.add_scalar('data_wait', scheduler.last_wait)
                 if n_gpu == 1:
-                    batch = tuple(t.to(device) for t in batch)  # multi-gpu does scattering it-self
-                input_ids, input_mask, loss_mask, segment_ids, labels, language_ids = batch
-                loss, adversarial_loss, adversarial_accuracy = model(input_ids, segment_ids, input_mask, loss_mask, labels, language_ids)
-                if n_gpu > 1:
-                    loss = loss.mean()  # mean() to average on multi-gpu.
-                if args.gradient_accumulation_steps > 1:
-                    loss = loss / args.gradient_accumulation_steps
-
-                if args.fp16:
-                    optimizer.backward(loss)
-                else:
-                    loss.backward()
+                    with phase("transfer"):
+                        batch = pipeline.to_device(batch)  # multi-gpu does scattering it-self
+                with gradient_sync(model, sync=(step + 1) % args.gradient_accumulation_steps == 0):
+                    input_ids, input_mask, loss_mask, segment_ids, labels, language_ids = batch[:6]
+                    frozen_output = batch[6] if args.freeze_layers else None
+                    with phase("forward"):
+                        loss, adversarial_loss, adversarial_accuracy = model(input_ids, segment_ids, input_mask,
+                                                                             loss_mask, labels, language_ids,
+                                                                             frozen_output=frozen_output)
+                    if n_gpu > 1:
+                        loss = loss.mean()  # mean() to average on multi-gpu.
+                    if args.gradient_accumulation_steps > 1:
+                        loss = loss / args.gradient_accumulation_steps
+
+                    with phase("backward"):
+                        if args.fp16:
+                            optimizer.backward(loss)
+                        else:
+                            loss_scaler.backward(loss)
                 if (step + 1) % args.gradient_accumulation_steps == 0:
                     if args.fp16:
                         # modify learning rate with special warm up BERT uses
@@ -667,46 +687,59 @@ def main():
                         for param_group in optimizer.param_groups:
                             param_group['lr'] = lr_this_step
 
-                    tensorboard_writer.add_scalar('loss', loss.item())
-                    tensorboard_writer.add_scalar('adversarial_loss', adversarial_loss.item())
-                    tensorboard_writer.add_scalar('adversarial_accuracy', adversarial_accuracy)
+                    metrics_writer.add_scalar('loss', loss)
+                    metrics_writer.add_scalar('adversarial_loss', adversarial_loss)
+                    metrics_writer.add_scalar('adversarial_accuracy', adversarial_accuracy)
                     optimizer_params = optimizer.param_groups[-1]
-                    tensorboard_writer.add_scalar('weight_decay', optimizer_params["weight_decay"])
-                    tensorboard_writer.add_scalar('learning_rate', optimizer_params["lr"])
+                    metrics_writer.add_scalar('weight_decay', optimizer_params["weight_decay"])
+                    metrics_writer.add_scalar('learning_rate', optimizer_params["lr"])
 
-                    optimizer.step()
-                    optimizer.zero_grad()
+                    with phase("optimizer step"):
+                        loss_scaler.step(optimizer)
+                        optimizer.zero_grad()
                     global_step += 1
+                    if args.checkpoint_every > 0 and global_step % args.checkpoint_every == 0:
+                        with phase("checkpoint"):
+                            save_checkpoint(epoch, step + 1)
+                with phase("metrics"):
+                    metrics_writer.step()
 
-            if args.evaluate_each_epoch:
-                precision, recall, f1 = evaluate_model(model)
-                tensorboard_writer.add_scalar('precision', precision)
-                tensorboard_writer.add_scalar('recall', recall)
-                tensorboard_writer.add_scalar('f1', f1)
-                if args.early_stopping and epoch > 0:
-                    if f1 < current_f1:
-                        logger.info("Stopping early because {} F1 < {} F1".format(f1, current_f1))
-                        break
-
-                if f1 > best_f1:
-                    logger.info("Saving model ...")
-                    model_to_save = model.module if hasattr(model, 'module') else model  # Only save the model it-self
-                    torch.save(model_to_save.state_dict(), output_model_file)
-                    output_config_file = os.path.join(args.output_dir, CONFIG_NAME)
-                    with open(output_config_file, 'w') as f:
-                        f.write(model_to_save.config.to_json_string())
-                    best_f1 = f1
-
-                current_f1 = f1
+            step_profiler.epoch_summary(epoch)
+            padding_statistics.log("Epoch {}".format(epoch))
+            scheduler.log_statistics()
+            metrics_writer.flush()
 
-            if not args.evaluate_each_epoch:
+            if args.evaluate_each_epoch:
+                if evaluator is None:
+                    evaluations = [(epoch, metrics_writer.global_step, evaluate_epoch(model, device), None)]
+                else:
+                    model_to_save = model.module if hasattr(model, 'module') else model
+                    snapshot_file = os.path.join(args.output_dir, "snapshot-{}.bin".format(epoch))
+                    checkpoints.save_file(model_to_save.state_dict(), snapshot_file,
+                                          callback=functools.partial(evaluator.submit, epoch,
+                                                                     metrics_writer.global_step, snapshot_file))
+                    evaluations = evaluator.poll()
+                if broadcast_flag(process_evaluations(evaluations)):
+                    break
+
+            if not args.evaluate_each_epoch and is_main_process():
                 logger.info("Saving model ...")
                 model_to_save = model.module if hasattr(model, 'module') else model  # Only save the model it-self
-                torch.save(model_to_save.state_dict(), output_model_file)
+                checkpoints.save_file(model_to_save.state_dict(), output_model_file)
                 output_config_file = os.path.join(args.output_dir, CONFIG_NAME)
                 with open(output_config_file, 'w') as f:
                     f.write(model_to_save.config.to_json_string())
 
+            save_checkpoint(epoch + 1, 0, current_f1 if args.evaluate_each_epoch and evaluator is None else None)
+
+        step_profiler.close()
+        if evaluator is not None:
+            # The snapshots have to be written before the worker can evaluate them
+            checkpoints.wait()
+            process_evaluations(evaluator.close())
+        checkpoints.close()
+
+    metrics_writer.close()
     del model
 
     if args.do_predict and (args.local_rank == -1 or torch.distributed.get_rank() == 0):
@@ -714,8 +747,75 @@ def main():
         config = BertConfig(output_config_file)
         model = AdversarialBertForNER(config, num_labels=len(eval_examples[0].label_vocab), num_languages=2)
         model.load_state_dict(torch.load(output_model_file))
+        set_precision(model, args.precision)
+        set_packed(model, args.pack_sequences)
         model.to(device)
-        evaluate_model(model)
+        startup_profile.lap("fine-tuned model load")
+        startup_profile.report()
+        evaluate_epoch(model, device)
+
+
+def evaluate_model(model, device, eval_examples, eval_features, output_filepath, args):
+    logger.info("***** Running predictions *****")
+    logger.info("  Num orig examples = %d", len(eval_examples))
+    logger.info("  Num split examples = %d", len(eval_features))
+    logger.info("  Batch size = %d", args.predict_batch_size)
+    if args.pack_sequences:
+        eval_data = PackedDataset(eval_features, args.max_seq_length, labels=False, example_indices=True)
+    else:
+        eval_data = eval_features.to_dataset(args.max_seq_length, labels=False, example_indices=True)
+    # Run prediction for full data
+    eval_sampler = SequentialSampler(eval_data)
+    eval_dataloader = DataLoader(eval_data, sampler=eval_sampler, batch_size=args.predict_batch_size,
+                                 collate_fn=get_collate_fn(args.dynamic_padding))
+    model.eval()
+    all_features = []
+    all_results = []
+    logger.info("Start evaluating")
+    for input_ids, input_mask, loss_mask, segment_ids, example_indices in tqdm(eval_dataloader,
+                                                                               desc="Evaluating"):
+        if len(all_results) % 1000 == 0:
+            logger.info("Processing example: %d" % (len(all_results)))
+        input_ids = input_ids.to(device)
+        input_mask = input_mask.to(device)
+        loss_mask = loss_mask.to(device)
+        segment_ids = segment_ids.to(device)
+        with torch.no_grad():
+            batch_logits = model(input_ids, segment_ids, input_mask, loss_mask)
+        for i, example_index in enumerate(example_indices):
+            # A packed sequence holds the logits of several features
+            for feature_index, logits in eval_data.split_logits(example_index.item(),
+                                                                batch_logits[i].detach().cpu()):
+                eval_feature = eval_features[feature_index]
+                unique_id = int(eval_feature.unique_id)
+                all_features.append(eval_feature)
+                all_results.append(RawResult(unique_id=unique_id,
+                                             logits=logits))
+    return write_predictions(eval_examples, all_features, all_results, output_filepath,
+                             args.verbose_logging)
+
+
+def make_evaluation_model(config, num_labels, args):
+    """A model that `AsyncEvaluator` loads the snapshots into, in the precision of the trained one."""
+    model = AdversarialBertForNER(config, num_labels=num_labels,
+                                  num_languages=len(args.train_languages or args.predict_languages))
+    if args.fp16:
+        model.half()
+    set_precision(model, args.precision)
+    set_packed(model, args.pack_sequences)
+    return model
+
+
+def _submit_featurization(featurizer, feature_cache, args, examples, input_file, languages, description,
+                          is_training):
+    label_vocab = examples[0].label_vocab
+    label_vocab.build()
+    key = feature_cache.key("run_adversarial_ner", _language_files(input_file, languages), featurizer.tokenizer,
+                            args.do_lower_case, args.max_seq_length, label_vocab.labels, languages=languages,
+                            is_training=is_training, window_stride=args.window_stride)
+    return featurizer.submit(convert_examples_to_features, examples, feature_cache, key, description,
+                             max_seq_length=args.max_seq_length, is_training=is_training, languages=languages,
+                             window_stride=args.window_stride)
 
 
 if __name__ == "__main__":
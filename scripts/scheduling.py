@@ -0,0 +1,240 @@
+"""
+Scheduling of batches from a supervised and one or more unsupervised streams.
+
+`StreamScheduler` walks through the supervised DataLoader once per epoch and mixes in batches of the other streams
+at a fixed ratio. The other streams are `CyclingStream`s that keep their iterators between steps and epochs, so
+every stream is read systematically, one pass after another, and the number of passes is counted per stream. The
+batches are put together on a background thread a few steps ahead of training, and optionally staged for the
+device there (see `BatchPipeline`). The time the training loop waits for batches is tracked and logged.
+
+Drawing batches on a background thread must not consume the global torch RNG, or dropout would depend on thread
+timing: use samplers with their own random state (`SeededRandomSampler`, `LengthBucketBatchSampler` with a seed)
+and `isolated_rng_kwargs` for the DataLoaders.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+
+from torch.utils.data import DataLoader
+
+from .batching import set_position
+
+logger = logging.getLogger(__name__)
+
+_END_OF_EPOCH = object()
+
+
+class CyclingStream:
+    """
+    Endless iterator over a finite iterable of batches such as a DataLoader, one pass after another. `epoch` is the
+    number of completed passes and `num_batches` the number of batches drawn so far. Iterators that never end (e.g.
+    streamed corpora) are drawn from as they are.
+
+    A DataLoader starts every pass at the next epoch of its sampler. `state_dict` and `load_state_dict` save and
+    restore the position; a DataLoader then continues in the same pass (see `set_position`), other iterables start
+    over.
+    """
+
+    def __init__(self, name, batches):
+        self.name = name
+        self.batches = batches
+        self.epoch = 0
+        self.num_batches = 0
+        self._iterator = None
+        self._pass_batches = 0
+        self._resume = False
+
+    def __iter__(self):
+        return self
+
+    def _start_pass(self):
+        num_dropped = 0
+        if isinstance(self.batches, DataLoader):
+            if not self._resume:
+                self._pass_batches = 0
+            # Every pass is an epoch of the sampler, e.g. a new permutation of a DistributedSampler
+            num_dropped = set_position(self.batches, self.epoch, self._pass_batches)
+        else:
+            if self._resume:
+                logger.info("Stream %s cannot be positioned, starting it over", self.name)
+            self._pass_batches = 0
+        self._resume = False
+        self._iterator = iter(self.batches)
+        for _ in range(num_dropped):
+            next(self._iterator)
+
+    def state_dict(self):
+        return {"epoch": self.epoch, "num_batches": self.num_batches, "pass_batches": self._pass_batches}
+
+    def load_state_dict(self, state):
+        self.epoch = state["epoch"]
+        self.num_batches = state["num_batches"]
+        self._pass_batches = state["pass_batches"]
+        self._iterator = None
+        self._resume = True
+
+    def __next__(self):
+        while True:
+            if self._iterator is None:
+                self._start_pass()
+            try:
+                batch = next(self._iterator)
+            except StopIteration:
+                self._iterator = None
+                if self._pass_batches == 0:
+                    raise ValueError("Stream {} has no batches".format(self.name))
+                self.epoch += 1
+                logger.info("Stream %s: finished pass %d after %d batches", self.name, self.epoch, self.num_batches)
+                continue
+            self._pass_batches += 1
+            self.num_batches += 1
+            return batch
+
+
+class StreamScheduler:
+    """
+    Mixes the batches of a primary stream (the supervised DataLoader) with those of secondary streams.
+
+    `secondary` maps a stream name to `(batches, ratio)`: on average, `ratio` batches of that stream are drawn for
+    every primary batch (e.g. 0.5 for every other step, 2 for two batches per step). `epoch()` yields one
+    `(batch, {name: [secondary batches]})` per batch of the primary stream; the list of a stream is empty on steps
+    where none of its batches are due. Up to `prefetch` steps are prepared on a background thread, which also
+    passes every batch through `stage` if it is given.
+
+    The position in all streams is part of `state_dict`, so that training can resume in the middle of an epoch.
+    """
+
+    def __init__(self, primary, secondary=None, prefetch=2, stage=None):
+        self.primary = primary
+        self.streams = {}
+        self.ratios = {}
+        self._credit = {}
+        for name, (batches, ratio) in (secondary or {}).items():
+            if ratio < 0:
+                raise ValueError("The ratio of stream {} must not be negative, got {}".format(name, ratio))
+            self.streams[name] = CyclingStream(name, batches)
+            self.ratios[name] = ratio
+            self._credit[name] = 0.0
+        self.prefetch = prefetch
+        self.stage = stage
+        self._state = self._get_state()
+        self.last_wait = 0.0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._num_steps = 0
+
+    def __len__(self):
+        return len(self.primary)
+
+    def _draw(self):
+        drawn = {}
+        for name, stream in self.streams.items():
+            self._credit[name] += self.ratios[name]
+            count = int(self._credit[name])
+            self._credit[name] -= count
+            drawn[name] = [next(stream) for _ in range(count)]
+        return drawn
+
+    def _get_state(self):
+        return {"credit": dict(self._credit),
+                "streams": {name: stream.state_dict() for name, stream in self.streams.items()}}
+
+    def state_dict(self):
+        """The state after the last step that was yielded; the background thread may have drawn further."""
+        return self._state
+
+    def load_state_dict(self, state):
+        self._credit.update(state["credit"])
+        for name, stream_state in state["streams"].items():
+            self.streams[name].load_state_dict(stream_state)
+        self._state = self._get_state()
+
+    def _steps(self, epoch, start):
+        batches = self.primary
+        if isinstance(self.primary, DataLoader) and epoch is not None:
+            num_dropped = set_position(self.primary, epoch, start)
+            batches = itertools.islice(self.primary, num_dropped, None)
+        elif start:
+            batches = itertools.islice(self.primary, start, None)
+        for batch in batches:
+            streams = self._draw()
+            if self.stage is not None:
+                batch = self.stage(batch)
+                streams = {name: [self.stage(b) for b in batches] for name, batches in streams.items()}
+            yield batch, streams, self._get_state()
+
+    def _waited(self, start):
+        self.last_wait = time.time() - start
+        self._wait_time += self.last_wait
+        self._max_wait = max(self._max_wait, self.last_wait)
+        self._num_steps += 1
+
+    def _produce(self, steps, items, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    items.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for step in steps:
+                if not put(step):
+                    return
+            put(_END_OF_EPOCH)
+        except BaseException as error:  # re-raised on the training thread
+            put(error)
+
+    def epoch(self, epoch=None, start=0):
+        """
+        Yield the batches of one pass over the primary stream: pass `epoch` of its sampler if it is given, starting
+        after its first `start` batches.
+        """
+        if self.prefetch <= 0:
+            steps = self._steps(epoch, start)
+            while True:
+                start = time.time()
+                try:
+                    step = next(steps)
+                except StopIteration:
+                    break
+                self._waited(start)
+                batch, streams, self._state = step
+                yield batch, streams
+        else:
+            items = queue.Queue(self.prefetch)
+            stop = threading.Event()
+            producer = threading.Thread(target=self._produce, args=(self._steps(epoch, start), items, stop),
+                                        daemon=True)
+            producer.start()
+            try:
+                while True:
+                    start = time.time()
+                    item = items.get()
+                    if item is _END_OF_EPOCH:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    self._waited(start)
+                    batch, streams, self._state = item
+                    yield batch, streams
+            finally:
+                # The streams must not be drawn from by an old producer once the next epoch starts
+                stop.set()
+                producer.join()
+
+    def log_statistics(self):
+        """Log the data wait per step since the last call, and the progress of the secondary streams."""
+        logger.info("Data wait: %.1f ms per step on average, %.1f ms at most, %.2f s in total (prefetch %d)",
+                    1000 * self._wait_time / max(self._num_steps, 1), 1000 * self._max_wait, self._wait_time,
+                    self.prefetch)
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._num_steps = 0
+        for name, stream in self.streams.items():
+            logger.info("Stream %s: %d batches, %d complete passes", name, stream.num_batches, stream.epoch)
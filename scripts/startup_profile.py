@@ -0,0 +1,66 @@
+"""
+Where the startup time of a run goes, for --profile_startup.
+
+A `StartupProfile` splits the time from the start of the process until the first training or prediction batch into
+laps: every call of `lap(name)` adds the time since the previous call to `name`. The first lap, "imports", is the age
+of the process when the profile is created (read from /proc on Linux, otherwise the time since this module was
+imported). `report()` logs a table of the laps, writes them to a JSON file (in the main process of distributed runs)
+and ends the profile; later calls of `lap` and `report` do nothing. A disabled profile does nothing at all.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from .distributed import is_main_process
+
+logger = logging.getLogger(__name__)
+
+_IMPORTED = time.time()
+
+
+def process_age():
+    """Seconds since the start of this process."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The fields after the parenthesized command name start with the third, the start time is the 22nd
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+    except (OSError, ValueError, IndexError):
+        return time.time() - _IMPORTED
+
+
+class StartupProfile(object):
+
+    def __init__(self, enabled, output_file=None):
+        self.enabled = enabled
+        self.output_file = output_file
+        self.laps = OrderedDict()
+        if enabled:
+            self.laps["imports"] = process_age()
+        self._last = time.time()
+
+    def lap(self, name):
+        if not self.enabled:
+            return
+        now = time.time()
+        self.laps[name] = self.laps.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        total = sum(self.laps.values())
+        lines = ["{:<28}{:>10}{:>8}".format("startup phase", "seconds", "share")]
+        for name, seconds in self.laps.items():
+            lines.append("{:<28}{:>10.2f}{:>7.1f}%".format(name, seconds, 100 * seconds / max(total, 1e-9)))
+        lines.append("{:<28}{:>10.2f}".format("total", total))
+        logger.info("Startup profile:\n%s", "\n".join(lines))
+        if self.output_file is not None and is_main_process():
+            with open(self.output_file, "w", encoding="utf-8") as f:
+                json.dump(OrderedDict((name, round(seconds, 3)) for name, seconds in self.laps.items()), f, indent=2)
@@ -0,0 +1,213 @@
+"""
+Where the time of the training steps goes, for --profile_steps and --profile_trace.
+
+The training loops mark the phases of a step (transfer, forward passes, perturbation, TSA, backward, optimizer step,
+metrics, ...) with `phase(name)`, and iterate over their batches through `StepProfiler.batches`, which times the wait
+for every batch as the phase "data". Without an active profiler, `phase` returns a shared no-op context manager and
+`batches` returns its argument, so the marks cost next to nothing. Nested phases are counted on their own and
+subtracted from the self time of the enclosing phase; the time of a step that no phase accounts for is reported as
+"untracked". `epoch_summary` logs a table of the phases at the end of every epoch and appends it to
+<output_dir>/profile/summary.jsonl.
+
+CUDA kernels run asynchronously, so on a GPU the profiler synchronizes the device around every phase to charge the
+kernels to the phase that launched them, which slows training down a little while profiling.
+
+With `trace_window=(start, steps)`, torch.profiler also records the operators of `steps` batches after the first
+`start` ones, with the phases as named ranges. The trace is written to <output_dir>/profile/trace.json, which
+chrome://tracing and Perfetto open, and a table of the most expensive operators to ops.txt next to it.
+
+In distributed training, only the main process profiles.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+
+from .distributed import is_main_process
+
+logger = logging.getLogger(__name__)
+
+
+class _NoOp(object):
+    """Context manager that does nothing (`contextlib.nullcontext` only exists from Python 3.7 on)."""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_OP = _NoOp()
+_active = None
+
+
+def phase(name):
+    """Context manager that marks a phase of a training step for the active `StepProfiler`."""
+    if _active is None:
+        return _NO_OP
+    return _active.phase(name)
+
+
+def check_profile_trace(trace_window):
+    """Raise a ValueError if --profile_trace `trace_window` cannot be recorded with this torch version."""
+    if trace_window is None:
+        return
+    if not hasattr(torch, "profiler"):
+        raise ValueError("--profile_trace needs torch.profiler (torch >= 1.8.1), use --profile_steps instead")
+    start, steps = trace_window
+    if start < 0 or steps < 1:
+        raise ValueError("--profile_trace needs START >= 0 and STEPS >= 1, got {} {}".format(start, steps))
+
+
+class StepProfiler(object):
+
+    def __init__(self, enabled, output_dir, device=None, trace_window=None):
+        global _active
+        self.enabled = enabled and is_main_process()
+        self.directory = os.path.join(output_dir, "profile")
+        self.synchronize = device is not None and device.type == "cuda"
+        self.device = device
+        self._thread = threading.get_ident()
+        self._children = []
+        self._phases = OrderedDict()
+        self._steps = 0
+        self._step_time = 0.0
+        self._trace = None
+        self._trace_steps = 0
+        self._trace_end = 0
+        self._batches = 0
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if trace_window is not None:
+            self._start_trace(*trace_window)
+        _active = self
+
+    def _sync(self):
+        if self.synchronize:
+            torch.cuda.synchronize(self.device)
+
+    def _record(self, name, elapsed, children=0.0):
+        if self._children:
+            self._children[-1] += elapsed
+        phase = self._phases.setdefault(name, [0, 0.0, 0.0])
+        phase[0] += 1
+        phase[1] += elapsed
+        phase[2] += elapsed - children
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        self._sync()
+        start = time.perf_counter()
+        self._children.append(0.0)
+        try:
+            if self._trace is None:
+                yield
+            else:
+                with torch.autograd.profiler.record_function(name):
+                    yield
+        finally:
+            self._sync()
+            children = self._children.pop()
+            self._record(name, time.perf_counter() - start, children)
+
+    def phase(self, name):
+        # Forward passes of DataParallel replicas run on other threads
+        if not self.enabled or threading.get_ident() != self._thread:
+            return _NO_OP
+        return self._timed(name)
+
+    def batches(self, iterable):
+        """The batches of `iterable`; a step lasts from waiting for a batch until the next batch is requested."""
+        if not self.enabled:
+            return iterable
+        return self._batches_of(iterable)
+
+    def _batches_of(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self._record("data", time.perf_counter() - start)
+            yield batch
+            self._sync()
+            self._step_time += time.perf_counter() - start
+            self._steps += 1
+            self._step_trace()
+
+    def _start_trace(self, start, steps):
+        from torch.profiler import ProfilerActivity, profile, schedule
+        activities = [ProfilerActivity.CPU]
+        if self.synchronize:
+            activities.append(ProfilerActivity.CUDA)
+        warmup = min(start, 1)
+        self._trace = profile(activities=activities,
+                              schedule=schedule(wait=start - warmup, warmup=warmup, active=steps, repeat=1),
+                              on_trace_ready=self._export_trace)
+        self._trace_steps = steps
+        self._trace_end = start + steps
+        self._trace.start()
+
+    def _step_trace(self):
+        if self._trace is None:
+            return
+        self._trace.step()
+        self._batches += 1
+        if self._batches >= self._trace_end:
+            self._stop_trace()
+
+    def _stop_trace(self):
+        trace, self._trace = self._trace, None
+        trace.stop()
+
+    def _export_trace(self, trace):
+        trace_file = os.path.join(self.directory, "trace.json")
+        trace.export_chrome_trace(trace_file)
+        sort_by = "self_cuda_time_total" if self.synchronize else "self_cpu_time_total"
+        with open(os.path.join(self.directory, "ops.txt"), "w", encoding="utf-8") as f:
+            f.write(trace.key_averages().table(sort_by=sort_by, row_limit=50))
+        logger.info("Wrote the profiler trace of %d batches to %s", self._trace_steps, trace_file)
+
+    def epoch_summary(self, epoch):
+        """Log and store the times of the phases of the steps since the last summary, and start over."""
+        if not self.enabled or not self._steps:
+            return
+        phases = sorted(self._phases.items(), key=lambda item: -item[1][2])
+        untracked = self._step_time - sum(self_time for _, (_, _, self_time) in phases)
+        lines = ["{:<24}{:>10}{:>12}{:>12}{:>8}{:>12}".format("phase", "calls", "total (s)", "self (s)", "self",
+                                                             "ms/step")]
+        for name, (calls, total, self_time) in phases + [("untracked", (self._steps, untracked, untracked))]:
+            lines.append("{:<24}{:>10}{:>12.2f}{:>12.2f}{:>7.1f}%{:>12.1f}".format(
+                name, calls, total, self_time, 100 * self_time / max(self._step_time, 1e-9),
+                1000 * self_time / self._steps))
+        lines.append("{:<24}{:>10}{:>12.2f}".format("step", self._steps, self._step_time))
+        logger.info("Step profile of epoch %d:\n%s", epoch, "\n".join(lines))
+
+        record = OrderedDict([("epoch", epoch), ("steps", self._steps), ("step_time", round(self._step_time, 4)),
+                              ("untracked", round(untracked, 4))])
+        record["phases"] = OrderedDict((name, {"calls": calls, "total": round(total, 4), "self": round(self_time, 4)})
+                                       for name, (calls, total, self_time) in phases)
+        with open(os.path.join(self.directory, "summary.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        self._phases = OrderedDict()
+        self._steps = 0
+        self._step_time = 0.0
+
+    def close(self):
+        global _active
+        if not self.enabled:
+            return
+        if self._trace is not None:
+            self._stop_trace()
+        if _active is self:
+            _active = None
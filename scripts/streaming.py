@@ -0,0 +1,124 @@
+"""
+Streaming of unsupervised corpora that do not fit into memory.
+
+`StreamingDataset` reads one or more files (given as glob patterns) lazily, featurizes the examples on the fly and
+shuffles them through a bounded buffer, so memory use does not depend on the size of the corpus. The corpus is
+repeated indefinitely, with a different order in every pass. With torch >= 1.2, featurization runs inside the
+DataLoader workers; older versions have no `IterableDataset`, and the stream is batched in the training process.
+"""
+
+import glob
+import itertools
+import logging
+import random
+
+from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:  # torch < 1.2
+    IterableDataset = object
+    get_worker_info = None
+
+from .distributed import get_rank, get_world_size
+
+logger = logging.getLogger(__name__)
+
+
+def expand_file_patterns(file_patterns):
+    """Resolve comma-separated glob patterns into a sorted list of files."""
+    filepaths = []
+    for file_pattern in file_patterns.split(","):
+        matches = sorted(glob.glob(file_pattern))
+        if not matches:
+            raise ValueError("No files match {}".format(file_pattern))
+        filepaths += matches
+    return filepaths
+
+
+def read_lines(filepath):
+    """Yield the tokens of each non-empty line of a file with one sentence per line."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            tokens = line.split()
+            if tokens:
+                yield tokens
+
+
+class StreamingDataset(IterableDataset):
+    """
+    Iterable dataset over the examples that `read_fn(filepath)` yields for each file. `featurize_fn(example, index)`
+    turns an example into a tuple of tensors; `index` counts the examples of the current worker.
+
+    Workers (of all processes, in distributed training) split the files among themselves if there are enough files,
+    and otherwise take every n-th example.
+    """
+
+    def __init__(self, file_patterns, read_fn, featurize_fn, shuffle_buffer_size=10000, seed=42, repeat=True):
+        self.filepaths = expand_file_patterns(file_patterns)
+        self.read_fn = read_fn
+        self.featurize_fn = featurize_fn
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.repeat = repeat
+
+    def _worker(self):
+        # In distributed training, the workers of all processes share the corpus
+        rank, world_size = get_rank(), get_world_size()
+        worker_info = get_worker_info() if get_worker_info is not None else None
+        if worker_info is None:
+            return rank, world_size
+        return rank * worker_info.num_workers + worker_info.id, world_size * worker_info.num_workers
+
+    def _read_pass(self, worker_id, num_workers):
+        if len(self.filepaths) >= num_workers:
+            for filepath in self.filepaths[worker_id::num_workers]:
+                for example in self.read_fn(filepath):
+                    yield example
+        else:
+            examples = itertools.chain.from_iterable(self.read_fn(filepath) for filepath in self.filepaths)
+            for example in itertools.islice(examples, worker_id, None, num_workers):
+                yield example
+
+    def _shuffle(self, examples, rng):
+        buffer = []
+        for example in examples:
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(example)
+                continue
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = example
+        rng.shuffle(buffer)
+        for example in buffer:
+            yield example
+
+    def __iter__(self):
+        worker_id, num_workers = self._worker()
+        index = 0
+        for epoch in itertools.count():
+            rng = random.Random("{}-{}-{}".format(self.seed, epoch, worker_id))
+            for example in self._shuffle(self._read_pass(worker_id, num_workers), rng):
+                yield self.featurize_fn(example, index)
+                index += 1
+            if not self.repeat:
+                break
+
+
+def _batches(dataset, batch_size, collate_fn):
+    examples = iter(dataset)
+    while True:
+        batch = list(itertools.islice(examples, batch_size))
+        if not batch:
+            return
+        yield collate_fn(batch)
+
+
+def get_streaming_batches(dataset, batch_size, collate_fn=default_collate, num_workers=0):
+    """Iterator over batches of a `StreamingDataset`."""
+    if IterableDataset is object:
+        if num_workers > 0:
+            logger.warning("Streaming DataLoader workers need torch >= 1.2, featurizing in the training process")
+        return _batches(dataset, batch_size, collate_fn)
+    return iter(DataLoader(dataset, batch_size=batch_size, collate_fn=collate_fn, num_workers=num_workers))
@@ -0,0 +1,165 @@
+"""
+Run a grid of configurations of a run script, loading the shared resources only once.
+
+The sweep imports the run script, runs it once up to the end of its preparation to load the tokenizer, the examples,
+their features and the pretrained weights (see `scripts.preloading`), and then forks one process per configuration,
+at most --num_jobs at a time, each with --threads_per_job torch threads. The jobs inherit the loaded resources and
+map the pretrained weights of their models from the same file (see `scripts.weights_store`). Example:
+
+python -m scripts.sweep --script run_uda_ner --output_dir output/sweep --num_jobs 4 \\
+  --grid seed 1 2 3 --grid learning_rate 3e-5 5e-5 --grid tsa linear_0.5 exp_0.5 \\
+  -- --bert_model bert-base-multilingual-cased --do_train --do_predict --train_file data/train.txt ...
+
+Every configuration writes into its own directory below --output_dir, named after its grid values, with a log.txt
+and a sweep_result.json. Configurations whose result says they are done are skipped when the sweep is run again, and
+the results of all jobs are appended to <output_dir>/sweep.jsonl.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import torch
+
+from .featurization import FeaturizationJob
+from .preloading import PreloadComplete, preload_only, preloaded_resources
+
+logger = logging.getLogger(__name__)
+
+SCRIPTS = ["run_ner", "run_adversarial_ner", "run_uda_ner"]
+
+
+def configurations(grid):
+    """
+    The configurations of a grid given as [name, value, ...] lists: tuples of a directory name and the command line
+    arguments of the configuration.
+    """
+    names = [values[0] for values in grid]
+    result = []
+    for values in itertools.product(*[values[1:] for values in grid]):
+        name = ",".join("{}={}".format(option, value) for option, value in zip(names, values)) or "default"
+        argv = [argument for option, value in zip(names, values) for argument in ("--" + option, value)]
+        result.append((re.sub(r"[^\w.,=+-]", "_", name), argv))
+    return result
+
+
+def preload(module, script_args, output_dir):
+    """Run the script up to `end_of_preloading`, on the CPU, and wait for all features that it queued."""
+    start = time.time()
+    preload_dir = tempfile.mkdtemp(prefix="preload.", dir=output_dir)
+    try:
+        with preload_only():
+            module.main(script_args + ["--output_dir", preload_dir, "--no_cuda", "--precision", "fp32",
+                                       "--metrics_sink", "none"])
+    except PreloadComplete:
+        pass
+    finally:
+        shutil.rmtree(preload_dir)
+    for resource in preloaded_resources():
+        if isinstance(resource, FeaturizationJob):
+            resource.result()
+    logger.info("Preloaded %d resources in %.1f s", len(preloaded_resources()), time.time() - start)
+
+
+def _run_job(module_name, argv, output_dir, threads):
+    torch.set_num_threads(threads)
+    handler = logging.FileHandler(os.path.join(output_dir, "log.txt"))
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s -   %(message)s'))
+    logging.getLogger().addHandler(handler)
+    start = time.time()
+    result = {"argv": argv, "status": "done", "error": None}
+    try:
+        importlib.import_module(module_name).main(argv)
+    except BaseException as error:
+        logger.exception("Configuration in %s failed", output_dir)
+        result.update(status="failed", error=repr(error))
+    result["seconds"] = round(time.time() - start, 1)
+    with open(os.path.join(output_dir, "sweep_result.json"), "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    sys.exit(0 if result["status"] == "done" else 1)
+
+
+def _read_result(output_dir):
+    path = os.path.join(output_dir, "sweep_result.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--script", required=True, choices=SCRIPTS)
+    parser.add_argument("--output_dir", required=True, type=str,
+                        help="The configurations write into directories below this one.")
+    parser.add_argument("--grid", nargs="+", action="append", default=[], metavar=("NAME", "VALUE"),
+                        help="An option of the run script (without dashes) and its values; the sweep runs all "
+                             "combinations of the given options.")
+    parser.add_argument("--num_jobs", default=1, type=int, help="Number of configurations that run at a time.")
+    parser.add_argument("--threads_per_job", default=None, type=int,
+                        help="torch threads of every job. Defaults to the cores divided by --num_jobs.")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER,
+                        help="Arguments of the run script that all configurations share, after --.")
+    args = parser.parse_args()
+
+    script_args = args.script_args[1:] if args.script_args[:1] == ["--"] else args.script_args
+    if "--output_dir" in script_args or any(argument.startswith("--local_rank") for argument in script_args):
+        raise ValueError("The sweep sets --output_dir for every configuration and does not run distributed jobs.")
+    threads = args.threads_per_job or max(os.cpu_count() // args.num_jobs, 1)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    module_name = "scripts." + args.script
+    module = importlib.import_module(module_name)
+    jobs = []
+    for name, grid_args in configurations(args.grid):
+        output_dir = os.path.join(args.output_dir, name)
+        result = _read_result(output_dir)
+        if result is not None and result["status"] == "done":
+            logger.info("Skipping %s, which is done", name)
+            continue
+        os.makedirs(output_dir, exist_ok=True)
+        jobs.append((name, script_args + grid_args + ["--output_dir", output_dir], output_dir))
+    if not jobs:
+        return
+    preload(module, script_args, args.output_dir)
+
+    # Forked jobs inherit the preloaded resources; they are not daemons, so they can start workers of their own
+    context = multiprocessing.get_context("fork")
+    pending = list(jobs)
+    running = []
+    with open(os.path.join(args.output_dir, "sweep.jsonl"), "a", encoding="utf-8") as summary:
+        while pending or running:
+            while pending and len(running) < args.num_jobs:
+                name, argv, output_dir = pending.pop(0)
+                process = context.Process(target=_run_job, args=(module_name, argv, output_dir, threads))
+                process.start()
+                logger.info("Started %s (%d pending)", name, len(pending))
+                running.append((name, output_dir, process))
+            time.sleep(1)
+            for job in list(running):
+                name, output_dir, process = job
+                if process.is_alive():
+                    continue
+                running.remove(job)
+                result = _read_result(output_dir) or {"status": "failed", "error": "exit code {}".format(
+                    process.exitcode)}
+                result["name"] = name
+                summary.write(json.dumps(result) + "\n")
+                summary.flush()
+                logger.info("Finished %s: %s", name, result["status"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+                        datefmt='%m/%d/%Y %H:%M:%S',
+                        level=logging.INFO)
+    main()
@@ -0,0 +1,111 @@
+"""
+EMA teacher for the consistency loss of UDA.
+
+Without a teacher, every UDA step runs the model on the clean unsupervised batch only to get the targets of the
+consistency loss. With --ema_teacher, these targets come from `EmaTeacher`, an exponential moving average of the
+model weights, and are kept in a `LogitStore`: a memory-mapped fp16 array with one row of logits per WordPiece of the
+unsupervised corpus. A training step reads the targets of its batch from the store, and the teacher only predicts
+sentences that have no targets yet. Every --teacher_refresh_every steps, it re-predicts the next
+--teacher_refresh_size sentences of the corpus, so that the targets follow the teacher. The store records the step
+at which every target was predicted, and reports their age.
+"""
+
+import copy
+import logging
+import os
+
+import numpy as np
+import torch
+
+from .batching import dynamic_padding_collate
+
+logger = logging.getLogger(__name__)
+
+
+class EmaTeacher:
+    """A copy of `model` in eval mode whose weights follow the model as an exponential moving average."""
+
+    def __init__(self, model, decay=0.999):
+        model = model.module if hasattr(model, 'module') else model
+        self.model = copy.deepcopy(model).eval()
+        for parameter in self.model.parameters():
+            parameter.requires_grad = False
+        self.decay = decay
+
+    def update(self, model):
+        """Move the weights towards those of `model`, after an optimizer step."""
+        model = model.module if hasattr(model, 'module') else model
+        with torch.no_grad():
+            for teacher_parameter, parameter in zip(self.model.parameters(), model.parameters()):
+                teacher_parameter.mul_(self.decay).add_((1 - self.decay) * parameter.to(teacher_parameter.dtype))
+            for teacher_buffer, buffer in zip(self.model.buffers(), model.buffers()):
+                teacher_buffer.copy_(buffer)
+
+    def predict(self, batch):
+        """Logits of a batch of (input_ids, input_mask, loss_mask, segment_ids, ...)."""
+        input_ids, input_mask, loss_mask, segment_ids = batch[:4]
+        with torch.no_grad():
+            return self.model(input_ids, segment_ids, input_mask, loss_mask, use_dropout=False).float()
+
+    def state_dict(self):
+        return self.model.state_dict()
+
+    def load_state_dict(self, state):
+        self.model.load_state_dict(state)
+
+
+class LogitStore:
+    """
+    Teacher logits for the features of `dataset` (a `ColumnarFeatureDataset` with feature indices), in an array at
+    <directory>/logits.npy. Batches of the dataset carry the feature indices as their last element.
+    """
+
+    def __init__(self, dataset, num_labels, directory):
+        self.dataset = dataset
+        self.offsets = dataset.offsets
+        self.lengths = dataset.lengths
+        os.makedirs(directory, exist_ok=True)
+        self.logits = np.lib.format.open_memmap(os.path.join(directory, "logits.npy"), mode="w+", dtype=np.float16,
+                                                shape=(int(self.offsets[-1]), num_labels))
+        self.predicted_at = np.full(len(dataset), -1, dtype=np.int64)  # step, -1 if there are no targets yet
+        self.next_refresh = 0
+
+    def _put(self, indices, logits, step):
+        logits = logits.to(dtype=torch.float16).cpu().numpy()
+        for index, sentence_logits in zip(indices, logits):
+            start, length = int(self.offsets[index]), int(self.lengths[index])
+            self.logits[start:start + length] = sentence_logits[:length]
+        self.predicted_at[indices] = step
+
+    def targets(self, teacher, batch, step):
+        """The teacher logits of a batch, padded like its input ids; missing ones are predicted first."""
+        indices = batch[-1].cpu().numpy()
+        if (self.predicted_at[indices] < 0).any():
+            self._put(indices, teacher.predict(batch), step)
+        targets = np.zeros(tuple(batch[0].size()) + (self.logits.shape[1],), dtype=np.float32)
+        for i, index in enumerate(indices):
+            start, length = int(self.offsets[index]), int(self.lengths[index])
+            length = min(length, targets.shape[1])
+            targets[i, :length] = self.logits[start:start + length]
+        return torch.from_numpy(targets).to(batch[0].device)
+
+    def ages(self, indices, step):
+        """Number of steps since the targets of the given features were predicted."""
+        return step - self.predicted_at[np.asarray(indices)]
+
+    def refresh(self, teacher, step, num_sentences, batch_size, device):
+        """Re-predict the targets of the next `num_sentences` sentences of the corpus, in order."""
+        indices = (self.next_refresh + np.arange(min(num_sentences, len(self.dataset)))) % len(self.dataset)
+        self.next_refresh = int(indices[-1] + 1) if len(indices) else self.next_refresh
+        for start in range(0, len(indices), batch_size):
+            batch = dynamic_padding_collate([self.dataset[int(index)] for index in indices[start:start + batch_size]])
+            batch = tuple(t.to(device) for t in batch)
+            self._put(batch[-1].cpu().numpy(), teacher.predict(batch), step)
+
+    def log_statistics(self, step):
+        predicted = self.predicted_at >= 0
+        if not predicted.any():
+            return
+        ages = step - self.predicted_at[predicted]
+        logger.info("Teacher targets: %.1f%% of the unsupervised sentences predicted, %.0f steps old on average "
+                    "(at most %d)", 100 * predicted.mean(), ages.mean(), ages.max())
@@ -10,16 +10,16 @@ import torch
 
 class TSA:
 
-    def __init__(self, num_classes: int, num_steps: int, tensorboard_writer=None):
+    def __init__(self, num_classes: int, num_steps: int, metrics_writer=None):
         self.current_step = 0
         self.num_steps = num_steps
         self.num_classes = num_classes
-        self.tensorboard_writer = tensorboard_writer
+        self.metrics_writer = metrics_writer
         self.eta = None
 
     def step(self):
-        if self.tensorboard_writer is not None:
-            self.tensorboard_writer.add_scalar('tsa_eta', self.eta)
+        if self.metrics_writer is not None:
+            self.metrics_writer.add_scalar('tsa_eta', self.eta)
         self.current_step += 1
 
     def apply(self, logits, labels, loss_mask):
@@ -35,8 +35,8 @@ class TSA:
         labels = labels[inconfident_samples]
         loss_mask = loss_mask[inconfident_samples]
 
-        if self.tensorboard_writer is not None:
-            self.tensorboard_writer.add_scalar('tsa_z', sum(inconfident_samples))
+        if self.metrics_writer is not None:
+            self.metrics_writer.add_scalar('tsa_z', inconfident_samples.sum())
 
         return logits, labels, loss_mask
 
@@ -0,0 +1,168 @@
+"""
+Store of extracted pretrained weights that models map in from disk.
+
+`BertPreTrainedModel.from_pretrained` extracts the model archive into a temporary directory on every call, and
+deserializes the complete state dict before copying it into the model. With several ranks, or the jobs of a sweep,
+every process does both. The `WeightsStore` extracts every archive once, under a file lock, into an entry with the
+configuration and all weights in one flat file, `weights.bin`, described by `index.json`. `from_pretrained` builds a
+model and points its parameters at copy-on-write memory maps of that file: pages are read when they are first used,
+processes on one machine share them in the page cache, and a page is only copied when a process changes it (e.g. in
+an optimizer step).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from .feature_cache import file_lock
+from .preloading import preloaded
+
+logger = logging.getLogger(__name__)
+
+# Offsets of the tensors in weights.bin are multiples of this
+ALIGNMENT = 64
+
+
+def _entry_name(archive_file):
+    description = {"archive": archive_file}
+    if os.path.exists(archive_file):
+        stat = os.stat(archive_file)
+        description.update(archive=os.path.abspath(archive_file), size=stat.st_size, mtime=stat.st_mtime)
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _rename_tf_keys(state_dict):
+    """The renaming of `from_pretrained`: LayerNorm weights converted from TensorFlow are called gamma and beta."""
+    renamed = OrderedDict()
+    for key, tensor in state_dict.items():
+        renamed[key.replace("gamma", "weight").replace("beta", "bias")] = tensor
+    return renamed
+
+
+def write_weights(state_dict, directory):
+    """Write the tensors of `state_dict` into <directory>/weights.bin and their layout into index.json."""
+    index = []
+    offset = 0
+    with open(os.path.join(directory, "weights.bin"), "wb") as f:
+        for name, tensor in state_dict.items():
+            array = tensor.detach().cpu().contiguous().numpy()
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            index.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset})
+            f.write(array.tobytes())
+            offset += array.nbytes
+    with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+
+def map_weights(directory):
+    """The state dict in <directory>/weights.bin, as tensors on a copy-on-write memory map of the file."""
+    with open(os.path.join(directory, "index.json"), encoding="utf-8") as f:
+        index = json.load(f)
+    data = np.memmap(os.path.join(directory, "weights.bin"), dtype=np.uint8, mode="c")
+    state_dict = OrderedDict()
+    for entry in index:
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        array = data[entry["offset"]:entry["offset"] + count * dtype.itemsize].view(dtype).reshape(entry["shape"])
+        state_dict[entry["name"]] = torch.from_numpy(array)
+    return state_dict
+
+
+class WeightsStore(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def entry(self, bert_model):
+        """The directory with the configuration and the weights of `bert_model`, extracted if it is not there yet."""
+        from pytorch_pretrained_bert.file_utils import cached_path
+        from pytorch_pretrained_bert.modeling import CONFIG_NAME, PRETRAINED_MODEL_ARCHIVE_MAP, WEIGHTS_NAME
+
+        archive_file = PRETRAINED_MODEL_ARCHIVE_MAP.get(bert_model, bert_model)
+        name = _entry_name(archive_file)
+        path = os.path.join(self.directory, name)
+        if os.path.isdir(path):
+            return path
+        with file_lock(path + ".lock"):
+            if os.path.isdir(path):
+                return path
+            logger.info("Extracting the weights of %s into %s", bert_model, path)
+            resolved_archive_file = cached_path(archive_file, cache_dir=os.path.join(self.directory, "archives"))
+            temporary_path = tempfile.mkdtemp(prefix=name + ".", suffix=".tmp", dir=self.directory)
+            try:
+                if os.path.isdir(resolved_archive_file):
+                    serialization_dir = resolved_archive_file
+                else:
+                    serialization_dir = os.path.join(temporary_path, "archive")
+                    with tarfile.open(resolved_archive_file, "r:gz") as archive:
+                        archive.extractall(serialization_dir)
+                shutil.copyfile(os.path.join(serialization_dir, CONFIG_NAME), os.path.join(temporary_path, CONFIG_NAME))
+                state_dict = torch.load(os.path.join(serialization_dir, WEIGHTS_NAME), map_location="cpu")
+                write_weights(_rename_tf_keys(state_dict), temporary_path)
+                del state_dict
+                if serialization_dir != resolved_archive_file:
+                    shutil.rmtree(serialization_dir)
+                os.rename(temporary_path, path)
+            except BaseException:
+                shutil.rmtree(temporary_path, ignore_errors=True)
+                raise
+        return path
+
+    def config(self, bert_model):
+        from pytorch_pretrained_bert.modeling import BertConfig, CONFIG_NAME
+        return BertConfig.from_json_file(os.path.join(self.entry(bert_model), CONFIG_NAME))
+
+    def state_dict(self, bert_model):
+        return map_weights(self.entry(bert_model))
+
+
+def load_weights(model, state_dict):
+    """
+    Point the parameters and buffers of `model` at the tensors of `state_dict` with the same names (without the
+    "bert." prefix for models that are a plain encoder), as `from_pretrained` would load them, without a copy.
+    """
+    prefix = "" if hasattr(model, "bert") else "bert."
+    model_tensors = OrderedDict(model.named_parameters())
+    model_tensors.update(model.named_buffers())
+    used = set()
+    for name, tensor in model_tensors.items():
+        mapped = state_dict.get(prefix + name)
+        if mapped is None:
+            continue
+        if mapped.shape != tensor.shape:
+            raise ValueError("Pretrained weight {} has shape {}, the model expects {}".format(
+                prefix + name, tuple(mapped.shape), tuple(tensor.shape)))
+        tensor.data = mapped
+        used.add(prefix + name)
+    missing_keys = [name for name in model_tensors if prefix + name not in used]
+    unexpected_keys = [key for key in state_dict if key not in used and key.startswith(prefix)]
+    if missing_keys:
+        logger.info("Weights of {} not initialized from pretrained model: {}".format(
+            model.__class__.__name__, missing_keys))
+    if unexpected_keys:
+        logger.info("Weights from pretrained model not used in {}: {}".format(
+            model.__class__.__name__, unexpected_keys))
+
+
+def from_pretrained(model_class, bert_model, weights_cache_dir, *inputs, **kwargs):
+    """
+    Like `model_class.from_pretrained(bert_model, *inputs, **kwargs)`, with the weights mapped in from the store in
+    `weights_cache_dir`. Every model gets a memory map of its own, so models in one process do not share parameters.
+    """
+    store = WeightsStore(weights_cache_dir)
+    entry, config = preloaded(("pretrained weights", bert_model, weights_cache_dir),
+                              lambda: (store.entry(bert_model), store.config(bert_model)))
+    model = model_class(config, *inputs, **kwargs)
+    load_weights(model, map_weights(entry))
+    return model
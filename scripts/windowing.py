@@ -0,0 +1,65 @@
+"""
+Sliding windows over sentences that are longer than the maximum sequence length.
+
+A sentence of n WordPieces is split into windows of at most `max_tokens` WordPieces that start every `stride`
+WordPieces, so consecutive windows overlap. Every original token is predicted by the head WordPiece in the window
+where it has the most context on both sides (as in BERT's SQuAD document strides); `prediction_mask` marks these
+WordPieces, and `merge_window_predictions` puts the predictions of the windows of each example back together.
+"""
+
+from collections import defaultdict
+
+
+def get_windows(num_tokens, max_tokens, stride=None):
+    """
+    (start, end) WordPiece spans of the windows of a sentence. Without a stride, long sentences are truncated to a
+    single window.
+    """
+    if stride is None or num_tokens <= max_tokens:
+        return [(0, min(num_tokens, max_tokens))]
+    if not 0 < stride <= max_tokens:
+        raise ValueError("The window stride must be between 1 and {}, got {}".format(max_tokens, stride))
+    windows = []
+    start = 0
+    while True:
+        end = min(start + max_tokens, num_tokens)
+        windows.append((start, end))
+        if end == num_tokens:
+            return windows
+        start += stride
+
+
+def _context_score(window, position):
+    start, end = window
+    return min(position - start, end - 1 - position) + 0.01 * (end - start)
+
+
+def get_prediction_mask(windows, window_index, head_positions):
+    """
+    1 for the WordPieces of window `window_index` that predict their original token: head WordPieces (given as
+    positions in the whole sentence) for which no other window has more context.
+    """
+    window = windows[window_index]
+    mask = []
+    for position in range(*window):
+        if position not in head_positions:
+            mask.append(0)
+            continue
+        score = _context_score(window, position)
+        is_max_context = all(
+            _context_score(other, position) <= score if i > window_index else _context_score(other, position) < score
+            for i, other in enumerate(windows) if i != window_index and other[0] <= position < other[1])
+        mask.append(int(is_max_context))
+    return mask
+
+
+def merge_window_predictions(all_features, all_predictions):
+    """
+    Collect the predictions of all windows by example; `all_predictions` has one prediction for each of the
+    `head_positions` of each feature. Returns a dict from example index to the list of (orig_index, prediction) of
+    the original tokens of that example, in order.
+    """
+    merged = defaultdict(dict)
+    for features, predictions in zip(all_features, all_predictions):
+        merged[features.example_index].update(zip(features.head_orig_indices.tolist(), predictions))
+    return {example_index: sorted(token_predictions.items()) for example_index, token_predictions in merged.items()}
@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig, BertModel
+
+from scripts.activation_checkpointing import CheckpointedEncoder, enable_activation_checkpointing
+from scripts.packing import encode
+
+
+class ActivationCheckpointingTestCase(TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size_or_config_json_file=60, hidden_size=32, num_hidden_layers=3,
+                            num_attention_heads=2, intermediate_size=37, max_position_embeddings=16)
+        self.bert = BertModel(config).eval()
+        self.input_ids = torch.randint(1, 60, (3, 12))
+        self.attention_mask = torch.tensor([[1] * 12, [1] * 5 + [2] * 7, [1] * 9 + [0] * 3])
+
+    def _gradients(self):
+        self.bert.zero_grad()
+        output = encode(self.bert, self.input_ids, attention_mask=self.attention_mask, packed=True)
+        output.sum().backward()
+        return output.detach(), {name: parameter.grad.clone() for name, parameter in self.bert.named_parameters()
+                                 if parameter.grad is not None}
+
+    def test_same_outputs_and_gradients(self):
+        expected_output, expected_gradients = self._gradients()
+        keys = list(self.bert.state_dict())
+        for every in [1, 2, 3]:
+            enable_activation_checkpointing(self.bert, every)
+            self.assertIsInstance(self.bert.encoder, CheckpointedEncoder)
+            self.assertEqual(list(self.bert.state_dict()), keys)
+            output, gradients = self._gradients()
+            self.assertTrue(torch.allclose(output, expected_output, atol=1e-6))
+            self.assertEqual(gradients.keys(), expected_gradients.keys())
+            for name, gradient in gradients.items():
+                self.assertTrue(torch.allclose(gradient, expected_gradients[name], atol=1e-5), name)
+
+    def test_gradients_without_input_gradients(self):
+        # As for the cached outputs of frozen layers, the input of the first segment requires no gradient
+        enable_activation_checkpointing(self.bert, 2)
+        hidden_states = torch.randn(3, 12, 32)
+        extended_attention_mask = torch.zeros(3, 1, 1, 12)
+        self.bert.encoder(hidden_states, extended_attention_mask, output_all_encoded_layers=False)[-1].sum().backward()
+        for parameter in self.bert.encoder.layer.parameters():
+            self.assertIsNotNone(parameter.grad)
+        self.assertIsNone(hidden_states.grad)
+
+    def test_disabled(self):
+        encoder = self.bert.encoder
+        enable_activation_checkpointing(self.bert, 0)
+        self.assertIs(self.bert.encoder, encoder)
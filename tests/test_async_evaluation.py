@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import torch
+
+from scripts.async_evaluation import AsyncEvaluator
+
+
+def _evaluate(model, device):
+    if float(model.bias) < 0:
+        raise ValueError("cannot evaluate")
+    return float(model.weight.sum()), device.type
+
+
+def _make_model():
+    return torch.nn.Linear(2, 1)
+
+
+def _predict(model, device):
+    inputs = torch.linspace(-1, 1, 8, dtype=torch.float64, device=device).view(4, 2)
+    with torch.no_grad():
+        return model(inputs).tolist(), str(next(model.parameters()).dtype)
+
+
+def _make_double_model():
+    return torch.nn.Linear(2, 1).double()
+
+
+class AsyncEvaluationTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def _snapshot(self, epoch, weight, bias=0.0):
+        model = _make_model()
+        with torch.no_grad():
+            model.weight.fill_(weight)
+            model.bias.fill_(bias)
+        path = os.path.join(self.directory, "snapshot-{}.bin".format(epoch))
+        torch.save(model.state_dict(), path)
+        return path
+
+    def test_results_in_order(self):
+        evaluator = AsyncEvaluator(_evaluate, _make_model)
+        paths = [self._snapshot(epoch, epoch) for epoch in range(3)]
+        for epoch, path in enumerate(paths):
+            evaluator.submit(epoch, 10 * epoch, path)
+        results = evaluator.close()
+        self.assertEqual(results, [(epoch, 10 * epoch, (2.0 * epoch, "cpu"), path)
+                                   for epoch, path in enumerate(paths)])
+
+    def test_poll_and_close(self):
+        evaluator = AsyncEvaluator(_evaluate, _make_model)
+        self.assertEqual(evaluator.poll(), [])
+        evaluator.submit(0, 0, self._snapshot(0, 1.0))
+        polled = []
+        deadline = time.time() + 30
+        while not polled and time.time() < deadline:
+            polled = evaluator.poll()
+            time.sleep(0.01)
+        self.assertEqual([result[:3] for result in polled], [(0, 0, (2.0, "cpu"))])
+        evaluator.submit(1, 5, self._snapshot(1, 1.0, bias=-1.0))
+        self.assertEqual([result[:3] for result in evaluator.close()], [(1, 5, None)])
+
+    def test_same_results_as_synchronous_evaluation(self):
+        model = _make_double_model()
+        with torch.no_grad():
+            model.weight.copy_(torch.tensor([[0.1, -1.0 / 3]], dtype=torch.float64))
+        path = os.path.join(self.directory, "snapshot-0.bin")
+        torch.save(model.state_dict(), path)
+        evaluator = AsyncEvaluator(_predict, _make_double_model, torch.device("cpu"))
+        evaluator.submit(0, 0, path)
+        self.assertEqual(evaluator.close(), [(0, 0, _predict(model, torch.device("cpu")), path)])
@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+import torch
+from torch.utils.data import DataLoader, TensorDataset, SequentialSampler, RandomSampler
+from torch.utils.data.distributed import DistributedSampler
+
+from scripts.batching import (LengthBucketBatchSampler, SeededRandomSampler, count_optimization_steps, trim_batch,
+                              dynamic_padding_collate)
+
+
+class BatchingTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.lengths = [3, 10, 5, 7, 2, 9, 4, 8, 6, 1]
+        input_mask = torch.zeros(len(self.lengths), 12, dtype=torch.long)
+        for i, length in enumerate(self.lengths):
+            input_mask[i, :length] = 1
+        input_ids = input_mask * 5
+        labels = torch.arange(len(self.lengths))
+        self.data = TensorDataset(input_ids, input_mask, labels)
+
+    def test_every_index_once(self):
+        sampler = LengthBucketBatchSampler(RandomSampler(self.data), self.lengths, batch_size=3)
+        indices = [index for batch in sampler for index in batch]
+        self.assertEqual(sorted(indices), list(range(len(self.lengths))))
+        self.assertEqual(len(sampler), 4)
+
+    def test_seeded_sampling_leaves_global_rng_alone(self):
+        sampler = LengthBucketBatchSampler(SeededRandomSampler(self.data, seed=1), self.lengths, batch_size=3, seed=1)
+        state = torch.get_rng_state()
+        first, second = list(sampler), list(sampler)
+        self.assertTrue(torch.equal(torch.get_rng_state(), state))
+        self.assertNotEqual(first, second)
+        sampler.set_epoch(0)
+        self.assertEqual(list(sampler), first)
+
+    def test_batches_are_sorted_by_length(self):
+        sampler = LengthBucketBatchSampler(SequentialSampler(self.data), self.lengths, batch_size=2)
+        for batch in sampler:
+            self.assertLessEqual(abs(self.lengths[batch[0]] - self.lengths[batch[1]]), 1)
+
+    def test_max_tokens(self):
+        sampler = LengthBucketBatchSampler(SequentialSampler(self.data), self.lengths, batch_size=10, max_tokens=12)
+        for batch in sampler:
+            if len(batch) > 1:
+                self.assertLessEqual(len(batch) * max(self.lengths[i] for i in batch), 12)
+        self.assertEqual(sorted(i for batch in sampler for i in batch), list(range(len(self.lengths))))
+
+    def test_num_batches_with_max_tokens(self):
+        for sampler in [SeededRandomSampler(self.data, seed=1), DistributedSampler(self.data, num_replicas=2, rank=1)]:
+            batch_sampler = LengthBucketBatchSampler(sampler, self.lengths, batch_size=3, max_tokens=14, bucket_size=1,
+                                                     seed=1)
+            counts = [batch_sampler.num_batches(epoch) for epoch in range(4)]
+            self.assertEqual(sampler.epoch, 0)
+            for epoch, count in enumerate(counts):
+                batch_sampler.set_epoch(epoch)
+                self.assertEqual(len(batch_sampler), count)
+                self.assertEqual(len(list(batch_sampler)), count)
+            dataloader = DataLoader(self.data, batch_sampler=batch_sampler)
+            self.assertEqual(count_optimization_steps(dataloader, 4, 2), sum(count // 2 for count in counts))
+
+    def test_trim_batch(self):
+        batch = dynamic_padding_collate([self.data[0], self.data[2], self.data[4]])
+        input_ids, input_mask, labels = batch
+        self.assertEqual(tuple(input_ids.shape), (3, 5))
+        self.assertEqual(tuple(input_mask.shape), (3, 5))
+        self.assertEqual(labels.tolist(), [0, 2, 4])
+        self.assertEqual(int(input_mask.sum()), 3 + 5 + 2)
+
+    def test_trim_full_batch_is_noop(self):
+        batch = tuple(t[:, :10] if t.dim() > 1 else t for t in self.data.tensors)
+        self.assertIs(trim_batch(batch), batch)
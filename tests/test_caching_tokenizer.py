@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pytorch_pretrained_bert import BertTokenizer
+
+from scripts.caching_tokenizer import CachingTokenizer, load_bert_tokenizer
+
+
+class CachingTokenizerTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.vocab_file = os.path.join(self.directory, "vocab.txt")
+        with open(self.vocab_file, "w") as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "un", "##aff", "##able", "berlin", "##er", ","]))
+        self.tokenizer = BertTokenizer(self.vocab_file, do_lower_case=True)
+        self.words = ["unaffable", "Berliner", "berlin,", "xyz", "unaffable", "Berliner", "unable"] * 3
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_same_output(self):
+        caching_tokenizer = CachingTokenizer(self.tokenizer, max_size=2)
+        for word in self.words:
+            self.assertEqual(caching_tokenizer.tokenize(word), self.tokenizer.tokenize(word))
+        self.assertEqual(caching_tokenizer.hits, 0)
+        caching_tokenizer.tokenize("unable")
+        self.assertEqual(caching_tokenizer.hits, 1)
+        self.assertEqual(len(caching_tokenizer._cache), 2)
+        self.assertEqual(caching_tokenizer.convert_tokens_to_ids(["un"]), [4])
+
+    def test_table(self):
+        table_file = os.path.join(self.directory, "wordpieces.pkl")
+        caching_tokenizer = CachingTokenizer(self.tokenizer, table_file=table_file)
+        for word in self.words:
+            caching_tokenizer.tokenize(word)
+        caching_tokenizer.save()
+        loaded = CachingTokenizer(self.tokenizer, table_file=table_file)
+        for word in set(self.words):
+            self.assertEqual(loaded.tokenize(word), self.tokenizer.tokenize(word))
+        self.assertEqual(loaded.misses, 0)
+
+        with open(self.vocab_file, "a") as f:
+            f.write("\nnew")
+        other = CachingTokenizer(BertTokenizer(self.vocab_file), table_file=table_file)
+        other.tokenize("unaffable")
+        self.assertEqual(other.misses, 1)
+
+    def test_pickled_tokenizer(self):
+        cache_dir = os.path.join(self.directory, "tokenizers")
+        tokenizer = load_bert_tokenizer(self.vocab_file, do_lower_case=True, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        loaded = load_bert_tokenizer(self.vocab_file, do_lower_case=True, cache_dir=cache_dir)
+        self.assertIsNot(loaded, tokenizer)
+        self.assertEqual(loaded.vocab, tokenizer.vocab)
+        for word in set(self.words):
+            self.assertEqual(loaded.tokenize(word), self.tokenizer.tokenize(word))
+
+        load_bert_tokenizer(self.vocab_file, do_lower_case=False, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        with open(self.vocab_file, "a") as f:
+            f.write("\nnew")
+        changed = load_bert_tokenizer(self.vocab_file, do_lower_case=True, cache_dir=cache_dir)
+        self.assertIn("new", changed.vocab)
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+    def test_missing_vocabulary(self):
+        cache_dir = os.path.join(self.directory, "tokenizers")
+        with self.assertRaises(EnvironmentError):
+            load_bert_tokenizer(os.path.join(self.directory, "missing.txt"), do_lower_case=True, cache_dir=cache_dir)
+        self.assertFalse(os.path.exists(cache_dir))
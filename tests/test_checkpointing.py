@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from scripts.batching import SeededRandomSampler
+from scripts.checkpointing import CheckpointManager, get_rng_state, set_rng_state
+from scripts.scheduling import StreamScheduler
+
+
+class CheckpointingTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_keep_last_and_best(self):
+        checkpoints = CheckpointManager(self.directory, keep=2)
+        weight = torch.zeros(2)
+        for global_step, f1 in [(1, 50.0), (2, 70.0), (3, 60.0), (4, None), (5, 65.0)]:
+            weight += 1  # the saved copy must not change afterwards
+            checkpoints.save({"weight": weight, "global_step": global_step}, global_step, f1)
+        checkpoints.wait()
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if name.endswith(".pt")),
+                         ["checkpoint-2.pt", "checkpoint-4.pt", "checkpoint-5.pt"])
+        self.assertEqual(checkpoints.index["best"], "checkpoint-2.pt")
+        checkpoints.close()
+        latest = CheckpointManager(self.directory).load_latest()
+        self.assertEqual(latest["global_step"], 5)
+        self.assertEqual(latest["weight"].tolist(), [5.0, 5.0])
+
+    def test_rng_state(self):
+        state = get_rng_state()
+        expected = torch.rand(3)
+        set_rng_state(state)
+        self.assertTrue(torch.equal(torch.rand(3), expected))
+
+    def test_resume_in_the_middle_of_streams(self):
+        def make_scheduler():
+            train = DataLoader(TensorDataset(torch.arange(12)), sampler=SeededRandomSampler(range(12), 1),
+                               batch_size=2)
+            other = DataLoader(TensorDataset(torch.arange(5)), sampler=SeededRandomSampler(range(5), 2),
+                               batch_size=2)
+            return StreamScheduler(train, {"other": (other, 1.5)})
+
+        def flatten(step):
+            batch, streams = step
+            return batch[0].tolist(), [b[0].tolist() for b in streams["other"]]
+
+        scheduler = make_scheduler()
+        expected = [flatten(step) for epoch in range(2) for step in scheduler.epoch(epoch)]
+        scheduler = make_scheduler()
+        for step_number, step in enumerate(scheduler.epoch(0)):
+            if step_number == 3:
+                break
+        state = scheduler.state_dict()
+        resumed = make_scheduler()
+        resumed.load_state_dict(state)
+        steps = [flatten(step) for step in resumed.epoch(0, 4)] + [flatten(step) for step in resumed.epoch(1)]
+        self.assertEqual(steps, expected[4:])
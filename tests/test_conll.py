@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from copy import deepcopy
+from unittest import TestCase
+
+from scripts.conll import CoNLL2003Dataset, CoNLLCorpus
+
+CONLL = """-DOCSTART- -X- -X- O
+
+EU NNP B-NP B-ORG
+rejects VBZ B-VP O
+German JJ B-NP B-MISC
+
+Peter NNP B-NP B-PER
+Blackburn NNP I-NP I-PER
+
+-DOCSTART- -X- -X- O
+
+EU NNP B-NP B-ORG
+B-LOC
+"""
+
+
+class CoNLL2003DatasetTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, "sample.conll")
+        with open(self.filepath, "w", encoding="utf-8") as f:
+            f.write(CONLL)
+        self.dataset = CoNLL2003Dataset(self.filepath)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_documents(self):
+        self.assertEqual(list(self.dataset.documents), [
+            [[("EU", "B-ORG"), ("rejects", "O"), ("German", "B-MISC")],
+             [("Peter", "B-PER"), ("Blackburn", "I-PER")]],
+            [[("EU", "B-ORG"), (None, "B-LOC")]],
+        ])
+        self.assertEqual(self.dataset.documents[-1], [[("EU", "B-ORG"), (None, "B-LOC")]])
+        self.assertEqual(self.dataset.corpus.tokens, ["EU", "rejects", "German", "Peter", "Blackburn"])
+
+    def test_read_sentences(self):
+        expected = list(CoNLLCorpus.read(self.filepath).iter_sentences())
+        self.assertEqual(len(expected), 3)
+        for chunk_lines in [1, 2, 10000]:
+            self.assertEqual(list(CoNLLCorpus.read_sentences(self.filepath, chunk_lines)), expected)
+
+    def test_statistics(self):
+        self.assertEqual(self.dataset.get_num_documents(), 2)
+        self.assertEqual(self.dataset.get_num_sentences(), 3)
+        self.assertEqual(self.dataset.get_num_tokens(), 7)
+        self.assertEqual(self.dataset.get_vocabulary_size(), 6)
+        self.assertEqual(self.dataset.get_sentence_lengths(), [3, 2, 2])
+        self.assertEqual(self.dataset.get_document_token_counts(), [5, 2])
+        self.assertEqual(self.dataset.get_raw_class_sizes()["B-ORG"], 2)
+        self.assertEqual(self.dataset.get_classes(), ["LOC", "MISC", "O", "ORG", "PER"])
+        classes, frequencies = self.dataset.get_unigram_distribution()
+        self.assertEqual(classes[0], "B-LOC")
+        self.assertAlmostEqual(sum(frequencies), 1)
+
+    def test_assign_documents(self):
+        subset = deepcopy(self.dataset)
+        sentence = self.dataset.documents[0][1]
+        subset.documents = [[sentence]]
+        self.assertEqual(list(subset.documents), [[sentence]])
+        self.assertEqual(str(subset), "-DOCSTART- O\n\nPeter\tB-PER\nBlackburn\tI-PER\n\n")
+        self.assertEqual(self.dataset.get_num_sentences(), 3)
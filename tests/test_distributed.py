@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+from unittest import TestCase
+
+import torch
+
+from scripts.batching import SeededRandomSampler
+from scripts.distributed import broadcast_flag, distribute_model, get_sampler, gradient_sync
+
+
+class _Model(torch.nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(2, 1)
+
+    def forward(self, inputs):
+        return self.linear(inputs).sum()
+
+
+def _accumulate(rank, world_size, port, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.distributed.init_process_group("gloo", rank=rank, world_size=world_size)
+    torch.manual_seed(rank)  # DDP starts from the weights of rank 0
+    model = distribute_model(_Model(), torch.device("cpu"))
+    inputs = torch.full((1, 2), float(rank + 1))
+    with gradient_sync(model, sync=False):
+        model(inputs).backward()
+    local_gradient = model.module.linear.weight.grad.clone()
+    with gradient_sync(model, sync=True):
+        model(inputs).backward()
+    results.put((rank, local_gradient.tolist(), model.module.linear.weight.grad.tolist(),
+                 model.module.linear.weight.tolist(), broadcast_flag(rank == 0)))
+    torch.distributed.destroy_process_group()
+
+
+class DistributedTestCase(TestCase):
+
+    def test_single_process(self):
+        model = _Model()
+        with gradient_sync(model, sync=False):
+            model(torch.ones(1, 2)).backward()
+        self.assertEqual(model.linear.weight.grad.tolist(), [[1.0, 1.0]])
+        self.assertIsInstance(get_sampler(list(range(4)), 42), SeededRandomSampler)
+        self.assertTrue(broadcast_flag(True))
+
+    def test_gradient_accumulation_without_sync(self):
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        processes = [context.Process(target=_accumulate, args=(rank, 2, 29531, results)) for rank in range(2)]
+        for process in processes:
+            process.start()
+        outputs = sorted(results.get(timeout=120) for _ in processes)
+        for process in processes:
+            process.join()
+
+        (_, local_0, synced_0, weight_0, stop_0), (_, local_1, synced_1, weight_1, stop_1) = outputs
+        # Without sync, every process keeps its own gradient; the synced pass averages the accumulated gradients
+        self.assertEqual(local_0, [[1.0, 1.0]])
+        self.assertEqual(local_1, [[2.0, 2.0]])
+        self.assertEqual(synced_0, [[3.0, 3.0]])
+        self.assertEqual(synced_1, [[3.0, 3.0]])
+        self.assertEqual(weight_0, weight_1)
+        self.assertTrue(stop_0 and stop_1)
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from unittest import TestCase
+
+from scripts.feature_cache import FeatureCache, file_lock
+from test_feature_store import _Features
+
+
+class _Tokenizer(object):
+
+    def __init__(self, tokens):
+        self.vocab = OrderedDict((token, i) for i, token in enumerate(tokens))
+
+
+class FeatureCacheTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.cache = FeatureCache(os.path.join(self.directory, "cache"))
+        self.input_file = os.path.join(self.directory, "train.txt")
+        with open(self.input_file, "w") as f:
+            f.write("EU B-ORG\n")
+        self.tokenizer = _Tokenizer(["[PAD]", "[CLS]", "[SEP]", "eu"])
+        self.calls = 0
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def _build(self):
+        self.calls += 1
+        return [_Features(1000, [1, 3, 2], [1, 1, 1], [0, 1, 0])]
+
+    def _key(self, **kwargs):
+        return self.cache.key("test", [self.input_file], self.tokenizer, True, 8, ["O", "B-ORG"], **kwargs)
+
+    def test_builds_once(self):
+        key = self._key()
+        first = self.cache.get_or_create(key, self._build)
+        second = self.cache.get_or_create(key, self._build)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(first[0].input_ids, second[0].input_ids)
+
+    def test_key_depends_on_inputs(self):
+        key = self._key()
+        self.assertEqual(key, self._key())
+        self.assertNotEqual(key, self._key(languages=["en"]))
+        self.assertNotEqual(key, self.cache.key("test", [self.input_file], self.tokenizer, False, 8))
+        self.assertNotEqual(key, self.cache.key("test", [self.input_file], _Tokenizer(["[PAD]"]), True, 8,
+                                                ["O", "B-ORG"]))
+        with open(self.input_file, "a") as f:
+            f.write("\n")
+        self.assertNotEqual(key, self._key())
+
+    def test_eviction(self):
+        self.cache.max_size = 1
+        first_key = self._key()
+        self.cache.get_or_create(first_key, self._build)
+        second_key = self._key(languages=["en"])
+        self.cache.get_or_create(second_key, self._build)
+        cache_dir = self.cache.cache_dir
+        entries = [name for name in os.listdir(cache_dir) if os.path.isdir(os.path.join(cache_dir, name))]
+        self.assertEqual(entries, [second_key])
+
+    def test_eviction_waits_for_readers(self):
+        key = self._key()
+        self.cache.get_or_create(key, self._build)
+        path = os.path.join(self.cache.cache_dir, key)
+        self.cache.max_size = 1
+        with file_lock(path + ".lock", shared=True):
+            thread = threading.Thread(target=self.cache.evict)
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            self.assertTrue(os.path.isdir(path))
+        thread.join()
+        self.assertFalse(os.path.isdir(path))
@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from scripts.feature_store import ColumnarFeatures
+
+
+class _Features(object):
+
+    def __init__(self, unique_id, input_ids, loss_mask, label_ids, max_seq_length=8):
+        length = len(input_ids)
+        padding = [0] * (max_seq_length - length)
+        self.unique_id = unique_id
+        self.example_index = unique_id - 1000
+        self.token_to_orig_map = {i: i - 1 for i in range(1, length - 1)}
+        self.input_ids = input_ids + padding
+        self.input_mask = [1] * length + padding
+        self.loss_mask = loss_mask + padding
+        self.segment_ids = [0] * max_seq_length
+        self.label_ids = label_ids + padding if label_ids is not None else None
+
+
+class ColumnarFeaturesTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.features = [
+            _Features(1000, [2, 10, 11, 3], [1, 1, 0, 1], [0, 1, 2, 0]),
+            _Features(1001, [2, 12, 3], [1, 1, 1], [0, 3, 0]),
+            _Features(1002, [2, 13, 14, 15, 16, 3], [1, 1, 1, 0, 1, 1], [0, 0, 0, 0, 4, 0]),
+        ]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def _assert_same_items(self, columnar):
+        dataset = columnar.to_dataset(8)
+        self.assertEqual(len(dataset), len(self.features))
+        for f, (input_ids, input_mask, loss_mask, segment_ids, label_ids) in zip(self.features, dataset):
+            self.assertEqual(input_ids.tolist(), f.input_ids)
+            self.assertEqual(input_mask.tolist(), f.input_mask)
+            self.assertEqual(loss_mask.tolist(), f.loss_mask)
+            self.assertEqual(segment_ids.tolist(), f.segment_ids)
+            self.assertEqual(label_ids.tolist(), f.label_ids)
+
+    def test_roundtrip(self):
+        columnar = ColumnarFeatures.from_features(self.features)
+        self._assert_same_items(columnar)
+        columnar.save(self.directory)
+        loaded = ColumnarFeatures.load(self.directory)
+        self._assert_same_items(loaded)
+        self.assertEqual(loaded.lengths.tolist(), [4, 3, 6])
+
+    def test_views(self):
+        columnar = ColumnarFeatures.from_features(self.features)
+        for f, view in zip(self.features, columnar):
+            self.assertEqual(view.unique_id, f.unique_id)
+            self.assertEqual(view.example_index, f.example_index)
+            self.assertEqual(view.token_to_orig_map, f.token_to_orig_map)
+
+    def test_unsupervised(self):
+        for f in self.features:
+            f.label_ids = None
+        columnar = ColumnarFeatures.from_features(self.features)
+        self.assertNotIn("label_ids", columnar.columns)
+        item = columnar.to_dataset(labels=False, example_indices=True)[2]
+        self.assertEqual(len(item), 5)
+        self.assertEqual(item[0].shape[0], 6)
+        self.assertEqual(int(item[-1]), 2)
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from unittest import TestCase
+
+from pytorch_pretrained_bert import BertTokenizer
+
+from scripts.featurization import Featurizer, convert_examples_to_columns
+from test_feature_store import _Features
+
+_Example = namedtuple("_Example", ["tokens", "labels"])
+
+
+class _LabelVocab(object):
+    labels = ["O", "B-LOC", "I-LOC"]
+
+    def convert_labels_to_ids(self, labels):
+        return [self.labels.index(label) for label in labels]
+
+
+def _convert(examples, tokenizer, max_seq_length, start_index=0):
+    return [_Features(1000 + index, [2] + [tokenizer[token] for token in tokens] + [3], [1] * (len(tokens) + 2),
+                      None, max_seq_length)
+            for index, tokens in enumerate(examples, start_index)]
+
+
+class FeaturizerTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.tokenizer = {"a": 10, "b": 11, "c": 12}
+        self.examples = [["a"], ["b", "c"], ["c", "a", "b"], ["a", "a"], ["b"]]
+
+    def test_sharded_output_is_identical(self):
+        single = Featurizer(self.tokenizer).submit(_convert, self.examples, max_seq_length=8).result()
+        featurizer = Featurizer(self.tokenizer, num_workers=2, shard_size=2)
+        first = featurizer.submit(_convert, self.examples, max_seq_length=8)
+        second = featurizer.submit(_convert, self.examples[:3], max_seq_length=8)
+        sharded = first.result()
+        featurizer.close()
+        self.assertEqual(len(second.result()), 3)
+        self.assertEqual(sorted(sharded.columns), sorted(single.columns))
+        for name, column in single.columns.items():
+            self.assertEqual(sharded.columns[name].tolist(), column.tolist())
+        self.assertEqual([view.unique_id for view in sharded], [1000, 1001, 1002, 1003, 1004])
+
+
+class ConvertExamplesToColumnsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        vocab_file = os.path.join(self.directory, "vocab.txt")
+        with open(vocab_file, "w") as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "new", "york", "##er", "in", "un", "##aff"]))
+        self.tokenizer = BertTokenizer(vocab_file, do_lower_case=True)
+        self.examples = [
+            _Example(["New", "Yorker", "in", "unaff"], ["B-LOC", "I-LOC", "O", "O"]),
+            _Example(["in"], ["O"]),
+        ]
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_columns(self):
+        features = convert_examples_to_columns(self.examples, self.tokenizer, 8, _LabelVocab(), start_index=3)
+        columns = features.columns
+        self.assertEqual(columns["offsets"].tolist(), [0, 8, 11])
+        self.assertEqual(columns["input_ids"].tolist(), [2, 4, 5, 6, 7, 8, 9, 3, 2, 7, 3])
+        self.assertEqual(columns["loss_mask"].tolist(), [1, 1, 1, 0, 1, 1, 0, 1, 1, 1, 1])
+        self.assertEqual(columns["label_ids"].tolist(), [0, 1, 2, 2, 0, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(columns["tok_to_orig"].tolist(), [-1, 0, 1, 1, 2, 3, 3, -1, -1, 0, -1])
+        self.assertEqual(columns["prediction_mask"].tolist(), [0, 1, 1, 0, 1, 1, 0, 0, 0, 1, 0])
+        self.assertEqual(columns["example_index"].tolist(), [3, 4])
+        self.assertEqual(columns["unique_id"].tolist(), [1000000003, 1000000004])
+        self.assertEqual(features[0].head_orig_indices.tolist(), [0, 1, 2, 3])
+
+    def test_windows(self):
+        truncated = convert_examples_to_columns(self.examples, self.tokenizer, 5)
+        self.assertEqual(truncated.lengths.tolist(), [5, 3])
+        self.assertNotIn("label_ids", truncated.columns)
+        windows = convert_examples_to_columns(self.examples, self.tokenizer, 5, window_stride=2)
+        self.assertEqual(windows.columns["example_index"].tolist(), [0, 0, 0, 1])
+        self.assertEqual(windows.columns["input_ids"].tolist()[:10], [2, 4, 5, 6, 3, 2, 6, 7, 8, 3])
+        heads = [(view.example_index, orig) for view in windows for orig in view.head_orig_indices.tolist()]
+        self.assertEqual(heads, [(0, 0), (0, 1), (0, 2), (0, 3), (1, 0)])
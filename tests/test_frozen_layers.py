@@ -0,0 +1,68 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig, BertModel
+
+from scripts.batching import dynamic_padding_collate
+from scripts.feature_store import ColumnarFeatures
+from scripts.frozen_layers import FrozenOutputDataset, freeze_layers, get_frozen_outputs
+from scripts.packing import PackedDataset, encode
+
+
+def _columns(lengths):
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return {
+        "offsets": offsets,
+        "input_ids": np.arange(1, offsets[-1] + 1, dtype=np.int32) % 50 + 1,
+        "loss_mask": np.ones(offsets[-1], dtype=np.uint8),
+        "label_ids": np.ones(offsets[-1], dtype=np.int16),
+        "tok_to_orig": np.zeros(offsets[-1], dtype=np.int32),
+        "unique_id": np.arange(len(lengths), dtype=np.int64),
+        "example_index": np.arange(len(lengths), dtype=np.int64),
+    }
+
+
+class FrozenLayersTestCase(TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size_or_config_json_file=60, hidden_size=32, num_hidden_layers=3,
+                            num_attention_heads=2, intermediate_size=37, max_position_embeddings=16)
+        self.bert = BertModel(config).eval()
+        self.features = ColumnarFeatures(_columns([4, 6, 3, 5, 2]))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_freeze_layers(self):
+        freeze_layers(self.bert, 2)
+        trainable = [name for name, parameter in self.bert.named_parameters() if parameter.requires_grad]
+        self.assertFalse(any(name.startswith(("embeddings.", "encoder.layer.0.", "encoder.layer.1."))
+                             for name in trainable))
+        self.assertTrue(any(name.startswith("encoder.layer.2.") for name in trainable))
+        with self.assertRaises(ValueError):
+            freeze_layers(self.bert, 4)
+
+    def test_cached_outputs_match_full_encoding(self):
+        freeze_layers(self.bert, 2)
+        hidden_states = get_frozen_outputs(self.bert, self.features, self.directory, 16, batch_size=2)
+        self.assertEqual(hidden_states.shape, (20, 32))
+        self.assertEqual(hidden_states.dtype, np.float16)
+        # The second call loads the array
+        self.assertTrue(np.array_equal(get_frozen_outputs(self.bert, self.features, self.directory, 16),
+                                       hidden_states))
+
+        for dataset in [self.features.to_dataset(16), PackedDataset(self.features, 16)]:
+            batch = dynamic_padding_collate([item for item in FrozenOutputDataset(dataset, hidden_states)])
+            input_ids, input_mask, _, segment_ids, _, frozen_output = batch
+            self.assertEqual(frozen_output.shape[:2], input_ids.shape)
+            with torch.no_grad():
+                expected = encode(self.bert, input_ids, segment_ids, input_mask,
+                                  packed=isinstance(dataset, PackedDataset))
+                output = encode(self.bert, input_ids, segment_ids, input_mask, frozen_output)
+            real = input_mask > 0
+            self.assertLess(float((output[real] - expected[real]).abs().max()), 1e-2)
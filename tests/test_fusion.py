@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig, BertModel
+
+from scripts.fusion import concatenate_batches, fused_forward, split_logits
+from scripts.packing import encode
+
+
+def _batch(lengths, seq_length, packed=False):
+    input_ids = torch.randint(1, 60, (len(lengths), seq_length))
+    input_mask = torch.zeros(len(lengths), seq_length, dtype=torch.long)
+    for i, length in enumerate(lengths):
+        input_mask[i, :length] = 1
+        if packed:
+            input_mask[i, length // 2:length] = 2
+    input_ids = input_ids * (input_mask > 0).long()
+    return input_ids, input_mask, input_mask.clamp(max=1), torch.zeros_like(input_ids)
+
+
+class FusionTestCase(TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size_or_config_json_file=60, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=37, max_position_embeddings=16)
+        self.bert = BertModel(config).eval()
+        self.batches = [_batch([5, 7], 7, packed=True), _batch([3, 2, 4], 4), _batch([9], 9)]
+
+    def test_concatenate_and_split(self):
+        input_ids, input_mask, loss_mask, segment_ids = concatenate_batches(self.batches)
+        self.assertEqual(input_ids.shape, (6, 9))
+        for batch, part in zip(self.batches, split_logits(input_ids, self.batches)):
+            self.assertTrue(torch.equal(part, batch[0]))
+
+    def test_fused_forward_matches_separate_passes(self):
+        flags = []
+
+        def model(input_ids, segment_ids, input_mask, loss_mask, use_dropout=None):
+            flags.append(use_dropout.tolist())
+            output = encode(self.bert, input_ids, segment_ids, input_mask, packed=True)
+            # As the models of the run scripts apply their dropout
+            return torch.where(use_dropout.view(-1, 1, 1), output, output)
+
+        with torch.no_grad():
+            fused = fused_forward(model, self.batches, use_dropout=[True, False, False])
+            for batch, output in zip(self.batches, fused):
+                input_ids, input_mask, _, segment_ids = batch
+                expected = encode(self.bert, input_ids, segment_ids, input_mask, packed=True)
+                self.assertEqual(output.shape, expected.shape)
+                real = input_mask > 0
+                self.assertLess(float((output[real] - expected[real]).abs().max()), 1e-5)
+        self.assertEqual(flags, [[True, True, False, False, False, False]])
@@ -0,0 +1,49 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import torch
+
+from scripts.metrics import JsonlSink, MetricsWriter
+
+
+class MetricsWriterTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "metrics.jsonl")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_means_are_written_every_n_steps(self):
+        writer = MetricsWriter([JsonlSink(self.path)], flush_every=2)
+        for step in range(5):
+            writer.add_scalar("loss", torch.tensor(float(step), requires_grad=True) * 2)
+            writer.add_scalar("names", torch.tensor([True, step % 2 == 0]).sum())
+            writer.add_scalar("learning_rate", 0.1)
+            writer.step()
+        writer.add_scalar("f1", 0.5, global_step=3)
+        writer.close()
+        with open(self.path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record["step"] for record in records], [2, 4, 3, 5])
+        self.assertEqual([record.get("loss") for record in records], [1.0, 5.0, None, 8.0])
+        self.assertEqual(records[0]["names"], 1.5)
+        self.assertEqual(records[1]["learning_rate"], 0.1)
+        self.assertEqual(records[2]["f1"], 0.5)
+
+    def test_values_are_copied(self):
+        writer = MetricsWriter([JsonlSink(self.path)], flush_every=1)
+        loss = torch.tensor(1.0, requires_grad=True) * 1
+        writer.add_scalar("supervised_loss", loss)
+        loss += 2
+        writer.add_scalar("total_loss", loss)
+        writer.step()
+        writer.close()
+        with open(self.path, encoding="utf-8") as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record["supervised_loss"], 1.0)
+        self.assertEqual(record["total_loss"], 3.0)
@@ -0,0 +1,79 @@
+from unittest import TestCase
+
+import numpy as np
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig, BertModel
+
+from scripts.feature_store import ColumnarFeatures
+from scripts.packing import PackedDataset, encode, pack_lengths
+
+
+def _columns(lengths):
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return {
+        "offsets": offsets,
+        "input_ids": np.arange(1, offsets[-1] + 1, dtype=np.int32) % 50 + 1,
+        "loss_mask": np.ones(offsets[-1], dtype=np.uint8),
+        "label_ids": np.ones(offsets[-1], dtype=np.int16),
+        "tok_to_orig": np.zeros(offsets[-1], dtype=np.int32),
+        "unique_id": np.arange(len(lengths), dtype=np.int64),
+        "example_index": np.arange(len(lengths), dtype=np.int64),
+        "language_id": np.array([0, 1] * (len(lengths) // 2) + [0] * (len(lengths) % 2), dtype=np.int64),
+    }
+
+
+class PackingTestCase(TestCase):
+
+    def test_pack_lengths(self):
+        lengths = [9, 3, 5, 2, 7, 1, 10, 4]
+        packs = pack_lengths(lengths, 10)
+        self.assertEqual(sorted(i for pack in packs for i in pack), list(range(len(lengths))))
+        self.assertTrue(all(sum(lengths[i] for i in pack) <= 10 for pack in packs))
+        self.assertEqual(len(packs), 5)
+        groups = np.array([0, 1, 0, 1, 0, 1, 0, 1])
+        for pack in pack_lengths(lengths, 10, groups):
+            self.assertEqual(len(set(groups[pack])), 1)
+
+    def test_packed_dataset(self):
+        features = ColumnarFeatures(_columns([4, 6, 3, 5, 2]))
+        dataset = PackedDataset(features, 8, labels=False, example_indices=True)
+        self.assertEqual(sum(int((dataset[i][1] > 0).sum()) for i in range(len(dataset))), 20)
+        seen = []
+        for index in range(len(dataset)):
+            input_ids, input_mask, _, _, pack_index = dataset[index]
+            for feature_index, ids in dataset.split_logits(int(pack_index), input_ids):
+                self.assertEqual(ids.tolist(), features.get_column("input_ids", feature_index).tolist())
+                seen.append(feature_index)
+        self.assertEqual(sorted(seen), list(range(5)))
+
+    def test_packed_encoding_matches_separate_encoding(self):
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size_or_config_json_file=60, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=37, max_position_embeddings=16)
+        bert = BertModel(config).eval()
+        features = ColumnarFeatures(_columns([4, 6, 3, 5, 2]))
+        packed = PackedDataset(features, 16, labels=False, example_indices=True)
+        single = features.to_dataset(16, labels=False, example_indices=True)
+        with torch.no_grad():
+            for index in range(len(packed)):
+                input_ids, input_mask, _, segment_ids, _ = (t.unsqueeze(0) for t in packed[index])
+                self.assertGreater(int(input_mask.max()), 1)
+                output = encode(bert, input_ids, segment_ids, input_mask, packed=True)[0]
+                for feature_index, feature_output in packed.split_logits(index, output):
+                    input_ids, input_mask, _, segment_ids, _ = (t.unsqueeze(0) for t in single[feature_index])
+                    expected = encode(bert, input_ids, segment_ids, input_mask)[0][:len(feature_output)]
+                    self.assertTrue(torch.allclose(feature_output, expected, atol=1e-5))
+
+    def test_packed_path_on_unpacked_batches(self):
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size_or_config_json_file=60, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=37, max_position_embeddings=16)
+        bert = BertModel(config).eval()
+        dataset = ColumnarFeatures(_columns([4, 6, 3, 5, 2])).to_dataset(8, labels=False)
+        input_ids, input_mask, _, segment_ids = (torch.stack(column) for column in
+                                                 zip(*[dataset[i] for i in range(len(dataset))]))
+        with torch.no_grad():
+            expected = encode(bert, input_ids, segment_ids, input_mask)
+            output = encode(bert, input_ids, segment_ids, input_mask, packed=True)
+        real = input_mask > 0
+        self.assertTrue(torch.allclose(output[real], expected[real], atol=1e-5))
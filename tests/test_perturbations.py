@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 
 from torch.utils.data import TensorDataset, DataLoader, SequentialSampler
@@ -135,3 +138,28 @@ class PerturbationsTestCase(TestCase):
         perturbed_batch = self.filled_perturbation.perturbe(unsupervised_batch, logits)
         self._print_sentence(unsupervised_batch)
         self._print_sentence(perturbed_batch)
+
+
+class SwapPerturbationTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        vocab_file = os.path.join(self.directory, "vocab.txt")
+        with open(vocab_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "aa", "bb", "cc", "dd"]) + "\n")
+        self.tokenizer = BertTokenizer(vocab_file, do_lower_case=False)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_sequence_that_fills_the_batch(self):
+        # Without dynamic padding, a sequence of max_seq_length tokens ends in the last column of the batch
+        tokens = ["[CLS]", "aa", "bb", "cc", "dd", "[SEP]"]
+        input_ids = torch.tensor([self.tokenizer.convert_tokens_to_ids(tokens)])
+        input_mask = torch.ones_like(input_ids)
+        batch = (input_ids, input_mask, input_mask.clone(), torch.zeros_like(input_ids))
+        perturbation = SwapPerturbation(torch.device("cpu"), self.tokenizer, token_rate=1)
+        perturbed_ids = perturbation.perturbe(batch, None)[0]
+        self.assertEqual(self.tokenizer.convert_ids_to_tokens(perturbed_ids[0].tolist()),
+                         ["[CLS]", "bb", "cc", "dd", "aa", "[SEP]"])
+        self.assertEqual(self.tokenizer.convert_ids_to_tokens(input_ids[0].tolist()), tokens)
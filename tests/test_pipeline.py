@@ -0,0 +1,34 @@
+from unittest import TestCase, skipUnless
+
+import torch
+
+from scripts.pipeline import BatchPipeline, StagedBatch
+from scripts.scheduling import StreamScheduler
+
+
+class BatchPipelineTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.batches = [(torch.arange(6).view(2, 3), torch.ones(2, dtype=torch.uint8)) for _ in range(5)]
+
+    def test_cpu_batches_are_unchanged(self):
+        pipeline = BatchPipeline(torch.device("cpu"))
+        scheduler = StreamScheduler(self.batches, prefetch=2, stage=pipeline.stage)
+        for batch, _ in scheduler.epoch():
+            self.assertNotIsInstance(batch, StagedBatch)
+            self.assertTrue(torch.equal(pipeline.to_device(batch)[0], self.batches[0][0]))
+        self.assertGreaterEqual(scheduler.last_wait, 0)
+
+    @skipUnless(torch.cuda.is_available(), "needs a GPU")
+    def test_staged_batches_reuse_pinned_buffers(self):
+        pipeline = BatchPipeline(torch.device("cuda"))
+        buffers = set()
+        for batch in self.batches:
+            staged = pipeline.stage(batch)
+            self.assertTrue(staged[0].is_pinned())
+            buffers.add(id(staged.buffers))
+            moved = pipeline.to_device(staged)
+            torch.cuda.synchronize()
+            self.assertTrue(torch.equal(moved[0].cpu(), batch[0]))
+            self.assertEqual(moved[1].dtype, torch.uint8)
+        self.assertEqual(len(buffers), 1)
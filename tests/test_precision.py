@@ -0,0 +1,54 @@
+from unittest import TestCase, skipUnless
+
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig, BertModel
+
+from scripts.packing import encode
+from scripts.precision import LossScaler, autocast, check_precision, set_precision
+from scripts.run_ner import BertForNER
+
+
+class PrecisionTestCase(TestCase):
+
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        config = BertConfig(vocab_size_or_config_json_file=60, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=37, max_position_embeddings=16)
+        self.bert = BertModel(config).eval()
+        self.input_ids = torch.randint(1, 60, (3, 12))
+
+    def test_fp32_is_unchanged(self):
+        with torch.no_grad(), autocast(self.bert):
+            output = encode(self.bert, self.input_ids)
+        self.assertEqual(output.dtype, torch.float32)
+
+    @skipUnless(hasattr(torch, "autocast"), "needs torch.autocast")
+    def test_bf16_matches_fp32(self):
+        dtypes = set()
+        self.bert.pooler.dense.register_forward_hook(lambda module, inputs, output: dtypes.add(output.dtype))
+        with torch.no_grad():
+            expected = encode(self.bert, self.input_ids)
+            set_precision(self.bert, "bf16")
+            with autocast(self.bert):
+                output = encode(self.bert, self.input_ids)
+        self.assertEqual(dtypes, {torch.float32, torch.bfloat16})
+        self.assertLess(float((output.float() - expected).abs().max()), 0.1)
+
+    def test_classifier_keeps_its_dtype(self):
+        # As after apex's `model.half()`, the classifier gets the dtype of the model
+        model = BertForNER(self.bert.config, num_labels=3).double().eval()
+        with torch.no_grad():
+            logits = model(self.input_ids, attention_mask=torch.ones_like(self.input_ids))
+        self.assertEqual(logits.dtype, torch.float64)
+
+    def test_loss_scaler_without_scaling(self):
+        weight = torch.nn.Parameter(torch.ones(2))
+        optimizer = torch.optim.SGD([weight], lr=0.5)
+        scaler = LossScaler("bf16")
+        scaler.backward((weight * 2).sum())
+        scaler.step(optimizer)
+        self.assertEqual(weight.tolist(), [0.0, 0.0])
+        with self.assertRaises(ValueError):
+            check_precision("fp16", torch.device("cpu"))
+        with self.assertRaises(ValueError):
+            check_precision("bf16", torch.device("cpu"), fp16=True)
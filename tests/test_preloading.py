@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+from scripts import preloading
+from scripts.featurization import Featurizer
+from scripts.preloading import PreloadComplete, end_of_preloading, preload_only, preloaded
+from scripts.sweep import configurations
+from test_featurization import _convert
+
+
+class PreloadingTestCase(TestCase):
+
+    def tearDown(self) -> None:
+        preloading._resources.clear()
+
+    def test_loaded_once(self):
+        calls = []
+        for _ in range(2):
+            value = preloaded(("test", 1), lambda: calls.append(1) or [len(calls)])
+        self.assertEqual(value, [1])
+        self.assertEqual(len(calls), 1)
+
+    def test_end_of_preloading(self):
+        end_of_preloading()
+        with preload_only():
+            with self.assertRaises(PreloadComplete):
+                end_of_preloading()
+        end_of_preloading()
+
+    def test_featurization_is_shared(self):
+        tokenizer = {"a": 10, "b": 11}
+        examples = [["a"], ["b", "a"]]
+        first = Featurizer(tokenizer).submit(_convert, examples, key="features-key", max_seq_length=8)
+        second = Featurizer(tokenizer).submit(_convert, examples, key="features-key", max_seq_length=8)
+        self.assertIs(first, second)
+        self.assertIs(first.result(), second.result())
+
+    def test_sweep_configurations(self):
+        self.assertEqual(configurations([["seed", "1", "2"], ["perturbation", "mask/0.1"]]), [
+            ("seed=1,perturbation=mask_0.1", ["--seed", "1", "--perturbation", "mask/0.1"]),
+            ("seed=2,perturbation=mask_0.1", ["--seed", "2", "--perturbation", "mask/0.1"]),
+        ])
+        self.assertEqual(configurations([]), [("default", [])])
@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from scripts.scheduling import CyclingStream, StreamScheduler
+
+
+class _Failing:
+
+    def __iter__(self):
+        yield 0
+        raise RuntimeError("broken batch")
+
+
+class SchedulingTestCase(TestCase):
+
+    def test_cycling_stream(self):
+        stream = CyclingStream("numbers", [1, 2, 3])
+        self.assertEqual([next(stream) for _ in range(7)], [1, 2, 3, 1, 2, 3, 1])
+        self.assertEqual(stream.epoch, 2)
+        self.assertEqual(stream.num_batches, 7)
+        with self.assertRaises(ValueError):
+            next(CyclingStream("empty", []))
+
+    def test_passes_are_sampler_epochs(self):
+        data = list(range(16))
+        sampler = DistributedSampler(data, num_replicas=2, rank=0)
+        stream = CyclingStream("distributed", DataLoader(data, sampler=sampler, batch_size=8))
+        passes = [next(stream).tolist() for _ in range(3)]
+        self.assertEqual(stream.epoch, 2)
+        self.assertEqual(sampler.epoch, 2)
+        expected = []
+        for epoch in range(3):
+            sampler.set_epoch(epoch)
+            expected.append(list(sampler))
+        self.assertEqual(passes, expected)
+        self.assertNotEqual(passes[0], passes[1])
+
+    def test_ratios_and_persistent_streams(self):
+        for prefetch in [0, 2]:
+            scheduler = StreamScheduler(["a", "b", "c", "d"], {"half": ([1, 2, 3], 0.5), "double": ([4, 5, 6], 2)},
+                                        prefetch=prefetch)
+            steps = list(scheduler.epoch()) + list(scheduler.epoch())
+            self.assertEqual([batch for batch, _ in steps], ["a", "b", "c", "d"] * 2)
+            self.assertEqual([streams["half"] for _, streams in steps], [[], [1], [], [2], [], [3], [], [1]])
+            self.assertEqual(sum(len(streams["double"]) for _, streams in steps), 16)
+            self.assertEqual(scheduler.streams["double"].epoch, 5)
+
+    def test_stopping_early_and_errors(self):
+        scheduler = StreamScheduler(list(range(100)), {"other": (list(range(3)), 1)}, prefetch=2)
+        for step, (batch, _) in enumerate(scheduler.epoch()):
+            if step == 5:
+                break
+        # The background thread stops and the next epoch continues where the streams were
+        batch, streams = next(iter(scheduler.epoch()))
+        self.assertEqual(batch, 0)
+        self.assertIn(streams["other"][0], range(3))
+        with self.assertRaises(RuntimeError):
+            list(StreamScheduler(_Failing()).epoch())
@@ -0,0 +1,37 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from scripts.startup_profile import StartupProfile, process_age
+
+
+class StartupProfileTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.directory, "startup_profile.json")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_laps(self):
+        profile = StartupProfile(True, self.output_file)
+        profile.lap("tokenizer load")
+        profile.lap("model load")
+        profile.lap("tokenizer load")
+        profile.report()
+        profile.lap("after the report")
+        with open(self.output_file) as f:
+            laps = json.load(f)
+        self.assertEqual(list(laps), ["imports", "tokenizer load", "model load"])
+        self.assertGreater(laps["imports"], 0)
+        self.assertLessEqual(laps["imports"], process_age())
+
+    def test_disabled(self):
+        profile = StartupProfile(False, self.output_file)
+        profile.lap("tokenizer load")
+        profile.report()
+        self.assertEqual(profile.laps, {})
+        self.assertFalse(os.path.exists(self.output_file))
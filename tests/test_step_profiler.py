@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, skipUnless
+
+import torch
+
+from scripts import step_profiler
+from scripts.step_profiler import StepProfiler, check_profile_trace, phase
+
+
+class StepProfilerTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        step_profiler._active = None
+        shutil.rmtree(self.directory)
+
+    def _train(self, profiler, num_steps):
+        for _ in profiler.batches(range(num_steps)):
+            with phase("forward"):
+                with phase("tsa"):
+                    time.sleep(0.002)
+                time.sleep(0.002)
+            with phase("backward"):
+                torch.ones(2, requires_grad=True).sum().backward()
+
+    def test_disabled(self):
+        profiler = StepProfiler(False, self.directory)
+        batches = [1, 2]
+        self.assertIs(profiler.batches(batches), batches)
+        self.assertIs(phase("forward"), phase("backward"))
+        self._train(profiler, 2)
+        profiler.epoch_summary(0)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "profile")))
+
+    def test_epoch_summary(self):
+        profiler = StepProfiler(True, self.directory)
+        self._train(profiler, 3)
+        profiler.epoch_summary(0)
+        self._train(profiler, 2)
+        profiler.epoch_summary(1)
+        profiler.close()
+        self.assertIs(phase("forward"), phase("backward"))
+
+        with open(os.path.join(self.directory, "profile", "summary.jsonl")) as f:
+            first, second = [json.loads(line) for line in f]
+        self.assertEqual((first["epoch"], first["steps"], second["steps"]), (0, 3, 2))
+        self.assertEqual(set(first["phases"]), {"data", "forward", "tsa", "backward"})
+        forward, tsa = first["phases"]["forward"], first["phases"]["tsa"]
+        self.assertEqual(forward["calls"], 3)
+        # The nested phase is not part of the self time of the enclosing one
+        self.assertAlmostEqual(forward["self"], forward["total"] - tsa["total"], places=3)
+        self.assertGreaterEqual(first["step_time"], sum(p["self"] for p in first["phases"].values()))
+
+    @skipUnless(hasattr(torch, "profiler"), "torch.profiler is not available")
+    def test_trace(self):
+        profiler = StepProfiler(True, self.directory, torch.device("cpu"), trace_window=(1, 2))
+        self._train(profiler, 4)
+        profiler.close()
+        with open(os.path.join(self.directory, "profile", "trace.json")) as f:
+            names = {event.get("name") for event in json.load(f)["traceEvents"]}
+        self.assertIn("forward", names)
+        self.assertIn("tsa", names)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "profile", "ops.txt")))
+
+    def test_check_profile_trace(self):
+        check_profile_trace(None)
+        with self.assertRaises(ValueError):
+            check_profile_trace((1, 0))
+        if hasattr(torch, "profiler"):
+            check_profile_trace((1, 2))
+        else:
+            with self.assertRaises(ValueError):
+                check_profile_trace((1, 2))
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import torch
+
+from scripts.streaming import StreamingDataset, get_streaming_batches, read_lines
+
+
+def _featurize(tokens, index):
+    return torch.tensor(int(tokens[0]))
+
+
+class StreamingDatasetTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        for i, (start, end) in enumerate([(0, 30), (30, 45), (45, 50)]):
+            with open(os.path.join(self.directory, "unsup{}.txt".format(i)), "w") as f:
+                f.write("".join("{} token\n\n".format(j) for j in range(start, end)))
+        self.pattern = os.path.join(self.directory, "unsup*.txt")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_single_pass_is_shuffled_permutation(self):
+        dataset = StreamingDataset(self.pattern, read_lines, _featurize, shuffle_buffer_size=10, repeat=False)
+        values = [int(value) for value in dataset]
+        self.assertEqual(sorted(values), list(range(50)))
+        self.assertNotEqual(values, list(range(50)))
+
+    def test_repeats_with_new_order(self):
+        dataset = StreamingDataset(self.pattern, read_lines, _featurize, shuffle_buffer_size=10)
+        batches = get_streaming_batches(dataset, batch_size=25)
+        first_pass = torch.cat([next(batches), next(batches)]).tolist()
+        second_pass = torch.cat([next(batches), next(batches)]).tolist()
+        self.assertEqual(sorted(first_pass), sorted(second_pass))
+        self.assertNotEqual(first_pass, second_pass)
+
+    def test_workers_split_the_stream(self):
+        for num_workers in [2, 4]:
+            dataset = StreamingDataset(self.pattern, read_lines, _featurize, shuffle_buffer_size=10, repeat=False)
+            values = [value for batch in get_streaming_batches(dataset, 8, num_workers=num_workers)
+                      for value in batch.tolist()]
+            self.assertEqual(sorted(values), list(range(50)))
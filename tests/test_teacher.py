@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import torch
+
+from scripts.batching import dynamic_padding_collate
+from scripts.feature_store import ColumnarFeatures
+from scripts.teacher import EmaTeacher, LogitStore
+
+
+class _ConstantTeacher:
+    """Predicts the input id of every WordPiece as the logit of each of its labels."""
+
+    def __init__(self):
+        self.num_calls = 0
+
+    def predict(self, batch):
+        self.num_calls += 1
+        return batch[0].float().unsqueeze(-1).repeat(1, 1, 3)
+
+
+def _features(lengths):
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return ColumnarFeatures({
+        "offsets": offsets,
+        "input_ids": np.arange(1, offsets[-1] + 1, dtype=np.int32),
+        "loss_mask": np.ones(offsets[-1], dtype=np.uint8),
+        "tok_to_orig": np.zeros(offsets[-1], dtype=np.int32),
+        "unique_id": np.arange(len(lengths), dtype=np.int64),
+        "example_index": np.arange(len(lengths), dtype=np.int64),
+    })
+
+
+class TeacherTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.dataset = _features([4, 6, 3, 5]).to_dataset(8, labels=False, example_indices=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_targets_are_cached(self):
+        store = LogitStore(self.dataset, 3, self.directory)
+        teacher = _ConstantTeacher()
+        batch = dynamic_padding_collate([self.dataset[1], self.dataset[2]])
+        targets = store.targets(teacher, batch, step=5)
+        self.assertEqual(targets.shape, (2, 6, 3))
+        self.assertTrue(torch.equal(targets, teacher.predict(batch) * (batch[1] > 0).unsqueeze(-1)))
+        self.assertEqual(teacher.num_calls, 2)
+        store.targets(teacher, batch, step=7)
+        self.assertEqual(teacher.num_calls, 2)
+        self.assertEqual(store.ages([1, 2], 7).tolist(), [2, 2])
+
+    def test_refresh_in_order(self):
+        store = LogitStore(self.dataset, 3, self.directory)
+        teacher = _ConstantTeacher()
+        store.refresh(teacher, 3, num_sentences=3, batch_size=2, device=torch.device("cpu"))
+        self.assertEqual(store.predicted_at.tolist(), [3, 3, 3, -1])
+        store.refresh(teacher, 4, num_sentences=2, batch_size=2, device=torch.device("cpu"))
+        self.assertEqual(store.predicted_at.tolist(), [4, 3, 3, 4])
+        self.assertEqual(store.logits[:4, 0].tolist(), [1, 2, 3, 4])
+
+    def test_ema_update(self):
+        model = torch.nn.Linear(2, 1)
+        teacher = EmaTeacher(model, decay=0.75)
+        with torch.no_grad():
+            model.weight.add_(4.0)
+        expected = teacher.model.weight + 1.0
+        teacher.update(model)
+        self.assertTrue(torch.allclose(teacher.model.weight, expected))
+        self.assertFalse(teacher.model.weight.requires_grad)
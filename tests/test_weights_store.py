@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import torch
+from pytorch_pretrained_bert.modeling import BertConfig, BertForPreTraining, BertForTokenClassification
+
+from scripts import preloading
+from scripts.weights_store import WeightsStore, from_pretrained
+
+
+class WeightsStoreTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.model_dir = os.path.join(self.directory, "model")
+        os.makedirs(self.model_dir)
+        config = BertConfig(vocab_size_or_config_json_file=20, hidden_size=8, num_hidden_layers=1,
+                            num_attention_heads=2, intermediate_size=16, max_position_embeddings=16)
+        with open(os.path.join(self.model_dir, "bert_config.json"), "w") as f:
+            f.write(config.to_json_string())
+        torch.manual_seed(0)
+        self.pretrained = BertForPreTraining(config)
+        torch.save(self.pretrained.state_dict(), os.path.join(self.model_dir, "pytorch_model.bin"))
+        self.store_dir = os.path.join(self.directory, "weights")
+
+    def tearDown(self) -> None:
+        preloading._resources.clear()
+        shutil.rmtree(self.directory)
+
+    def test_weights_are_mapped(self):
+        model = from_pretrained(BertForTokenClassification, self.model_dir, self.store_dir, num_labels=3)
+        expected = self.pretrained.state_dict()
+        for name, tensor in model.bert.state_dict().items():
+            self.assertTrue(torch.equal(tensor, expected["bert." + name]), name)
+        self.assertEqual(model.classifier.out_features, 3)
+
+    def test_entry_is_extracted_once(self):
+        store = WeightsStore(self.store_dir)
+        entry = store.entry(self.model_dir)
+        modified = os.path.getmtime(os.path.join(entry, "weights.bin"))
+        self.assertEqual(WeightsStore(self.store_dir).entry(self.model_dir), entry)
+        self.assertEqual(os.path.getmtime(os.path.join(entry, "weights.bin")), modified)
+        self.assertEqual([name for name in os.listdir(self.store_dir) if name.endswith(".tmp")], [])
+
+    def test_updates_are_private(self):
+        first = from_pretrained(BertForTokenClassification, self.model_dir, self.store_dir, num_labels=3)
+        second = from_pretrained(BertForTokenClassification, self.model_dir, self.store_dir, num_labels=3)
+        weight = first.bert.embeddings.word_embeddings.weight
+        with torch.no_grad():
+            weight.add_(1.0)
+        original = self.pretrained.bert.embeddings.word_embeddings.weight
+        self.assertTrue(torch.equal(second.bert.embeddings.word_embeddings.weight, original))
+        third = from_pretrained(BertForTokenClassification, self.model_dir, self.store_dir, num_labels=3)
+        self.assertTrue(torch.equal(third.bert.embeddings.word_embeddings.weight, original))
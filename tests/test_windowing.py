@@ -0,0 +1,43 @@
+from collections import namedtuple
+from unittest import TestCase
+
+import numpy as np
+
+from scripts.windowing import get_prediction_mask, get_windows, merge_window_predictions
+
+_Window = namedtuple("_Window", ["example_index", "head_orig_indices"])
+
+
+class WindowingTestCase(TestCase):
+
+    def test_windows(self):
+        self.assertEqual(get_windows(5, 4), [(0, 4)])
+        self.assertEqual(get_windows(3, 4, stride=2), [(0, 3)])
+        self.assertEqual(get_windows(10, 4, stride=3), [(0, 4), (3, 7), (6, 10)])
+        self.assertEqual(get_windows(9, 4, stride=3), [(0, 4), (3, 7), (6, 9)])
+        with self.assertRaises(ValueError):
+            get_windows(10, 4, stride=5)
+
+    def test_every_head_is_predicted_once(self):
+        head_positions = {0, 1, 3, 4, 5, 7, 8, 9}  # WordPieces 2 and 6 are tails
+        windows = get_windows(10, 4, stride=2)
+        masks = [get_prediction_mask(windows, i, head_positions) for i in range(len(windows))]
+        predicted = [start + j for (start, _), mask in zip(windows, masks) for j, bit in enumerate(mask) if bit]
+        self.assertEqual(sorted(predicted), sorted(head_positions))
+        # Position 3 has one token of context on both sides in the second window, but none on the right in the first
+        self.assertEqual(masks[0], [1, 1, 0, 0])
+        self.assertEqual(masks[1], [0, 1, 1, 0])
+
+    def test_merge(self):
+        # Original tokens 0-3, the windows overlap on tokens 1 and 2, the second example has a single window
+        features = [
+            _Window(0, np.array([0, 1])),
+            _Window(0, np.array([2, 3])),
+            _Window(1, np.array([0])),
+        ]
+        predictions = [["B-PER", "I-PER"], ["I-PER", "B-LOC"], ["B-ORG"]]
+        merged = merge_window_predictions(features, predictions)
+        self.assertEqual(merged, {
+            0: [(0, "B-PER"), (1, "I-PER"), (2, "I-PER"), (3, "B-LOC")],
+            1: [(0, "B-ORG")],
+        })